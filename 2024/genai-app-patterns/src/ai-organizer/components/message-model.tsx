@@ -27,16 +27,18 @@ const MessageModel = ({ content, loading, uid, notebookId }: MessageModelProps)
   return (
     <div className="flex w-full justify-start pb-5 pr-8">
       <div className="relative max-w-[900px] rounded-2xl bg-[#F7FBFF] p-5 text-sm shadow-md">
-        {loading ? (
+        {loading && !content ? (
           <PulseLoader size={8} />
         ) : (
           <>
-            <MdOutlinePushPin
-              className="absolute right-2 top-2 cursor-pointer rounded-full bg-black/50 p-2"
-              size={40}
-              color="white"
-              onClick={handleClickPin}
-            />
+            {!loading && (
+              <MdOutlinePushPin
+                className="absolute right-2 top-2 cursor-pointer rounded-full bg-black/50 p-2"
+                size={40}
+                color="white"
+                onClick={handleClickPin}
+              />
+            )}
             <ReactMarkdown remarkPlugins={[remarkGfm]} className="markdown">
               {content}
             </ReactMarkdown>
@@ -1,34 +1,104 @@
+'use client';
+
 import { Timestamp } from 'firebase/firestore';
 import Link from 'next/link';
-import { BsThreeDotsVertical } from 'react-icons/bs';
+import { useState } from 'react';
+import { BsThreeDotsVertical, BsTrash } from 'react-icons/bs';
+import PuffLoader from 'react-spinners/PuffLoader';
+
+import { Dialog, DialogContent, DialogDescription, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
+import { DropdownMenu, DropdownMenuContent, DropdownMenuTrigger } from '@/components/ui/dropdown-menu';
+import VisuallyHidden from '@/components/visually-hidden';
+import { auth } from '@/lib/firebase/client-app';
+import { deleteNotebook } from '@/lib/firebase/firestore';
 
 export type Notebook = {
   id: string;
   title: string;
   count: number;
   createdAt: Timestamp;
+  status?: 'deleting';
 };
 
-const NotebookCard = ({ id, title, count, createdAt }: Notebook) => {
-  return (
-    <Link href={`/notebook/${id}`}>
-      <div className="flex size-[224px] flex-col rounded-2xl bg-[#CDD2D9]">
-        <div className="flex h-[106px] justify-between p-3">
-          <div className="flex size-8 items-center justify-center rounded-full bg-white">
-            <p>K</p>
-          </div>
-          <div className="flex size-8 items-center justify-center rounded-full hover:bg-[#C8CFD6] ">
-            <BsThreeDotsVertical size={20} />
-          </div>
-        </div>
-        <p className="line-clamp-2 h-16 px-4 text-2xl font-semibold">{title}</p>
-        <div className="flex h-[52px] p-4 text-sm">
-          <p>{createdAt?.toDate().toLocaleDateString()}</p>
-          <p>・</p>
-          <p>{count} 個のソース</p>
+const NotebookCard = ({ id, title, count, createdAt, status }: Notebook) => {
+  const [dialogForDeleteOpen, setDialogForDeleteOpen] = useState(false);
+  const [dropdownMenuOpen, setDropdownMenuOpen] = useState(false);
+  const uid = auth.currentUser?.uid as string;
+
+  const handleClickDelete = async () => {
+    // The notebook and its sources are deleted by the GenAI backend
+    await deleteNotebook(uid, id);
+    setDialogForDeleteOpen(false);
+    setDropdownMenuOpen(false);
+  };
+
+  const content = (
+    <div className="flex size-[224px] flex-col rounded-2xl bg-[#CDD2D9]">
+      <div className="flex h-[106px] p-3">
+        <div className="flex size-8 items-center justify-center rounded-full bg-white">
+          <p>K</p>
         </div>
       </div>
-    </Link>
+      <p className="line-clamp-2 h-16 px-4 text-2xl font-semibold">{title}</p>
+      <div className="flex h-[52px] p-4 text-sm">
+        <p>{createdAt?.toDate().toLocaleDateString()}</p>
+        <p>・</p>
+        <p>{count} 個のソース</p>
+      </div>
+    </div>
+  );
+
+  if (status === 'deleting') {
+    return (
+      <div className="relative opacity-50">
+        {content}
+        <PuffLoader size={20} color="#FF0000" className="absolute right-3 top-3" />
+      </div>
+    );
+  }
+
+  return (
+    <div className="relative">
+      <Link href={`/notebook/${id}`}>{content}</Link>
+      <DropdownMenu open={dropdownMenuOpen} onOpenChange={setDropdownMenuOpen}>
+        <DropdownMenuTrigger asChild>
+          <button className="absolute right-3 top-3 flex size-8 items-center justify-center rounded-full hover:bg-[#C8CFD6]">
+            <BsThreeDotsVertical size={20} />
+          </button>
+        </DropdownMenuTrigger>
+        <DropdownMenuContent className="p-0" align="start">
+          <Dialog open={dialogForDeleteOpen} onOpenChange={setDialogForDeleteOpen}>
+            <DialogTrigger className="flex h-12 w-full items-center px-2 py-[6px] hover:bg-[#EDEEEE]">
+              <BsTrash size={18} className="mr-2" />
+              <span className="text-sm">ノートブックを削除</span>
+            </DialogTrigger>
+            <DialogContent className="w-fit max-w-[120%] p-0">
+              <VisuallyHidden>
+                <DialogTitle>Delete notebook</DialogTitle>
+                <DialogDescription>Delete notebook</DialogDescription>
+              </VisuallyHidden>
+              <div className="p-4">
+                <p className="px-6 py-5 text-lg">{title} とすべてのソースを削除しますか？</p>
+                <div className="flex h-[52px] items-center justify-end px-2 py-[2px]">
+                  <span
+                    className="m-2 cursor-pointer p-2 text-sm text-blue-500 hover:bg-[#F7FAFE] hover:text-blue-800"
+                    onClick={() => setDialogForDeleteOpen(false)}
+                  >
+                    キャンセル
+                  </span>
+                  <span
+                    className="m-2 cursor-pointer p-2 text-sm text-blue-500 hover:bg-[#F7FAFE] hover:text-blue-800"
+                    onClick={handleClickDelete}
+                  >
+                    削除
+                  </span>
+                </div>
+              </div>
+            </DialogContent>
+          </Dialog>
+        </DropdownMenuContent>
+      </DropdownMenu>
+    </div>
   );
 };
 
@@ -57,8 +57,17 @@ const NotebooksLayout = () => {
           <div className="flex flex-wrap gap-8">
             <NewNotebookCard />
             {notebooks.map((notebook) => {
-              const { id, title, sourceCount, createdAt } = notebook;
-              return <NotebookCard key={notebook.id} id={id} title={title} count={sourceCount} createdAt={createdAt} />;
+              const { id, title, sourceCount, createdAt, status } = notebook;
+              return (
+                <NotebookCard
+                  key={notebook.id}
+                  id={id}
+                  title={title}
+                  count={sourceCount}
+                  createdAt={createdAt}
+                  status={status}
+                />
+              );
             })}
           </div>
         </>
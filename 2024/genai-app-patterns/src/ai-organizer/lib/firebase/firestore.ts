@@ -188,6 +188,7 @@ export type Notebook = {
   title: string;
   createdAt: Timestamp;
   sourceCount: number;
+  status?: 'deleting';
 };
 
 type GetNotebooksSnapshotCallback = (notebooks: Notebook[]) => void;
@@ -232,6 +233,12 @@ export const updateNotebookTitle = async (uid: string, notebookId: string, title
   });
 };
 
+export const deleteNotebook = async (uid: string, notebookId: string) => {
+  await updateDoc(doc(db, 'users', uid, 'notebooks', notebookId), {
+    status: 'deleting'
+  });
+};
+
 export type User = {
   id: string;
   email: string;
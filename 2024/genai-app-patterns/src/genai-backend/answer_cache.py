@@ -0,0 +1,127 @@
+import math
+import re
+import threading
+import unicodedata
+
+from cache import LRUCache
+from lazy import LazyModule
+from result_cache import cache_key
+
+firestore = LazyModule("google.cloud.firestore")
+
+# Maximum number of cached answers compared by embedding similarity
+SIMILARITY_CANDIDATES = 100
+
+
+def normalize_question(question):
+    question = unicodedata.normalize("NFKC", question).lower()
+    question = re.sub(r"\s+", " ", question).strip()
+    return question.rstrip("?？。.!！ ")
+
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class AnswerCache:
+    """Cache of answers keyed by the normalized question and the selected rag files.
+
+    Answers are stored per user in a Firestore collection with an in-memory
+    LRU in front, and are only reused for exactly the same set of rag files.
+    Only answers generated without chat history are stored, and they are
+    reused for questions asked without history. Answers marked as
+    self-contained (e.g. to generated common questions) are reused for any
+    question. With embed and similarity_threshold set, a similar question
+    asked without history is also accepted.
+    """
+
+    def __init__(self, db, embed=None, similarity_threshold=None, maxsize=1024):
+        self.db = db
+        self.entries = LRUCache(maxsize=maxsize)
+        self.embeddings = LRUCache(maxsize=256)
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def key(self, question, rag_file_ids):
+        return cache_key(normalize_question(question), *sorted(rag_file_ids))
+
+    def lookup(self, cache_ref, question, rag_file_ids, history_free):
+        """Return a cached answer for the question, or None."""
+        key = self.key(question, rag_file_ids)
+        entry = self.entries.get(key)
+        if entry is None:
+            doc = cache_ref.document(key).get()
+            if doc.exists:
+                entry = doc.to_dict()
+                self.entries.set(key, entry)
+        # A question asked with history can only reuse a self-contained answer to the
+        # same question, so the similarity search is only worth it without history
+        if entry is None and history_free and self.similarity_threshold is not None:
+            entry = self._find_similar(cache_ref, question, rag_file_ids)
+
+        with self.lock:
+            if entry is not None and (history_free or entry.get("selfContained")):
+                self.hits += 1
+                return entry["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, cache_ref, question, rag_file_ids, answer, self_contained=False):
+        entry = {
+            "question": normalize_question(question),
+            "ragFileIds": sorted(rag_file_ids),
+            "ragFileIdsKey": ",".join(sorted(rag_file_ids)),
+            "answer": answer,
+            "selfContained": self_contained,
+        }
+        if self.similarity_threshold is not None:
+            entry["embedding"] = self._embedding(question)
+        key = self.key(question, rag_file_ids)
+        cache_ref.document(key).set({**entry, "createdAt": firestore.SERVER_TIMESTAMP})
+        self.entries.set(key, entry)
+
+    def evict_rag_files(self, cache_ref, rag_file_ids):
+        """Forget the answers that used any of the deleted rag files and return their documents to delete."""
+        refs = {}
+        # array_contains_any accepts up to 30 values
+        for i in range(0, len(rag_file_ids), 30):
+            query = cache_ref.where(
+                filter=firestore.FieldFilter("ragFileIds", "array_contains_any", rag_file_ids[i:i + 30])
+            )
+            for doc in query.stream():
+                refs[doc.id] = doc.reference
+        for key in refs:
+            self.entries.pop(key)
+        return list(refs.values())
+
+    def _embedding(self, question):
+        normalized = normalize_question(question)
+        return self.embeddings.get_or_set(normalized, lambda: self.embed(normalized))
+
+    def _find_similar(self, cache_ref, question, rag_file_ids):
+        embedding = self._embedding(question)
+        candidates = (
+            cache_ref
+            .where(filter=firestore.FieldFilter("ragFileIdsKey", "==", ",".join(sorted(rag_file_ids))))
+            .limit(SIMILARITY_CANDIDATES)
+            .stream()
+        )
+        best, best_similarity = None, self.similarity_threshold
+        for doc in candidates:
+            candidate = doc.to_dict()
+            if not candidate.get("embedding"):
+                continue
+            similarity = cosine_similarity(embedding, candidate["embedding"])
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
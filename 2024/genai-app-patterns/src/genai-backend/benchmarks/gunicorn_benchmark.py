@@ -0,0 +1,137 @@
+import argparse
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.loadtest import seeded_events
+from telemetry import percentile
+
+# p50/p95 columns of the report
+ROUTES = {"summarize": "summarize ms", "generate_common_questions": "questions ms", "question": "question ms"}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(port, workers, threads, users, args):
+    """Serve benchmarks.loadtest:create_app() with gunicorn.conf.py, like the Dockerfile, and wait until it accepts requests."""
+    env = {
+        **os.environ,
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(workers),
+        "GUNICORN_THREADS": str(threads),
+        "FLASK_PROJECT_ID": "loadtest",
+        "LOADTEST_USERS": str(users),
+        "LOADTEST_SOURCES": str(args.sources),
+        "LOADTEST_QUESTIONS": str(args.questions),
+        "LOADTEST_LATENCY_SCALE": str(args.latency_scale),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "--log-level", "warning", "benchmarks.loadtest:create_app()"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"gunicorn exited with {process.returncode}")
+        try:
+            # Any response means that a worker has imported the app
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5)
+        except urllib.error.HTTPError:
+            return process
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    sys.exit("gunicorn didn't start")
+
+
+def post(port, route, document):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/{route}",
+        data=b"{}",
+        method="POST",
+        headers={
+            "ce-id": uuid.uuid4().hex,
+            "ce-source": "//firestore.googleapis.com/projects/loadtest/databases/(default)",
+            "ce-type": "google.cloud.firestore.document.v1.written",
+            "ce-specversion": "1.0",
+            "ce-subject": f"documents/{document}",
+            "ce-document": document,
+            "Content-Type": "application/json",
+        },
+    )
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=600) as response:
+            status = response.status
+    except urllib.error.HTTPError as err:
+        status = err.code
+    except OSError:
+        status = 599
+    return route, (time.monotonic() - start) * 1000, status
+
+
+def run_session(port, uid, args):
+    return [post(port, route, document) for route, document in seeded_events(uid, args.sources, args.questions)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the backend served by gunicorn with gunicorn.conf.py, on in-memory fakes."
+    )
+    parser.add_argument("--workers", type=lambda value: [int(n) for n in value.split(",")], default=[1], help="WEB_CONCURRENCY values")
+    parser.add_argument("--threads", type=lambda value: [int(n) for n in value.split(",")], default=[20], help="GUNICORN_THREADS values")
+    parser.add_argument(
+        "--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[1, 8, 32],
+        help="sessions running at the same time; a comma separated list measures each level"
+    )
+    parser.add_argument("--users", type=int, default=32, help="sessions at each concurrency level")
+    parser.add_argument("--sources", type=int, default=1, help="sources summarized per session")
+    parser.add_argument("--questions", type=int, default=3, help="questions asked per session")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier of all fake latencies")
+    args = parser.parse_args()
+
+    print(f"{'workers':>8}{'threads':>8}{'concurrency':>12}{'req/s':>8}{'errors':>8}" + "".join(f"{label:>16}" for label in ROUTES.values()))
+    for workers, threads in itertools.product(args.workers, args.threads):
+        port = free_port()
+        # Each concurrency level uses users of its own, so that no result is cached from a previous level
+        process = start_gunicorn(port, workers, threads, args.users * len(args.concurrency), args)
+        try:
+            for level, concurrency in enumerate(args.concurrency):
+                uids = [f"user{level * args.users + n}" for n in range(args.users)]
+                start = time.monotonic()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    results = [result for session in executor.map(lambda uid: run_session(port, uid, args), uids) for result in session]
+                elapsed = time.monotonic() - start
+                latencies = defaultdict(list)
+                for route, milliseconds, _ in results:
+                    latencies[route].append(milliseconds)
+                errors = sum(1 for _, _, status in results if status >= 400)
+                print(
+                    f"{workers:>8}{threads:>8}{concurrency:>12}{len(results) / elapsed:>8.1f}{errors:>8}"
+                    + "".join(
+                        f"{f'{percentile(latencies[route], 50):.0f}/{percentile(latencies[route], 95):.0f}':>16}"
+                        for route in ROUTES if latencies[route]
+                    )
+                )
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
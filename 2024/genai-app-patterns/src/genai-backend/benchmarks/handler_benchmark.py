@@ -0,0 +1,120 @@
+import argparse
+import logging
+import time
+from types import SimpleNamespace
+
+import vertexai.generative_models
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+
+from cache import LRUCache
+from benchmarks.loadtest import DEFAULT_LATENCIES, Latency, LoadTest, OpCounter, Recorder, install_fakes
+
+# Captured before install_fakes() replaces it
+StorageClient = storage.Client
+
+
+def make_instant_model():
+    """Return the real GenerativeModel with generate_content answering immediately.
+
+    Building the model, its tools and their API clients is measured as in
+    production; only the request to the model is skipped.
+    """
+    usage_metadata = SimpleNamespace(prompt_token_count=1000, candidates_token_count=100, total_token_count=1100)
+
+    class InstantGenerativeModel(vertexai.generative_models.GenerativeModel):
+
+        def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+            response = SimpleNamespace(text="1. 主なテーマは何ですか？\n2. 注意点は何ですか？", usage_metadata=usage_metadata)
+            return iter([response]) if stream else response
+
+    return InstantGenerativeModel
+
+
+def microseconds_per_call(fn, iterations, before_calls):
+    """Return the mean microseconds of fn per setup in before_calls.
+
+    The setups are interleaved, so the fake Firestore growing during the run
+    affects them equally.
+    """
+    seconds = [0.0] * len(before_calls)
+    for i in range(iterations):
+        for n, before_call in enumerate(before_calls):
+            before_call()
+            start = time.perf_counter()
+            fn(i)
+            seconds[n] += time.perf_counter() - start
+    return [total / iterations * 1e6 for total in seconds]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the per-request overhead of creating models and clients, with and without pooling."
+    )
+    parser.add_argument("--iterations", type=int, default=200, help="calls measured per row")
+    args = parser.parse_args()
+
+    counter = OpCounter()
+    # All fake calls return immediately, so only the handler overhead is measured
+    db = install_fakes(Latency(DEFAULT_LATENCIES, scale=0), counter)
+    vertexai.generative_models.GenerativeModel = make_instant_model()
+
+    import main as backend
+    logging.getLogger().setLevel(logging.WARNING)
+    # The rate limit of the model would otherwise dominate the measured time
+    backend.generation_limiter.rate = backend.generation_limiter.max_rate = 1e9
+
+    load_test = LoadTest(backend.app, db, counter, Recorder(), 0, 0, 0)
+    user_ref = db.collection("users").document("user")
+    user_ref.set({"status": "creating"})
+    load_test.post("add_user", user_ref.path)
+    corpus_name = db.snapshot(user_ref).get("corpusName")
+    notebook_ref = user_ref.collection("notebooks").document()
+
+    def question(i):
+        # A new notebook each time so that the chat history doesn't grow
+        message_ref = user_ref.collection("notebooks").document().collection("chat").document()
+        # A new question each time so that the answer cache is not hit
+        message_ref.set({"content": f"質問 {i}", "loading": False, "ragFileIds": ["1"], "role": "user", "status": "success"})
+        load_test.post("question", message_ref.path)
+
+    def generate_common_questions(i):
+        source_ref = notebook_ref.collection("sources").document()
+        # A new storage path each time so that the result cache is not hit
+        source_ref.set({"type": "application/pdf", "storagePath": f"/user/{source_ref.id}.pdf", "name": "a.pdf"})
+        load_test.post("generate_common_questions", source_ref.path)
+
+    rows = [
+        ("get_model()", lambda i: backend.get_model()),
+        ("get_rag_model()", lambda i: backend.get_rag_model(corpus_name, ["1"])),
+        ("POST /question", question),
+        ("POST /generate_common_questions", generate_common_questions),
+    ]
+    pool = backend.model_pool
+
+    def without_pool():
+        # A pool of size 0 creates the model on every call, as before pooling
+        backend.model_pool = LRUCache(maxsize=0)
+
+    def with_pool():
+        backend.model_pool = pool
+
+    print(f"{'call':<34}{'new us':>10}{'pooled us':>11}{'saved us':>10}")
+    for name, fn in rows:
+        fn(0)
+        new, pooled = microseconds_per_call(fn, args.iterations, [without_pool, with_pool])
+        print(f"{name:<34}{new:>10.0f}{pooled:>11.0f}{new - pooled:>10.0f}")
+
+    project = backend.PROJECT_ID
+    new, = microseconds_per_call(
+        lambda i: StorageClient(project=project, credentials=AnonymousCredentials()), args.iterations, [lambda: None]
+    )
+    print(f"{'storage.Client()':<34}{new:>10.0f}{0:>11.0f}{new:>10.0f}")
+    if load_test.recorder.errors:
+        print(f"errors: {dict(load_test.recorder.errors)}")
+
+    backend.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from google.api_core.exceptions import FailedPrecondition
+from tenacity import retry, retry_if_exception_type, wait_exponential
+
+from import_queue import CorpusImportQueue
+
+
+class SimulatedRag:
+    """Rag backend that runs only one import per corpus at a time, like Vertex AI RAG Engine.
+
+    An import started while another one is running on the same corpus fails
+    with FailedPrecondition. Durations are multiplied by time_scale.
+    """
+
+    def __init__(self, base_ms, per_file_ms, reject_ms, time_scale):
+        self.base_ms = base_ms
+        self.per_file_ms = per_file_ms
+        self.reject_ms = reject_ms
+        self.time_scale = time_scale
+        self.running = set()
+        self.calls = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def import_files(self, corpus_name, paths):
+        with self.lock:
+            self.calls += 1
+            busy = corpus_name in self.running
+            if busy:
+                self.rejected += 1
+            else:
+                self.running.add(corpus_name)
+        if busy:
+            time.sleep(self.reject_ms * self.time_scale / 1000)
+            raise FailedPrecondition(f"other operations are running on {corpus_name}")
+        try:
+            time.sleep((self.base_ms + self.per_file_ms * len(paths)) * self.time_scale / 1000)
+        finally:
+            with self.lock:
+                self.running.discard(corpus_name)
+        return SimpleNamespace(imported_rag_files_count=len(paths))
+
+
+class RetryingImport:
+    """rag.import_files with the same exponential backoff as import_files() in main.py."""
+
+    def __init__(self, rag, time_scale):
+        self.rag = rag
+        self.retry_seconds = 0.0
+        self.lock = threading.Lock()
+        self.import_files = retry(
+            retry=retry_if_exception_type(FailedPrecondition),
+            wait=wait_exponential(multiplier=5 * time_scale, max=40 * time_scale),
+            before_sleep=self.record_sleep,
+        )(rag.import_files)
+
+    def record_sleep(self, retry_state):
+        with self.lock:
+            self.retry_seconds += retry_state.next_action.sleep
+
+
+def run(uploads, corpora, instances, args, batched):
+    """Upload files to each corpus at the same time and return the simulated rag, the importer and the seconds taken."""
+    rag = SimulatedRag(args.import_ms, args.per_file_ms, args.reject_ms, args.time_scale)
+    importer = RetryingImport(rag, args.time_scale)
+    queues = [
+        CorpusImportQueue(importer.import_files, batch_window=args.batch_window * args.time_scale, max_batch_size=args.max_batch_size)
+        for _ in range(instances)
+    ]
+
+    def upload(n):
+        corpus_name = f"corpus{n % corpora}"
+        gcs_path = f"gs://benchmark/{n}.pdf"
+        if batched:
+            # Uploads are spread over the instances like requests behind the load balancer
+            queues[n % instances].submit(corpus_name, gcs_path).result()
+        else:
+            importer.import_files(corpus_name, [gcs_path])
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=uploads * corpora) as executor:
+        list(executor.map(upload, range(uploads * corpora)))
+    return rag, importer, time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare per-upload retries with the per-corpus import queue against a simulated rag backend."
+    )
+    parser.add_argument(
+        "--uploads", type=lambda value: [int(n) for n in value.split(",")], default=[1, 5, 20, 50],
+        help="files uploaded to a corpus at the same time; a comma separated list measures each"
+    )
+    parser.add_argument("--corpora", type=int, default=4, help="corpora (users) uploading at the same time")
+    parser.add_argument("--instances", type=int, default=1, help="instances each running its own import queue")
+    parser.add_argument("--import-ms", type=float, default=20000, help="duration of an import call")
+    parser.add_argument("--per-file-ms", type=float, default=2000, help="additional duration per imported file")
+    parser.add_argument("--reject-ms", type=float, default=300, help="duration of an import call rejected as busy")
+    parser.add_argument("--batch-window", type=float, default=1.0, help="IMPORT_BATCH_WINDOW_SECONDS")
+    parser.add_argument("--max-batch-size", type=int, default=25, help="IMPORT_MAX_BATCH_SIZE")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="multiplier of all durations and waits")
+    args = parser.parse_args()
+
+    print(f"{'uploads':>8}{'mode':>9}{'files/min':>11}{'calls':>7}{'rejected':>10}{'retry wait s':>14}{'elapsed s':>11}")
+    for uploads in args.uploads:
+        for batched in [False, True]:
+            rag, importer, elapsed = run(uploads, args.corpora, args.instances, args, batched)
+            # Rates and waits are reported in unscaled time
+            elapsed /= args.time_scale
+            print(
+                f"{uploads:>8}{'queue' if batched else 'retry':>9}{uploads * args.corpora / elapsed * 60:>11.1f}"
+                f"{rag.calls:>7}{rag.rejected:>10}{importer.retry_seconds / args.time_scale:>14.0f}{elapsed:>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
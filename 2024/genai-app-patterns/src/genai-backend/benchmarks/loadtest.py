@@ -0,0 +1,737 @@
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import vertexai
+import vertexai.generative_models
+from google.api_core.exceptions import Conflict, FailedPrecondition, NotFound
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore, storage
+from vertexai import rag
+
+from telemetry import percentile
+
+# Median latency in milliseconds and sigma of the log-normal distribution of each fake call
+DEFAULT_LATENCIES = {
+    "firestore": (8, 0.5),
+    "storage": (30, 0.5),
+    "create_corpus": (1500, 0.3),
+    "import_files": (3000, 0.3),
+    "list_files": (300, 0.3),
+    "delete_file": (200, 0.3),
+    "generate_content": (1500, 0.5),
+}
+ROUTES = ["add_user", "add_source", "summarize", "generate_common_questions", "question", "update_source"]
+
+
+class Latency:
+    """Sleeps for a random duration drawn from a log-normal distribution per kind of call."""
+
+    def __init__(self, latencies, scale=1.0, seed=None):
+        self.latencies = latencies
+        self.scale = scale
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sleep(self, kind):
+        median_ms, sigma = self.latencies[kind]
+        if not self.scale or not median_ms:
+            return
+        with self.lock:
+            ms = self.random.lognormvariate(math.log(median_ms), sigma)
+        time.sleep(ms * self.scale / 1000)
+
+
+class OpCounter(threading.local):
+    """Counts Firestore round trips of the current thread."""
+
+    def __init__(self):
+        self.ops = 0
+
+
+class FakeSnapshot:
+
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def get(self, field):
+        if self._data is None or field not in self._data:
+            raise KeyError(field)
+        return self._data[field]
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.split('/')[-1]
+
+    def collection(self, name):
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self):
+        self._client.round_trip()
+        return self._client.snapshot(self)
+
+    def set(self, data):
+        self._client.round_trip()
+        self._client.write("set", self, data)
+
+    def update(self, data, option=None):
+        self._client.round_trip()
+        self._client.write("update", self, data, option)
+
+    def create(self, data):
+        self._client.round_trip()
+        self._client.write("create", self, data)
+
+    def delete(self):
+        self._client.round_trip()
+        self._client.write("delete", self, None)
+
+    def on_snapshot(self, callback):
+        return SimpleNamespace(unsubscribe=lambda: None)
+
+
+class FakeQuery:
+
+    def __init__(self, client, path, filters=(), order=None, at=None, after=None, max_results=None):
+        self._client = client
+        self._path = path
+        self._filters = list(filters)
+        self._order = order
+        self._at = at
+        self._after = after
+        self._limit = max_results
+
+    def _copy(self, **kwargs):
+        attributes = {
+            "filters": self._filters, "order": self._order, "at": self._at, "after": self._after, "max_results": self._limit,
+        }
+        return FakeQuery(self._client, self._path, **{**attributes, **kwargs})
+
+    def where(self, filter):
+        return self._copy(filters=self._filters + [filter])
+
+    def order_by(self, field):
+        return self._copy(order=field)
+
+    def start_at(self, values):
+        return self._copy(at=values[self._order])
+
+    def start_after(self, values):
+        return self._copy(after=values[self._order])
+
+    def limit(self, count):
+        return self._copy(max_results=count)
+
+    def count(self):
+        query = self
+
+        class Aggregation:
+            def get(self):
+                return [[SimpleNamespace(value=len(query._matches()))]]
+        return Aggregation()
+
+    def stream(self):
+        return iter(self._matches())
+
+    def _matches(self):
+        self._client.round_trip()
+        snapshots = [snapshot for snapshot in self._client.children(self._path) if self._match(snapshot.to_dict())]
+        if self._order is not None:
+            snapshots = [snapshot for snapshot in snapshots if self._order in snapshot.to_dict()]
+            snapshots.sort(key=lambda snapshot: snapshot.get(self._order))
+            if self._at is not None:
+                snapshots = [snapshot for snapshot in snapshots if snapshot.get(self._order) >= self._at]
+            if self._after is not None:
+                snapshots = [snapshot for snapshot in snapshots if snapshot.get(self._order) > self._after]
+        return snapshots[:self._limit] if self._limit is not None else snapshots
+
+    def _match(self, data):
+        for field_filter in self._filters:
+            value = data.get(field_filter.field_path)
+            if field_filter.op_string == "==" and value != field_filter.value:
+                return False
+            if field_filter.op_string == "array_contains" and field_filter.value not in (value or []):
+                return False
+            if field_filter.op_string == "array_contains_any" and not set(field_filter.value) & set(value or []):
+                return False
+        return True
+
+
+class FakeCollectionReference(FakeQuery):
+
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.split('/')[-1]
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._client, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return self._client.now(), ref
+
+
+class FakeWriteBatch:
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref, data):
+        self._writes.append(("set", ref, data))
+
+    def update(self, ref, data):
+        self._writes.append(("update", ref, data))
+
+    def delete(self, ref):
+        self._writes.append(("delete", ref, None))
+
+    def commit(self):
+        self._client.round_trip()
+        with self._client.lock:
+            for op, ref, data in self._writes:
+                self._client.write(op, ref, data)
+        self._writes = []
+
+
+class FakeFirestoreClient:
+    """In-memory Firestore with the subset of the API used by the backend."""
+
+    def __init__(self, latency, counter):
+        self.latency = latency
+        self.counter = counter
+        self.documents = {}
+        self.update_times = {}
+        self.lock = threading.RLock()
+        self.last_timestamp = datetime.now(timezone.utc)
+        self.total_ops = 0
+
+    def round_trip(self):
+        self.counter.ops += 1
+        with self.lock:
+            self.total_ops += 1
+        self.latency.sleep("firestore")
+
+    def now(self):
+        with self.lock:
+            # Keep server timestamps unique so that ordered queries are stable
+            self.last_timestamp = max(datetime.now(timezone.utc), self.last_timestamp + timedelta(microseconds=1))
+            return self.last_timestamp
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def write_option(self, last_update_time):
+        return SimpleNamespace(last_update_time=last_update_time)
+
+    def get_all(self, refs):
+        self.round_trip()
+        return [self.snapshot(ref) for ref in refs]
+
+    def recursive_delete(self, ref):
+        self.round_trip()
+        with self.lock:
+            for path in [path for path in self.documents if path == ref.path or path.startswith(ref.path + "/")]:
+                del self.documents[path]
+                del self.update_times[path]
+
+    def snapshot(self, ref):
+        with self.lock:
+            data = self.documents.get(ref.path)
+            return FakeSnapshot(ref, dict(data) if data is not None else None, self.update_times.get(ref.path))
+
+    def children(self, collection_path):
+        depth = collection_path.count('/') + 1
+        with self.lock:
+            return [
+                FakeSnapshot(FakeDocumentReference(self, path), dict(data))
+                for path, data in self.documents.items()
+                if path.startswith(collection_path + "/") and path.count('/') == depth
+            ]
+
+    def write(self, op, ref, data, option=None):
+        with self.lock:
+            current = self.documents.get(ref.path)
+            if option is not None and self.update_times.get(ref.path) != option.last_update_time:
+                raise FailedPrecondition(f"document was updated: {ref.path}")
+            if op == "delete":
+                self.documents.pop(ref.path, None)
+                self.update_times.pop(ref.path, None)
+                return
+            if op == "create" and current is not None:
+                raise Conflict(f"document already exists: {ref.path}")
+            if op == "update" and current is None:
+                raise NotFound(f"no document to update: {ref.path}")
+            document = dict(current) if op == "update" else {}
+            for field, value in data.items():
+                if value is firestore.SERVER_TIMESTAMP:
+                    value = self.now()
+                elif isinstance(value, firestore.Increment):
+                    value = document.get(field, 0) + value.value
+                document[field] = value
+            self.documents[ref.path] = document
+            self.update_times[ref.path] = self.now()
+
+
+class FakeStorageClient:
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def bucket(self, name):
+        latency = self.latency
+
+        class Blob:
+            def __init__(self, path):
+                self.md5_hash = base64.b64encode(hashlib.md5(path.encode()).digest()).decode()
+                self.crc32c = None
+
+            def delete(self):
+                latency.sleep("storage")
+
+        class Bucket:
+            def blob(self, path):
+                return Blob(path)
+
+            def get_blob(self, path):
+                latency.sleep("storage")
+                return Blob(path)
+
+        return Bucket()
+
+
+class FakeRag:
+    """Rag corpora kept in memory, replacing the functions of vertexai.rag."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.corpora = defaultdict(dict)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def create_corpus(self, display_name, backend_config=None):
+        self.latency.sleep("create_corpus")
+        return SimpleNamespace(name=f"projects/loadtest/locations/us-central1/ragCorpora/{next(self.ids)}")
+
+    def import_files(self, corpus_name, paths, **kwargs):
+        self.latency.sleep("import_files")
+        with self.lock:
+            for path in paths:
+                rag_file_id = str(next(self.ids))
+                self.corpora[corpus_name][rag_file_id] = path.split('/')[-1]
+        return SimpleNamespace(imported_rag_files_count=len(paths))
+
+    def list_files(self, corpus_name):
+        self.latency.sleep("list_files")
+        with self.lock:
+            return [
+                SimpleNamespace(name=f"{corpus_name}/ragFiles/{rag_file_id}", display_name=display_name)
+                for rag_file_id, display_name in self.corpora[corpus_name].items()
+            ]
+
+    def delete_file(self, name, corpus_name=None):
+        self.latency.sleep("delete_file")
+        with self.lock:
+            if self.corpora[corpus_name].pop(name.split('/')[-1], None) is None:
+                raise NotFound(f"no rag file: {name}")
+
+
+def make_generative_model(latency):
+
+    class FakeGenerativeModel:
+
+        def __init__(self, model_name, tools=None, system_instruction=None):
+            self.model_name = model_name
+
+        def generate_content(self, contents, generation_config=None, stream=False):
+            latency.sleep("generate_content")
+            prompt = " ".join(content for content in contents if isinstance(content, str))
+            if generation_config is not None and "application/json" in str(generation_config.to_dict()):
+                text = json.dumps({"summarization": "要約" * 200, "questions": QUESTIONS}, ensure_ascii=False)
+            elif "common questions" in prompt:
+                text = "\n".join(f"{i}. {question}" for i, question in enumerate(QUESTIONS, 1))
+            elif generation_config is not None:
+                text = "要約" * 200
+            else:
+                text = "回答" * 400
+            prompt_tokens = len(str(contents)) // 4
+            usage_metadata = SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=len(text) // 2,
+                total_token_count=prompt_tokens + len(text) // 2,
+            )
+            if not stream:
+                return SimpleNamespace(text=text, usage_metadata=usage_metadata)
+            return (SimpleNamespace(text=text[i:i + 50], usage_metadata=usage_metadata) for i in range(0, len(text), 50))
+
+    return FakeGenerativeModel
+
+
+QUESTIONS = ["この資料の主なテーマは何ですか？", "導入する際の注意点は何ですか？", "どのような効果が期待できますか？"]
+
+
+def install_fakes(latency, counter):
+    """Replace the Google Cloud clients before main.py creates them."""
+    os.environ.setdefault("FLASK_PROJECT_ID", "loadtest")
+    db = FakeFirestoreClient(latency, counter)
+    fake_rag = FakeRag(latency)
+    # Rag tools create their API clients up front, so they need credentials even though they are never called
+    init = vertexai.init
+    vertexai.init = lambda **kwargs: init(**kwargs, credentials=AnonymousCredentials())
+    firestore.Client = lambda *args, **kwargs: db
+    storage.Client = lambda *args, **kwargs: FakeStorageClient(latency)
+    for name in ["create_corpus", "import_files", "list_files", "delete_file"]:
+        setattr(rag, name, getattr(fake_rag, name))
+    vertexai.generative_models.GenerativeModel = make_generative_model(latency)
+    return db
+
+
+class SideEffects:
+    """Counts the effects of handlers that must not be repeated for a redelivered event."""
+
+    def __init__(self, db):
+        self.imported_files = 0
+        self.answers_written = 0
+        self.lock = threading.Lock()
+
+        import_files = rag.import_files
+
+        def counting_import_files(corpus_name, paths, **kwargs):
+            with self.lock:
+                self.imported_files += len(paths)
+            return import_files(corpus_name, paths, **kwargs)
+
+        write = db.write
+
+        def counting_write(op, ref, data, option=None):
+            write(op, ref, data, option)
+            # The final update of an answer by /question
+            if ref.id.endswith("-answer") and data and data.get("loading") is False:
+                with self.lock:
+                    self.answers_written += 1
+
+        rag.import_files = counting_import_files
+        db.write = counting_write
+
+    def reset(self):
+        with self.lock:
+            self.imported_files = 0
+            self.answers_written = 0
+
+
+class Recorder:
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.ops = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.redeliveries = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, route, seconds, ops, ok):
+        with self.lock:
+            self.latencies[route].append(seconds * 1000)
+            self.ops[route].append(ops)
+            if not ok:
+                self.errors[route] += 1
+
+    def add_redelivery(self, outcome):
+        with self.lock:
+            self.redeliveries[outcome] += 1
+
+
+class LoadTest:
+    """Replays the CloudEvents of a user session against the Flask app."""
+
+    def __init__(self, app, db, counter, recorder, sources, questions, duplicate_ratio, redeliver_ratio=0.0, seed=None):
+        self.app = app
+        self.db = db
+        self.counter = counter
+        self.recorder = recorder
+        self.sources = sources
+        self.questions = questions
+        self.duplicate_ratio = duplicate_ratio
+        self.redeliver_ratio = redeliver_ratio
+        self.redelivery_executor = ThreadPoolExecutor(max_workers=8)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def send(self, route, document, event_id):
+        """Deliver the CloudEvent and return the status code."""
+        headers = {
+            "ce-id": event_id,
+            "ce-source": "//firestore.googleapis.com/projects/loadtest/databases/(default)",
+            "ce-type": "google.cloud.firestore.document.v1.written",
+            "ce-specversion": "1.0",
+            "ce-subject": f"documents/{document}",
+            "ce-document": document,
+            "Content-Type": "application/json",
+        }
+        try:
+            return self.app.test_client().post(f"/{route}", headers=headers, data="{}").status_code
+        except Exception:
+            return 500
+
+    def post(self, route, document):
+        event_id = uuid.uuid4().hex
+        with self.lock:
+            redeliver = self.random.random() < self.redeliver_ratio
+        # Eventarc delivers at least once, so the same event can arrive again while it is being processed
+        redelivery = self.redelivery_executor.submit(self.send, route, document, event_id) if redeliver else None
+        self.counter.ops = 0
+        start = time.monotonic()
+        status = self.send(route, document, event_id)
+        self.recorder.add(route, time.monotonic() - start, self.counter.ops, status < 500)
+        if redelivery is None:
+            return
+
+        self.recorder.add_redelivery("redelivered")
+        status = redelivery.result()
+        if status == 409:
+            # Eventarc retries it with backoff, after the first delivery has finished
+            self.recorder.add_redelivery("retried after 409")
+            status = self.send(route, document, event_id)
+        if status >= 500:
+            self.recorder.add_redelivery("failed")
+
+    def storage_path(self, uid, notebook_id, source_id):
+        with self.lock:
+            duplicate = self.random.random() < self.duplicate_ratio
+        # Duplicated uploads share the content hash, so they hit the result cache
+        return "/shared/sample.pdf" if duplicate else f"/{uid}/{notebook_id}/{source_id}.pdf"
+
+    def run_session(self, uid):
+        user_ref = self.db.collection("users").document(uid)
+        user_ref.set({"email": f"{uid}@example.com", "createdAt": firestore.SERVER_TIMESTAMP, "status": "creating"})
+        self.post("add_user", f"users/{uid}")
+
+        notebook_ref = user_ref.collection("notebooks").document()
+        notebook_ref.set({"title": "load test", "sourceCount": self.sources, "createdAt": firestore.SERVER_TIMESTAMP})
+        source_refs = []
+        for _ in range(self.sources):
+            source_ref = notebook_ref.collection("sources").document()
+            # Same fields as addSource in the frontend (lib/firebase/firestore.ts)
+            source_ref.set({
+                "name": f"{source_ref.id}.pdf",
+                "selected": False,
+                "type": "application/pdf",
+                "storagePath": self.storage_path(uid, notebook_ref.id, source_ref.id),
+                "ragFileId": None,
+                "status": "creating",
+                "createdAt": firestore.SERVER_TIMESTAMP,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+                "summarization": None,
+                "questions": None,
+            })
+            source_refs.append(source_ref)
+            for route in ["add_source", "summarize", "generate_common_questions"]:
+                self.post(route, source_ref.path)
+
+        rag_file_ids = [self.db.snapshot(ref).to_dict().get("ragFileId") for ref in source_refs]
+        rag_file_ids = [rag_file_id for rag_file_id in rag_file_ids if rag_file_id]
+        for i in range(self.questions):
+            message_ref = notebook_ref.collection("chat").document()
+            # Same fields as sendChatMessage in the frontend, so the history cache keeps the question
+            message_ref.set({
+                "content": QUESTIONS[i % len(QUESTIONS)],
+                "loading": False,
+                "ragFileIds": rag_file_ids,
+                "role": "user",
+                "status": "success",
+                "createdAt": firestore.SERVER_TIMESTAMP,
+            })
+            self.post("question", message_ref.path)
+
+        for source_ref in source_refs:
+            source_ref.update({"status": "deleting"})
+            self.post("update_source", source_ref.path)
+
+
+def report(recorder, side_effects, skipped, elapsed):
+    total = sum(len(values) for values in recorder.latencies.values())
+    print(f"{total} requests in {elapsed:.1f}s: {total / elapsed:.1f} requests/sec")
+    print(f"{'route':<28}{'count':>7}{'errors':>8}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'fs ops':>8}")
+    for route in ROUTES:
+        values = recorder.latencies.get(route)
+        if not values:
+            continue
+        ops = recorder.ops[route]
+        print(
+            f"{route:<28}{len(values):>7}{recorder.errors[route]:>8}{len(values) / elapsed:>8.1f}"
+            f"{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}{percentile(values, 99):>10.1f}"
+            f"{sum(ops) / len(ops):>8.1f}"
+        )
+    if recorder.redeliveries:
+        print(", ".join(f"{count} {outcome}" for outcome, count in recorder.redeliveries.items()) + f", {skipped} skipped as duplicates")
+    # Each event must import its file and write its answer exactly once, however often it is delivered
+    print(
+        f"side effects: {side_effects.imported_files} files imported for {len(recorder.latencies['add_source'])} add_source events, "
+        f"{side_effects.answers_written} answers written for {len(recorder.latencies['question'])} questions"
+    )
+
+
+def seed_user(db, uid, sources, questions):
+    """Write the documents of a user with a corpus, sources and questions, as left by a finished session.
+
+    Sources are in notebook0 and each question is in a notebook of its own.
+    """
+    user_ref = db.collection("users").document(uid)
+    db.write("set", user_ref, {
+        "email": f"{uid}@example.com",
+        "createdAt": firestore.SERVER_TIMESTAMP,
+        "status": "created",
+        "corpusName": f"projects/loadtest/locations/us-central1/ragCorpora/{uid}",
+    })
+    for i in range(max(questions, 1)):
+        notebook_ref = user_ref.collection("notebooks").document(f"notebook{i}")
+        db.write("set", notebook_ref, {"title": "load test", "sourceCount": sources, "createdAt": firestore.SERVER_TIMESTAMP})
+    notebook_ref = user_ref.collection("notebooks").document("notebook0")
+    for j in range(sources):
+        db.write("set", notebook_ref.collection("sources").document(f"source{j}"), {
+            "name": f"source{j}.pdf",
+            "selected": True,
+            "type": "application/pdf",
+            "storagePath": f"/files/{uid}/source{j}.pdf",
+            "ragFileId": f"{uid}-{j}",
+            "status": "created",
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+            "summarization": None,
+            "questions": None,
+        })
+    for i in range(questions):
+        message_ref = user_ref.collection("notebooks").document(f"notebook{i}").collection("chat").document("message")
+        db.write("set", message_ref, {
+            "content": QUESTIONS[i % len(QUESTIONS)],
+            "loading": False,
+            "ragFileIds": [f"{uid}-{j}" for j in range(sources)],
+            "role": "user",
+            "status": "success",
+            "createdAt": firestore.SERVER_TIMESTAMP,
+        })
+
+
+def seeded_events(uid, sources, questions):
+    """Return the (route, document) of the events that process the documents written by seed_user()."""
+    notebook = f"users/{uid}/notebooks/notebook0"
+    events = []
+    for j in range(sources):
+        events += [(route, f"{notebook}/sources/source{j}") for route in ["summarize", "generate_common_questions"]]
+    events += [("question", f"users/{uid}/notebooks/notebook{i}/chat/message") for i in range(questions)]
+    return events
+
+
+def create_app():
+    """Return main.app running on the fakes with seeded documents, e.g. to serve it with gunicorn.
+
+    The users, sources, questions and latency scale are read from the
+    LOADTEST_* environment variables. Each worker process seeds the same
+    documents, so that any worker can serve any event.
+    """
+    users = int(os.environ.get("LOADTEST_USERS", "20"))
+    sources = int(os.environ.get("LOADTEST_SOURCES", "2"))
+    questions = int(os.environ.get("LOADTEST_QUESTIONS", "3"))
+    latency_scale = float(os.environ.get("LOADTEST_LATENCY_SCALE", "1.0"))
+    db = install_fakes(Latency(DEFAULT_LATENCIES, scale=latency_scale), OpCounter())
+
+    import main as backend
+    backend.import_queue.batch_window *= latency_scale
+    for n in range(users):
+        seed_user(db, f"user{n}", sources, questions)
+    return backend.app
+
+
+def parse_latency(value):
+    name, _, spec = value.partition("=")
+    median_ms, _, sigma = spec.partition(":")
+    if name not in DEFAULT_LATENCIES:
+        raise argparse.ArgumentTypeError(f"unknown latency: {name}")
+    return name, (float(median_ms), float(sigma) if sigma else DEFAULT_LATENCIES[name][1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay synthetic CloudEvents against main.py with in-memory fakes of the Google Cloud services."
+    )
+    parser.add_argument("--users", type=int, default=20, help="number of user sessions")
+    parser.add_argument(
+        "--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[8],
+        help="sessions running at the same time; a comma separated list (e.g. 1,8,32,80) measures each level"
+    )
+    parser.add_argument("--sources", type=int, default=2, help="sources uploaded per session")
+    parser.add_argument("--questions", type=int, default=3, help="questions asked per session")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2, help="ratio of uploads of an identical file")
+    parser.add_argument(
+        "--redeliver-ratio", type=float, default=0.1,
+        help="ratio of events delivered a second time with the same ce-id, while the first delivery is processed"
+    )
+    parser.add_argument(
+        "--latency", type=parse_latency, action="append", default=[], metavar="NAME=MEDIAN_MS[:SIGMA]",
+        help=f"latency distribution of a fake call, one of {', '.join(DEFAULT_LATENCIES)}"
+    )
+    parser.add_argument(
+        "--latency-scale", type=float, default=1.0, help="multiplier of all latencies; 0 measures the handler overhead only"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    latency = Latency({**DEFAULT_LATENCIES, **dict(args.latency)}, scale=args.latency_scale, seed=args.seed)
+    counter = OpCounter()
+    db = install_fakes(latency, counter)
+
+    import main as backend
+    # The import batch window is a real wait, so it is scaled like the fake latencies
+    backend.import_queue.batch_window *= args.latency_scale
+    logging.getLogger().setLevel(logging.WARNING)
+
+    load_test = LoadTest(
+        backend.app, db, counter, None, args.sources, args.questions, args.duplicate_ratio, args.redeliver_ratio, seed=args.seed
+    )
+    side_effects = SideEffects(db)
+    # Throughput stops growing with the concurrency once the instance is saturated
+    for concurrency in args.concurrency:
+        load_test.recorder = Recorder()
+        side_effects.reset()
+        duplicates = backend.event_deduplicator.duplicates
+        total_ops = db.total_ops
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            uids = [f"c{concurrency}-user{n}" for n in range(args.users)]
+            for future in [executor.submit(load_test.run_session, uid) for uid in uids]:
+                future.result()
+        print(f"concurrency {concurrency}:")
+        report(load_test.recorder, side_effects, backend.event_deduplicator.duplicates - duplicates, time.monotonic() - start)
+        print(f"{db.total_ops - total_ops} firestore round trips in total")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import logging
+import sys
+
+from google.cloud import firestore
+
+from benchmarks.loadtest import DEFAULT_LATENCIES, Latency, LoadTest, OpCounter, Recorder, install_fakes, seed_user
+
+# Firestore round trips of each event, including claiming it in processedEvents and
+# marking it done (2). The user's corpus name is cached after the user's first event.
+BUDGETS = {
+    "add_user": 3,
+    "add_source": 6,
+    "summarize": 6,
+    "generate_common_questions": 6,
+    "analyze_source": 6,
+    "question": 8,
+    "question (cached history)": 7,
+    "question (answer event)": 0,
+    "precompute_answers": 7,
+    "update_source": 3,
+    "delete_notebook": 7,
+}
+
+
+def run_events(load_test, db):
+    """Post one event of each handler and return the round trips of each."""
+    counts = {}
+
+    def post(name, route, document):
+        load_test.recorder = Recorder()
+        load_test.post(route, document)
+        if load_test.recorder.errors:
+            sys.exit(f"{name} failed")
+        counts[name] = load_test.recorder.ops[route][0]
+
+    user_ref = db.collection("users").document("new-user")
+    db.write("set", user_ref, {"email": "new-user@example.com", "createdAt": firestore.SERVER_TIMESTAMP, "status": "creating"})
+    post("add_user", "add_user", user_ref.path)
+
+    seed_user(db, "user", sources=2, questions=1)
+    notebook_ref = db.collection("users").document("user").collection("notebooks").document("notebook0")
+    source_ref = notebook_ref.collection("sources").document("new-source")
+    db.write("set", source_ref, {
+        "name": "new-source.pdf",
+        "selected": False,
+        "type": "application/pdf",
+        "storagePath": "/files/user/new-source.pdf",
+        "ragFileId": None,
+        "status": "creating",
+        "createdAt": firestore.SERVER_TIMESTAMP,
+    })
+    post("add_source", "add_source", source_ref.path)
+
+    source_path = notebook_ref.collection("sources").document("source0").path
+    post("summarize", "summarize", source_path)
+    post("generate_common_questions", "generate_common_questions", source_path)
+    post("analyze_source", "analyze_source", notebook_ref.collection("sources").document("source1").path)
+    post("precompute_answers", "precompute_answers", source_path)
+
+    chat_ref = notebook_ref.collection("chat")
+    post("question", "question", chat_ref.document("message").path)
+    post("question (answer event)", "question", chat_ref.document("message-answer").path)
+    db.write("set", chat_ref.document("message2"), {
+        "content": "もう少し詳しく教えてください",
+        "loading": False,
+        "ragFileIds": ["user-0"],
+        "role": "user",
+        "status": "success",
+        "createdAt": firestore.SERVER_TIMESTAMP,
+    })
+    post("question (cached history)", "question", chat_ref.document("message2").path)
+
+    db.write("update", db.collection("users").document("user").collection("notebooks").document("notebook0").collection("sources").document("source1"), {"status": "deleting"})
+    post("update_source", "update_source", notebook_ref.collection("sources").document("source1").path)
+
+    db.write("update", notebook_ref, {"status": "deleting"})
+    post("delete_notebook", "delete_notebook", notebook_ref.path)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the Firestore round trips of each handler against BUDGETS, on in-memory fakes."
+    )
+    parser.parse_args()
+
+    counter = OpCounter()
+    db = install_fakes(Latency(DEFAULT_LATENCIES, scale=0), counter)
+
+    import main as backend
+    logging.getLogger().setLevel(logging.WARNING)
+
+    counts = run_events(LoadTest(backend.app, db, counter, Recorder(), 0, 0, 0), db)
+    failed = False
+    print(f"{'event':<30}{'round trips':>12}{'budget':>8}")
+    for name, budget in BUDGETS.items():
+        print(f"{name:<30}{counts[name]:>12}{budget:>8}")
+        if counts[name] > budget:
+            print(f"FAIL: {name} takes {counts[name]} round trips, more than {budget}")
+            failed = True
+
+    backend.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Modules that are only needed by some handlers and must not be imported at startup
+DEFERRED_MODULES = [
+    "vertexai.rag", "vertexai.language_models", "google.cloud.storage", "google.cloud.firestore", "opentelemetry.sdk"
+]
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure_imports():
+    """Import main.py in a fresh interpreter and return (cumulative us, depth, module) of each import."""
+    env = {"FLASK_PROJECT_ID": "startup-benchmark", **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        sys.exit(result.stderr)
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            _, cumulative, indent, module = match.groups()
+            imports.append((int(cumulative), len(indent) // 2, module))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the time to import main.py with python -X importtime.")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters to measure")
+    parser.add_argument("--top", type=int, default=15, help="number of the slowest top level imports to show")
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the median import time exceeds this")
+    args = parser.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        imports = measure_imports()
+        totals.append(next(cumulative for cumulative, _, module in imports if module == "main") / 1000)
+    median = sorted(totals)[len(totals) // 2]
+    print(f"import main: median {median:.0f} ms, min {min(totals):.0f} ms, max {max(totals):.0f} ms over {args.runs} runs")
+
+    print("slowest imports of the last run:")
+    top_level = sorted(((cumulative, module) for cumulative, depth, module in imports if depth <= 1), reverse=True)
+    for cumulative, module in top_level[:args.top]:
+        print(f"{cumulative / 1000:>10.1f} ms  {module}")
+
+    failed = False
+    imported = {module for _, _, module in imports}
+    for module in DEFERRED_MODULES:
+        if module in imported:
+            print(f"FAIL: {module} is imported at startup")
+            failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"FAIL: median import time {median:.0f} ms exceeds {args.max_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import vertexai.generative_models
+
+from benchmarks.loadtest import DEFAULT_LATENCIES, Latency, LoadTest, OpCounter, Recorder, install_fakes
+from telemetry import percentile
+
+
+def make_streaming_model(latency, answer_chars, chunk_chars):
+    """Return a fake GenerativeModel whose answers arrive in chunks like the streaming API."""
+
+    class FakeStreamingModel:
+
+        def __init__(self, model_name, tools=None, system_instruction=None):
+            self.model_name = model_name
+
+        def chunks(self):
+            # Retrieval and prompt processing happen before the first chunk
+            latency.sleep("first_chunk")
+            usage_metadata = SimpleNamespace(
+                prompt_token_count=1000, candidates_token_count=answer_chars // 2, total_token_count=1000 + answer_chars // 2
+            )
+            for i in range(0, answer_chars, chunk_chars):
+                if i:
+                    latency.sleep("chunk")
+                yield SimpleNamespace(text="回" * min(chunk_chars, answer_chars - i), usage_metadata=usage_metadata)
+
+        def generate_content(self, contents, generation_config=None, stream=False):
+            if stream:
+                return self.chunks()
+            chunks = list(self.chunks())
+            return SimpleNamespace(text="".join(chunk.text for chunk in chunks), usage_metadata=chunks[-1].usage_metadata)
+
+    return FakeStreamingModel
+
+
+class FirstContentWatcher:
+    """Records when each chat collection first receives an answer with text."""
+
+    def __init__(self, db):
+        self.first_content = {}
+        self.answer_writes = 0
+        self.lock = threading.Lock()
+        write = db.write
+
+        def watched_write(op, ref, data, option=None):
+            write(op, ref, data, option)
+            if "/chat/" in ref.path and data and data.get("content") and data.get("role") != "user":
+                with self.lock:
+                    self.answer_writes += 1
+                    self.first_content.setdefault(ref.path.rsplit('/', 1)[0], time.monotonic())
+
+        db.write = watched_write
+
+
+def ask(load_test, db, uid):
+    """Ask a question in a new notebook and return its start time, its duration and the path of the chat."""
+    user_ref = db.collection("users").document(uid)
+    notebook_ref = user_ref.collection("notebooks").document()
+    message_ref = notebook_ref.collection("chat").document()
+    # A rag file of its own keeps the answer cache from answering the question
+    message_ref.set({
+        "content": "この資料の主なテーマは何ですか？",
+        "loading": False,
+        "ragFileIds": [uuid.uuid4().hex],
+        "role": "user",
+        "status": "success",
+    })
+    start = time.monotonic()
+    load_test.post("question", message_ref.path)
+    return start, time.monotonic() - start, message_ref.path.rsplit('/', 1)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the time to the first visible text of /question answers with and without STREAM_ANSWER."
+    )
+    parser.add_argument("--questions", type=int, default=32, help="questions asked at each concurrency level")
+    parser.add_argument(
+        "--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[1, 8, 32],
+        help="questions asked at the same time; a comma separated list measures each level"
+    )
+    parser.add_argument("--first-chunk-ms", type=float, default=1200, help="median time to the first chunk of an answer")
+    parser.add_argument("--chunk-ms", type=float, default=80, help="median time between the following chunks")
+    parser.add_argument("--answer-chars", type=int, default=1500, help="characters of each answer")
+    parser.add_argument("--chunk-chars", type=int, default=50, help="characters of each chunk")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier of all latencies")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    latencies = {**DEFAULT_LATENCIES, "first_chunk": (args.first_chunk_ms, 0.3), "chunk": (args.chunk_ms, 0.3)}
+    latency = Latency(latencies, scale=args.latency_scale, seed=args.seed)
+    counter = OpCounter()
+    db = install_fakes(latency, counter)
+    vertexai.generative_models.GenerativeModel = make_streaming_model(latency, args.answer_chars, args.chunk_chars)
+    watcher = FirstContentWatcher(db)
+
+    import main as backend
+    logging.getLogger().setLevel(logging.WARNING)
+
+    load_test = LoadTest(backend.app, db, counter, Recorder(), 0, 0, 0, seed=args.seed)
+    for n in range(max(args.concurrency)):
+        db.collection("users").document(f"user{n}").set({"status": "creating"})
+        load_test.post("add_user", f"users/user{n}")
+
+    print(f"{'stream':<8}{'concurrency':>12}{'first text p50 ms':>19}{'p95 ms':>9}{'answer p50 ms':>15}{'p95 ms':>9}{'writes':>8}{'errors':>8}")
+    for stream in [False, True]:
+        backend.STREAM_ANSWER = stream
+        for concurrency in args.concurrency:
+            load_test.recorder = Recorder()
+            answer_writes = watcher.answer_writes
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [executor.submit(ask, load_test, db, f"user{n % concurrency}") for n in range(args.questions)]
+                results = [future.result() for future in futures]
+            first_text = [
+                (watcher.first_content[chat_path] - start) * 1000
+                for start, _, chat_path in results if chat_path in watcher.first_content
+            ]
+            totals = [seconds * 1000 for _, seconds, _ in results]
+            errors = sum(load_test.recorder.errors.values()) + len(results) - len(first_text)
+            print(
+                f"{str(stream):<8}{concurrency:>12}{percentile(first_text, 50):>19.0f}{percentile(first_text, 95):>9.0f}"
+                f"{percentile(totals, 50):>15.0f}{percentile(totals, 95):>9.0f}"
+                f"{(watcher.answer_writes - answer_writes) / len(results):>8.1f}{errors:>8}"
+            )
+
+    backend.shutdown()
+
+
+if __name__ == "__main__":
+    main()
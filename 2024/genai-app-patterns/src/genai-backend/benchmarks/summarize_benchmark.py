@@ -0,0 +1,58 @@
+import argparse
+import io
+import time
+
+from pypdf import PdfReader, PdfWriter
+
+
+def repeat_pages(data, pages):
+    """Return a synthetic PDF with the given number of pages, repeating the pages of data."""
+    reader = PdfReader(io.BytesIO(data))
+    writer = PdfWriter()
+    for i in range(pages):
+        writer.add_page(reader.pages[i % len(reader.pages)])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the wall-clock time of single-shot and map-reduce summarization of a large PDF with Vertex AI."
+    )
+    parser.add_argument("pdf", help="a local PDF file whose pages are repeated into a synthetic document")
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 200, 500], help="page counts of the synthetic documents")
+    parser.add_argument("--chunk-pages", type=int, default=None, help="pages per chunk (default: SUMMARY_CHUNK_PAGES)")
+    args = parser.parse_args()
+
+    # Uses FLASK_PROJECT_ID and FLASK_VERTEX_AI_LOCATION like the service
+    import main as backend
+    import pdf_chunks
+
+    with open(args.pdf, "rb") as f:
+        source = f.read()
+
+    print(f"{'pages':>6}{'chunks':>8}{'single-shot s':>15}{'map-reduce s':>14}{'single tokens':>15}{'map tokens':>12}")
+    for pages in args.pages:
+        data = repeat_pages(source, pages)
+
+        start = time.monotonic()
+        try:
+            _, single_tokens = backend.generate_summary(backend.generative_models.Part.from_data(data, "application/pdf"))
+            single_seconds = f"{time.monotonic() - start:.1f}"
+        except Exception as err:
+            # e.g. the document exceeds the context window
+            single_tokens, single_seconds = "-", type(err).__name__
+
+        chunks = pdf_chunks.split(data, args.chunk_pages or backend.SUMMARY_CHUNK_PAGES)
+        start = time.monotonic()
+        _, map_tokens = backend.generate_summary_map_reduce(chunks, lambda completed, total: None)
+        map_seconds = time.monotonic() - start
+
+        print(f"{pages:>6}{len(chunks):>8}{single_seconds:>15}{map_seconds:>14.1f}{single_tokens:>15}{map_tokens:>12}")
+
+    backend.shutdown()
+
+
+if __name__ == "__main__":
+    main()
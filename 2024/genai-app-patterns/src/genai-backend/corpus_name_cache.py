@@ -0,0 +1,58 @@
+import threading
+
+from cache import LRUCache
+
+
+class CorpusNameCache:
+    """Cache of each user's corpusName, which doesn't change once add_user() has set it.
+
+    With watch=True, a snapshot listener on each cached user document keeps
+    the entry up to date and drops it when the document is deleted.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, watch=False):
+        self.names = LRUCache(maxsize=maxsize, ttl=ttl, on_evict=self._unwatch)
+        self.watch = watch
+        self.watches = {}
+        self.lock = threading.Lock()
+        self.read_seconds = 0.0
+
+    @property
+    def hit_ratio(self):
+        return self.names.hit_ratio
+
+    @property
+    def saved_seconds(self):
+        """Estimated time saved, from the average time of the reads done on misses."""
+        misses = self.names.misses
+        return self.names.hits * self.read_seconds / misses if misses else 0.0
+
+    def get(self, uid):
+        return self.names.get(uid)
+
+    def set(self, uid, user_ref, corpus_name, read_seconds=0.0):
+        """Cache a corpus name that was read in read_seconds, or set by add_user()."""
+        with self.lock:
+            self.read_seconds += read_seconds
+            if corpus_name and self.watch and uid not in self.watches:
+                self.watches[uid] = user_ref.on_snapshot(self._on_snapshot(uid))
+        if corpus_name:
+            self.names.set(uid, corpus_name)
+
+    def _on_snapshot(self, uid):
+        def callback(doc_snapshots, changes, read_time):
+            doc = doc_snapshots[0] if doc_snapshots else None
+            corpus_name = doc.get("corpusName") if doc and doc.exists else None
+            if corpus_name:
+                self.names.set(uid, corpus_name)
+            else:
+                self.names.pop(uid)
+                # The listener can't be stopped from its own callback thread
+                threading.Thread(target=self._unwatch, args=(uid, None), daemon=True).start()
+        return callback
+
+    def _unwatch(self, uid, corpus_name):
+        with self.lock:
+            watch = self.watches.pop(uid, None)
+        if watch is not None:
+            watch.unsubscribe()
@@ -0,0 +1,102 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from google.api_core.exceptions import Conflict, FailedPrecondition
+
+from cache import LRUCache
+from lazy import LazyModule
+
+firestore = LazyModule("google.cloud.firestore")
+
+# States of an event returned by EventDeduplicator.start() when it is not claimed
+PROCESSING = "processing"
+DONE = "done"
+
+
+class EventDeduplicator:
+    """Detects redelivered CloudEvents with lease documents in Firestore.
+
+    start() claims an event by creating its document in the processing state
+    with a lease of lease_seconds, and complete() marks it done once the
+    handler has succeeded. fail() releases it, so that a redelivery is
+    processed again. If the instance holding the lease crashes or times out,
+    a redelivery claims the event again once the lease has expired.
+
+    Done keys are also kept in memory, so duplicates delivered to the same
+    instance are skipped without reading Firestore. Documents have an
+    expiresAt field that can back a Firestore TTL policy.
+    """
+
+    def __init__(self, db, collection_name="processedEvents", maxsize=10000, ttl_seconds=7 * 24 * 60 * 60, lease_seconds=600):
+        self.db = db
+        self.collection_ref = db.collection(collection_name)
+        self.done = LRUCache(maxsize=maxsize)
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.duplicates = 0
+        self.in_progress = 0
+        self.reclaimed = 0
+        self.lock = threading.Lock()
+
+    def start(self, key):
+        """Claim key for processing.
+
+        Returns None if it is claimed, DONE if it has already been processed,
+        or PROCESSING if another attempt holds an unexpired lease.
+        """
+        if self.done.get(key):
+            return self._skip(DONE)
+        doc_ref = self.collection_ref.document(key)
+        now = datetime.now(timezone.utc)
+        claim = {
+            "state": PROCESSING,
+            "leaseExpiresAt": now + timedelta(seconds=self.lease_seconds),
+            "attemptedAt": firestore.SERVER_TIMESTAMP,
+            "expiresAt": now + timedelta(seconds=self.ttl_seconds),
+        }
+        try:
+            doc_ref.create({**claim, "attempts": 1})
+            return None
+        except Conflict:
+            pass
+
+        doc = doc_ref.get()
+        if not doc.exists:
+            # Released by a failed attempt in the meantime, so the redelivery of that attempt processes it
+            return self._skip(PROCESSING)
+        # Documents written before leases were introduced have no state
+        if doc.to_dict().get("state", DONE) == DONE:
+            self.done.set(key, True)
+            return self._skip(DONE)
+        if doc.get("leaseExpiresAt") > now:
+            return self._skip(PROCESSING)
+
+        # The attempt holding the lease crashed or timed out
+        try:
+            doc_ref.update(
+                {**claim, "attempts": firestore.Increment(1)},
+                option=self.db.write_option(last_update_time=doc.update_time)
+            )
+        except FailedPrecondition:
+            # Another redelivery reclaimed it first
+            return self._skip(PROCESSING)
+        with self.lock:
+            self.reclaimed += 1
+        return None
+
+    def _skip(self, state):
+        with self.lock:
+            if state == DONE:
+                self.duplicates += 1
+            else:
+                self.in_progress += 1
+        return state
+
+    def complete(self, key):
+        """Mark key as processed, so that redeliveries are skipped."""
+        self.collection_ref.document(key).update({"state": DONE, "completedAt": firestore.SERVER_TIMESTAMP})
+        self.done.set(key, True)
+
+    def fail(self, key):
+        """Release key so that a redelivery of the failed event is processed again."""
+        self.collection_ref.document(key).delete()
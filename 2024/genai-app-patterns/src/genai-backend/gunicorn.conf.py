@@ -0,0 +1,34 @@
+import math
+import os
+
+# Cloud Run sets PORT
+bind = f":{os.environ.get('PORT', '8080')}"
+
+# A single worker process by default. The caches, the import queue and the
+# generation rate limit are per process, so each additional worker splits the
+# caches and adds its own rate limit. os.cpu_count() would also report the
+# CPUs of the host instead of the CPU limit of the Cloud Run instance.
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+# The handlers spend most of their time waiting for Vertex AI, Firestore and
+# Cloud Storage. A worker runs enough threads to keep its CPU busy while the
+# others wait: 1 / (1 - ratio of time spent waiting). The ratio is clamped to
+# [0, 0.99], since a ratio of 1 or more would mean unlimited threads.
+io_wait_ratio = min(max(float(os.environ.get("GUNICORN_IO_WAIT_RATIO", "0.95")), 0.0), 0.99)
+threads = int(os.environ.get("GUNICORN_THREADS", min(64, math.ceil(1 / (1 - io_wait_ratio)))))
+worker_class = "gthread"
+
+# A gthread worker that hasn't notified the arbiter for this long is hung and
+# restarted. Long requests don't count, since they run in the worker's threads
+# and Cloud Run enforces the request timeout (300 seconds by default).
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
+
+# Cloud Run sends SIGKILL 10 seconds after SIGTERM, so in-flight requests get
+# that long to finish before the worker exits
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "10"))
+
+
+def worker_exit(server, worker):
+    # Wait for the background work of the finished requests
+    import main
+    main.shutdown()
@@ -0,0 +1,124 @@
+import threading
+
+from cache import LRUCache
+from lazy import LazyModule
+
+generative_models = LazyModule("vertexai.generative_models")
+
+
+def estimate_tokens(text):
+    # Roughly 4 bytes per token for English and 3 bytes per character for Japanese
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+class NotebookHistory:
+    """Finalized chat messages of a notebook, kept as Content objects.
+
+    watermark is the createdAt of the last message that can no longer change
+    and content_count is the number of successful messages up to it.
+    """
+
+    def __init__(self):
+        self.reset()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        self.contents = []
+        self.watermark = None
+        self.content_count = 0
+
+
+class ChatHistoryCache:
+    """Per-notebook chat history cache that only reads messages newer than the watermark.
+
+    The message at the watermark is read again with the newer messages. If
+    it has been deleted (e.g. the chat history was cleared), the history is
+    read again from the beginning.
+    """
+
+    def __init__(self, maxsize=256, max_tokens=32000):
+        self.notebooks = LRUCache(maxsize=maxsize)
+        self.max_tokens = max_tokens
+        self.documents_read = 0
+
+    def invalidate(self, uid, notebook_id):
+        self.notebooks.pop((uid, notebook_id))
+
+    def load(self, chat_ref, uid, notebook_id):
+        """Return the history as a list of Content within the token budget.
+
+        The second return value holds per-request counters: whether the cache
+        was hit, the documents read and the estimated prompt tokens, and whether
+        the latest message is the only one in the conversation (history_free).
+        """
+        history = self.notebooks.get_or_set((uid, notebook_id), NotebookHistory)
+        with history.lock:
+            cache_hit = history.watermark is not None
+            docs = self._fetch(chat_ref, history)
+            documents_read = len(docs)
+
+            if cache_hit and (not docs or docs[0].get("createdAt") != history.watermark):
+                # The message at the watermark was deleted, so start over
+                history.reset()
+                cache_hit = False
+                docs = self._fetch(chat_ref, history)
+                documents_read += len(docs)
+            elif cache_hit:
+                docs = [doc for doc in docs if doc.get("createdAt") != history.watermark]
+
+            # Messages up to the first pending answer are final. The user message
+            # right before a pending answer may still be marked as failed.
+            final = len(docs)
+            for i, doc in enumerate(docs):
+                if doc.get("loading"):
+                    final = i
+                    break
+            if final > 0 and docs[final - 1].get("role") == "user":
+                final -= 1
+
+            for doc in docs[:final]:
+                history.watermark = doc.get("createdAt")
+                content = self._to_content(doc)
+                if content:
+                    history.contents.append(content)
+                    history.content_count += 1
+            history.contents = self._window(history.contents)
+
+            pending = [content for content in map(self._to_content, docs[final:]) if content]
+            contents = self._window(history.contents + pending)
+            history_free = history.content_count + len(pending) <= 1
+
+        self.documents_read += documents_read
+        stats = {
+            "cache_hit": cache_hit,
+            "documents_read": documents_read,
+            "prompt_tokens": sum(tokens for tokens, _ in contents),
+            "history_free": history_free,
+        }
+        return [content for _, content in contents], stats
+
+    def _fetch(self, chat_ref, history):
+        query = chat_ref.order_by("createdAt")
+        if history.watermark is not None:
+            # Includes the message at the watermark, to detect that it has been deleted
+            query = query.start_at({"createdAt": history.watermark})
+        return [doc.to_dict() for doc in query.stream()]
+
+    def _to_content(self, message):
+        if message.get("loading") or message.get("status") != "success":
+            return None
+        text = message.get("content")
+        return (estimate_tokens(text), generative_models.Content(role=message.get("role"), parts=[generative_models.Part.from_text(text)]))
+
+    def _window(self, contents):
+        """Keep the newest contents that fit within max_tokens, starting with a user turn."""
+        total = 0
+        start = len(contents)
+        while start > 0 and total + contents[start - 1][0] <= self.max_tokens:
+            start -= 1
+            total += contents[start][0]
+        # Always keep the latest message even if it alone exceeds the budget
+        start = min(start, max(len(contents) - 1, 0))
+        while start < len(contents) - 1 and contents[start][1].role != "user":
+            start += 1
+        return contents[start:]
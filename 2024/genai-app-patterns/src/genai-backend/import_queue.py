@@ -0,0 +1,52 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class CorpusImportQueue:
+    """Coalesces imports into the same corpus into batched import calls.
+
+    Only one import per corpus can run at a time, so files submitted while an
+    import is running are queued and imported together by the next call.
+    Different corpora are imported in parallel.
+    """
+
+    def __init__(self, import_files, batch_window=1.0, max_batch_size=25):
+        self.import_files = import_files
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, corpus_name, gcs_path):
+        """Queue gcs_path and return a Future resolved with the import response of its batch."""
+        future = Future()
+        with self.lock:
+            queue = self.pending.get(corpus_name)
+            if queue is None:
+                self.pending[corpus_name] = [(gcs_path, future)]
+                threading.Thread(target=self._run, args=(corpus_name,), daemon=True).start()
+            else:
+                queue.append((gcs_path, future))
+        return future
+
+    def _run(self, corpus_name):
+        # Give files uploaded at the same time a chance to join the first batch
+        time.sleep(self.batch_window)
+        while True:
+            with self.lock:
+                queue = self.pending[corpus_name]
+                if not queue:
+                    del self.pending[corpus_name]
+                    return
+                batch = queue[:self.max_batch_size]
+                del queue[:self.max_batch_size]
+
+            try:
+                response = self.import_files(corpus_name, [gcs_path for gcs_path, _ in batch])
+            except Exception as err:
+                for _, future in batch:
+                    future.set_exception(err)
+            else:
+                for _, future in batch:
+                    future.set_result(response)
@@ -0,0 +1,41 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """Imports a module on the first access to one of its attributes.
+
+    on_import is called once after the import, e.g. to initialize the SDK.
+    """
+
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_import:
+                        self._on_import()
+                    self._module = module
+        return getattr(self._module, attr)
+
+
+class LazyObject:
+    """Creates an object with factory on the first access to one of its attributes."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._object = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._object is None:
+            with self._lock:
+                if self._object is None:
+                    self._object = self._factory()
+        return getattr(self._object, attr)
@@ -1,19 +1,28 @@
+import base64
+import functools
+import json
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from logging.config import dictConfig
 
-import vertexai
 from cloudevents.http import from_http
 from flask import Flask, request
-from google.cloud import firestore, storage
-from tenacity import retry, wait_exponential
-from vertexai import rag
-from vertexai.generative_models import (
-    Content,
-    GenerationConfig,
-    GenerativeModel,
-    Part,
-    Tool,
-)
+from google.api_core.exceptions import NotFound, ResourceExhausted, TooManyRequests
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from answer_cache import AnswerCache
+from cache import LRUCache
+from corpus_name_cache import CorpusNameCache
+from dedupe import DONE, EventDeduplicator
+from history import ChatHistoryCache
+from import_queue import CorpusImportQueue
+from lazy import LazyModule, LazyObject
+from rate_limiter import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, AdaptiveRateLimiter
+from rag_file_index import RagFileIndex
+from result_cache import FirestoreResultCache, SQLiteResultCache, cache_key
+from telemetry import Telemetry
+from unit_of_work import UnitOfWork
 
 # Logging config
 dictConfig({
@@ -50,6 +59,46 @@ MAX_SUMMARIZATION_LENGTH = 2048
 MAX_TOTAL_COMMON_QUESTIONS_LENGTH = 1024
 SUMMARIZATION_FAILED_MESSAGE = "申し訳ございません。要約の生成に失敗しました。"
 MEANINGFUL_MINIMUM_QUESTION_LENGTH = 7
+# PDFs with at least MAP_REDUCE_MIN_PAGES pages are summarized in chunks of
+# SUMMARY_CHUNK_PAGES pages, and the chunk summaries are combined
+MAP_REDUCE_MIN_PAGES = 60
+SUMMARY_CHUNK_PAGES = 30
+SUMMARY_CONCURRENCY = 4
+MAX_CHUNK_SUMMARIZATION_LENGTH = 1024
+# Firestore sustains about one write per second on a single document,
+# so partial answers are coalesced before being flushed.
+STREAM_FLUSH_INTERVAL_MS = 1000
+STREAM_FLUSH_MIN_CHARS = 200
+HISTORY_CACHE_SIZE = 256
+MAX_HISTORY_TOKENS = 32000
+MODEL_POOL_SIZE = 128
+CORPUS_NAME_CACHE_SIZE = 1024
+CORPUS_NAME_CACHE_TTL_SECONDS = 60 * 60
+# Files uploaded within this window are imported into the corpus together
+IMPORT_BATCH_WINDOW_SECONDS = 1.0
+IMPORT_MAX_BATCH_SIZE = 25
+# Maximum number of rag files and Cloud Storage objects deleted at the same time
+DELETE_CONCURRENCY = 16
+# A redelivered event is processed again if the attempt holding it hasn't
+# finished within this lease, which must be longer than the request timeout
+EVENT_LEASE_SECONDS = 10 * 60
+# Bump a version when its prompt changes so that cached results are not reused
+PROMPT_VERSIONS = {"summarization": 1, "questions": 1, "analysis": 1}
+RESULT_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+RESULT_CACHE_MAX_ENTRIES = 10000
+ANSWER_CACHE_SIZE = 1024
+# Client side limit of generation requests of this process. It is adapted to
+# 429 responses between these rates, and /question is served before background work.
+GENERATION_MAX_REQUESTS_PER_MIN = 600
+GENERATION_MIN_REQUESTS_PER_MIN = 30
+ANALYSIS_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summarization": {"type": "string"},
+        "questions": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["summarization", "questions"],
+}
 
 # Obtain project_id from environment variable and will raise exception if not set
 try:
@@ -63,14 +112,104 @@ try:
 except KeyError:
     VERTEX_AI_LOCATION = "us-central1"
 
+# Stream partial answers into Firestore while they are being generated (see stream_benchmark.py)
+STREAM_ANSWER = app.config.get("STREAM_ANSWER", False)
+
+# Keep cached corpus names up to date with snapshot listeners on the user documents
+WATCH_CORPUS_NAMES = app.config.get("WATCH_CORPUS_NAMES", False)
+
+# Summarize large PDFs in page chunks concurrently (map-reduce) instead of in a single request
+SUMMARIZE_MAP_REDUCE = app.config.get("SUMMARIZE_MAP_REDUCE", False)
+
+# Store generated results in a local SQLite database instead of Firestore (e.g. for local testing)
+RESULT_CACHE_SQLITE_PATH = app.config.get("RESULT_CACHE_SQLITE_PATH")
+
+# Reuse cached answers of similar questions whose embeddings have at least this cosine similarity (e.g. 0.95)
+ANSWER_CACHE_SIMILARITY_THRESHOLD = app.config.get("ANSWER_CACHE_SIMILARITY_THRESHOLD")
+
+# Number of common questions answered in advance at the same time, and the tokens spent per source
+PRECOMPUTE_CONCURRENCY = app.config.get("PRECOMPUTE_CONCURRENCY", 4)
+PRECOMPUTE_TOKEN_BUDGET = app.config.get("PRECOMPUTE_TOKEN_BUDGET", 50000)
+
+# Export spans and metrics of each handler stage to "console" or to OTLP JSON "file"s under TELEMETRY_PATH
+TELEMETRY_EXPORTER = app.config.get("TELEMETRY_EXPORTER")
+TELEMETRY_PATH = app.config.get("TELEMETRY_PATH", "telemetry")
+
 bucket_name = f"{PROJECT_ID}.firebasestorage.app"
 
-vertexai.init(project=PROJECT_ID, location=VERTEX_AI_LOCATION)
-db = firestore.Client()
+@functools.cache
+def init_vertexai():
+    import vertexai
+    vertexai.init(project=PROJECT_ID, location=VERTEX_AI_LOCATION)
+
+# The SDKs are imported and the clients are created when a handler first uses them,
+# so that cold starts don't wait for the SDKs that the request doesn't need.
+rag = LazyModule("vertexai.rag", on_import=init_vertexai)
+generative_models = LazyModule("vertexai.generative_models", on_import=init_vertexai)
+language_models = LazyModule("vertexai.language_models", on_import=init_vertexai)
+storage = LazyModule("google.cloud.storage")
+firestore = LazyModule("google.cloud.firestore")
+pdf_chunks = LazyModule("pdf_chunks")
+
+telemetry = Telemetry("genai-backend", exporter=TELEMETRY_EXPORTER, path=TELEMETRY_PATH)
+db = LazyObject(lambda: firestore.Client())
+storage_client = LazyObject(lambda: storage.Client())
+model_pool = LRUCache(maxsize=MODEL_POOL_SIZE)
+generation_limiter = AdaptiveRateLimiter(
+    max_rate=GENERATION_MAX_REQUESTS_PER_MIN / 60,
+    min_rate=GENERATION_MIN_REQUESTS_PER_MIN / 60,
+    on_wait=telemetry.record_rate_limit_wait
+)
+telemetry.gauge(
+    "genai_backend.rate_limit.queue_depth", lambda: generation_limiter.queue_depth,
+    unit="{request}", description="Requests waiting for the client side rate limit"
+)
+telemetry.gauge(
+    "genai_backend.rate_limit.rate", lambda: generation_limiter.rate * 60,
+    unit="{request}/min", description="Current client side rate limit"
+)
 
-# Retry with exponential backoff since only one file can be imported at the same time
+# Background generations are retried when they are throttled, at the adapted rate
+retry_throttled = retry(
+    retry=retry_if_exception_type((ResourceExhausted, TooManyRequests)),
+    wait=wait_exponential(multiplier=2, max=30),
+    stop=stop_after_attempt(5),
+    reraise=True
+)
+history_cache = ChatHistoryCache(maxsize=HISTORY_CACHE_SIZE, max_tokens=MAX_HISTORY_TOKENS)
+rag_file_index = RagFileIndex(db, lambda **kwargs: rag.list_files(**kwargs))
+deletion_executor = ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY)
+precompute_executor = ThreadPoolExecutor(max_workers=PRECOMPUTE_CONCURRENCY)
+summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY)
+event_deduplicator = LazyObject(lambda: EventDeduplicator(db, lease_seconds=EVENT_LEASE_SECONDS))
+corpus_name_cache = CorpusNameCache(
+    maxsize=CORPUS_NAME_CACHE_SIZE,
+    ttl=CORPUS_NAME_CACHE_TTL_SECONDS,
+    watch=WATCH_CORPUS_NAMES
+)
+if RESULT_CACHE_SQLITE_PATH:
+    result_cache = SQLiteResultCache(RESULT_CACHE_SQLITE_PATH, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ENTRIES)
+else:
+    result_cache = LazyObject(
+        lambda: FirestoreResultCache(db, "resultCache", RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ENTRIES)
+    )
+
+def embed_text(text):
+    """Return the embedding of a question with the same model as the rag corpus."""
+    model_name = PUBLISHER_MODEL.split('/')[-1]
+    model = model_pool.get_or_set((model_name,), lambda: language_models.TextEmbeddingModel.from_pretrained(model_name))
+    return model.get_embeddings([language_models.TextEmbeddingInput(text, "RETRIEVAL_QUERY")])[0].values
+
+answer_cache = AnswerCache(
+    db,
+    embed=embed_text,
+    similarity_threshold=float(ANSWER_CACHE_SIMILARITY_THRESHOLD) if ANSWER_CACHE_SIMILARITY_THRESHOLD else None,
+    maxsize=ANSWER_CACHE_SIZE
+)
+
+# Retry with exponential backoff since only one import can run on a corpus at the same time
 @retry(wait=wait_exponential(multiplier=5, max=40))
-def import_files(corpus_name, gcs_path):
+def import_files(corpus_name, gcs_paths):
     transformation_config = rag.TransformationConfig(
         chunking_config=rag.ChunkingConfig(
             chunk_size=RAG_CHUNK_SIZE,
@@ -79,12 +218,163 @@ def import_files(corpus_name, gcs_path):
     )
     return rag.import_files(
         corpus_name,
-        paths=[gcs_path],
+        paths=gcs_paths,
         transformation_config=transformation_config,
         max_embedding_requests_per_min=RAG_MAX_EMBEDDING_REQUESTS_PER_MIN,
     )
 
+import_queue = CorpusImportQueue(
+    import_files,
+    batch_window=IMPORT_BATCH_WINDOW_SECONDS,
+    max_batch_size=IMPORT_MAX_BATCH_SIZE
+)
+
+def get_all_with_corpus_name(uow, users, uid, refs):
+    """Read refs and return the snapshots with the user's corpus name.
+
+    The user document is only read (in the same round trip) when its corpus name is not cached.
+    """
+    corpus_name = corpus_name_cache.get(uid)
+    with telemetry.stage("firestore_read", corpus_name_cached=bool(corpus_name)):
+        if corpus_name:
+            snapshots = uow.get_all(refs)
+        else:
+            user_ref = db.collection(users).document(uid)
+            start = time.monotonic()
+            *snapshots, user = uow.get_all(refs + [user_ref])
+            corpus_name = user.get("corpusName")
+            corpus_name_cache.set(uid, user_ref, corpus_name, read_seconds=time.monotonic() - start)
+    app.logger.info(
+        f"corpus name cache hit ratio: {corpus_name_cache.hit_ratio:.2f}, "
+        f"estimated time saved: {corpus_name_cache.saved_seconds:.3f}s"
+    )
+    return snapshots, corpus_name
+
+def get_model():
+    """Return a pooled GenerativeModel without any tools."""
+    return model_pool.get_or_set(
+        (GENERATIVE_MODEL_NAME,),
+        lambda: generative_models.GenerativeModel(model_name=GENERATIVE_MODEL_NAME)
+    )
+
+def get_rag_model(corpus_name, rag_file_ids):
+    """Return a pooled GenerativeModel that retrieves from the given rag files."""
+    system_instruction = "Output the result in markdown format."
+
+    def create():
+        rag_retrieval_tool = generative_models.Tool.from_retrieval(
+            retrieval=rag.Retrieval(
+                source=rag.VertexRagStore(
+                    rag_resources=[
+                        rag.RagResource(
+                            rag_corpus=corpus_name,
+                            rag_file_ids=rag_file_ids
+                        )
+                    ],
+                    rag_retrieval_config= rag.RagRetrievalConfig(
+                        top_k=RAG_SIMILARITY_TOP_K, 
+                        filter=rag.Filter(vector_similarity_threshold=RAG_VECTOR_SIMILARITY_THRESHOLD)
+                    )
+                ),
+            )
+        )
+
+        return generative_models.GenerativeModel(
+            model_name=GENERATIVE_MODEL_NAME,
+            tools=[rag_retrieval_tool],
+            system_instruction=[system_instruction]
+        )
+
+    key = (GENERATIVE_MODEL_NAME, corpus_name, tuple(sorted(rag_file_ids)), system_instruction)
+    return model_pool.get_or_set(key, create)
+
+def stream_answer(rag_model, contents, answer_ref):
+    """Generate an answer with streaming and flush partial text to answer_ref.
+
+    Chunks are coalesced and written at most every STREAM_FLUSH_INTERVAL_MS,
+    or earlier once STREAM_FLUSH_MIN_CHARS new characters have been received.
+    """
+    answer = ""
+    flushed_length = 0
+    last_flush = time.monotonic()
+    usage_metadata = None
+    with generation_limiter.limit(PRIORITY_INTERACTIVE):
+        for i, chunk in enumerate(rag_model.generate_content(contents=contents, stream=True)):
+            if i == 0:
+                # Retrieval and prompt processing happen before the first chunk
+                telemetry.event("first_chunk")
+            usage_metadata = chunk.usage_metadata
+            try:
+                answer += chunk.text
+            except ValueError:
+                # A chunk without text parts (e.g. only a finish reason)
+                continue
+
+            elapsed_ms = (time.monotonic() - last_flush) * 1000
+            pending = len(answer) - flushed_length
+            if pending and (elapsed_ms >= STREAM_FLUSH_INTERVAL_MS or pending >= STREAM_FLUSH_MIN_CHARS):
+                answer_ref.update({"content": answer})
+                flushed_length = len(answer)
+                last_flush = time.monotonic()
+
+    if not answer:
+        raise ValueError("no text is generated")
+    return answer, usage_metadata
+
+def deduplicate(handler=None, *, skip=None):
+    """Skip CloudEvents that the handler has already processed.
+
+    Eventarc delivers events at least once. An event is marked done only
+    after the handler has succeeded. If the handler fails, the event is
+    released so that its redelivery is processed again, and if the instance
+    crashes or times out, a redelivery processes it once the lease expires.
+
+    Events whose document matches skip are ignored before they are claimed,
+    so they cost no Firestore round trip.
+    """
+    if handler is None:
+        return functools.partial(deduplicate, skip=skip)
+
+    @functools.wraps(handler)
+    def wrapper():
+        event_id = request.headers.get("ce-id")
+        document = request.headers.get("ce-document")
+        if not event_id or (skip is not None and not document):
+            # Events in structured mode carry their attributes in the body
+            event = from_http(request.headers, request.get_data())
+            event_id = event.get("id")
+            document = event.get("document")
+        if skip is not None and skip(document):
+            app.logger.info(f"{event_id}: skipping event of {document}")
+            return ("skip event", 204)
+        key = f"{handler.__name__}-{event_id}"
+        state = event_deduplicator.start(key)
+        if state == DONE:
+            app.logger.info(f"{event_id}: skipping duplicate event: {event_deduplicator.duplicates} duplicates skipped")
+            return ("skip duplicate event", 204)
+        if state is not None:
+            # Eventarc retries the delivery with backoff, until the other attempt is done or its lease expires
+            app.logger.info(f"{event_id}: event is being processed by another attempt")
+            return ("event is being processed", 409)
+        try:
+            response = handler()
+        except Exception:
+            event_deduplicator.fail(key)
+            raise
+        if response[1] >= 500:
+            event_deduplicator.fail(key)
+            return response
+        try:
+            event_deduplicator.complete(key)
+        except Exception as err:
+            # The event is processed again only if it is redelivered after the lease expires
+            app.logger.info(f"{event_id}: failed marking the event as done: {err=}, {type(err)=}")
+        return response
+    return wrapper
+
 @app.route("/add_user", methods=["POST"])
+@telemetry.handler
+@deduplicate
 def add_user():
     event = from_http(request.headers, request.get_data())
     document = event.get("document")
@@ -101,20 +391,25 @@ def add_user():
             rag.VertexPredictionEndpoint(publisher_model=PUBLISHER_MODEL)
         )
     )
-    rag_corpus = rag.create_corpus(
-        display_name=uid,
-        backend_config=backend_config
-    )
+    with telemetry.stage("create_corpus"):
+        rag_corpus = rag.create_corpus(
+            display_name=uid,
+            backend_config=backend_config
+        )
     app.logger.info(f"{event_id}: finished creating a rag corpus for a user: {uid}")
     
     doc_ref = db.collection(users).document(uid)
-    doc_ref.update({"corpusName": rag_corpus.name, "status": "created"})
+    with telemetry.stage("firestore_write"):
+        doc_ref.update({"corpusName": rag_corpus.name, "status": "created"})
+    corpus_name_cache.set(uid, doc_ref, rag_corpus.name)
 
     app.logger.info(f"{event_id}: finished adding a user: {uid}")
 
     return ("finished", 204)
 
 @app.route("/add_source", methods=["POST"])
+@telemetry.handler
+@deduplicate
 def add_source():
     event = from_http(request.headers, request.get_data())
     event_id = event.get("id")
@@ -124,41 +419,48 @@ def add_source():
 
     app.logger.info(f"{event_id}: start adding a source: {sourceId}")
 
-    user_ref = db.collection(users).document(uid)
-    user = user_ref.get()
-    corpus_name = user.get("corpusName")
-
+    uow = UnitOfWork(db)
     doc_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(sources).document(sourceId)
-    doc = doc_ref.get()
+    (doc,), corpus_name = get_all_with_corpus_name(uow, users, uid, [doc_ref])
+
     name = doc.get("name")
     storagePath = doc.get("storagePath")
 
     gcs_path = f"gs://{PROJECT_ID}.firebasestorage.app{storagePath}"
 
     app.logger.info(f"{event_id}: start importing a source file: {name}")
-    response = import_files(corpus_name, gcs_path)
-    app.logger.info(f"{event_id}: finished importing a source file: {response.imported_rag_files_count} files are imported")
+    # Imports into the same corpus are batched with other uploads on this instance
+    with telemetry.stage("import_files"):
+        response = import_queue.submit(corpus_name, gcs_path).result()
+    app.logger.info(f"{event_id}: finished importing a source file: {response.imported_rag_files_count} files are imported in the batch")
+
+    imported_at = time.time()
 
     app.logger.info(f"{event_id}: start finding rag_file_id: {name}")
-    rag_files = list(rag.list_files(corpus_name=corpus_name))
-    rag_file_name = ""
     filename = storagePath.split('/')[-1]
-    for rag_file in rag_files:
-        if rag_file.display_name == filename:
-            rag_file_name = rag_file.name
-    if not rag_file_name:
-        app.logger.error(f"{event_id}: rag_file_name not found for {filename}")
+    index_ref = db.collection(users).document(uid).collection("ragFiles")
+    with telemetry.stage("find_rag_file"):
+        rag_file_id = rag_file_index.lookup(index_ref, corpus_name, filename, imported_at)
+    if not rag_file_id:
+        app.logger.error(f"{event_id}: rag_file_id not found for {filename}")
         return ("failed", 500)
-    rag_file_id = rag_file_name.split('/')[-1]
     app.logger.info(f"{event_id}: found rag_file_id: {rag_file_id}")
 
-    doc_ref.update({"status": "created", "ragFileId": rag_file_id})
+    uow.update(doc_ref, {"status": "created", "ragFileId": rag_file_id})
+    with telemetry.stage("firestore_write"):
+        uow.commit()
 
-    app.logger.info(f"{event_id}: finished adding a source: {sourceId} / {name} => {rag_file_id}")
+    app.logger.info(f"{event_id}: finished adding a source: {sourceId} / {name} => {rag_file_id}: {uow.round_trips} firestore round trips")
 
     return ("finished", 204)
 
+def is_answer(document):
+    """Whether document is an answer written by /question as {messageId}-answer."""
+    return document.split('/')[-1].endswith("-answer")
+
 @app.route("/question", methods=["POST"])
+@telemetry.handler
+@deduplicate(skip=is_answer)
 def question():
     event = from_http(request.headers, request.get_data())
     event_id = event.get("id")
@@ -168,78 +470,116 @@ def question():
 
     app.logger.info(f"{event_id}: start generating an answer: {messageId}")
 
+    uow = UnitOfWork(db)
     message_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(chat).document(messageId)
-    message = message_ref.get()
+    (message,), corpus_name = get_all_with_corpus_name(uow, users, uid, [message_ref])
 
     if message.get("role") == "model":
         return ("skip message from model", 204)
 
-    add_time, answer_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(chat).add({
-        "content": '',
-        "loading": True,
-        "ragFileIds": None,
-        "role": 'model',
-        "createdAt": firestore.SERVER_TIMESTAMP
-    })
-
-    user_ref = db.collection(users).document(uid)
-    user = user_ref.get()
-    corpus_name = user.get("corpusName")
+    # A reclaimed event overwrites the answer left loading by the attempt that crashed
+    answer_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(chat).document(f"{messageId}-answer")
+    with telemetry.stage("firestore_write"):
+        answer_ref.set({
+            "content": '',
+            "loading": True,
+            "ragFileIds": None,
+            "role": 'model',
+            "createdAt": firestore.SERVER_TIMESTAMP
+        })
 
     source_ids = message.get("ragFileIds")
     app.logger.info(f"{event_id}: {len(source_ids)} sources are selected")
 
-    rag_retrieval_tool = Tool.from_retrieval(
-        retrieval=rag.Retrieval(
-            source=rag.VertexRagStore(
-                rag_resources=[
-                    rag.RagResource(
-                        rag_corpus=corpus_name,
-                        rag_file_ids=source_ids
-                    )
-                ],
-                rag_retrieval_config= rag.RagRetrievalConfig(
-                    top_k=RAG_SIMILARITY_TOP_K, 
-                    filter=rag.Filter(vector_similarity_threshold=RAG_VECTOR_SIMILARITY_THRESHOLD)
-                )
-            ),
-        )
-    )
+    rag_model = get_rag_model(corpus_name, source_ids)
 
-    rag_model = GenerativeModel(
-        model_name=GENERATIVE_MODEL_NAME,
-        tools=[rag_retrieval_tool],
-        system_instruction=["Output the result in markdown format."]
-    )
-
-    chat_messages = (
-        db.collection(users).document(uid)
-        .collection(notebooks).document(notebookId)
-        .collection('chat')
-        .order_by('createdAt')
-        .stream()
-    )
+    # Only messages newer than the cached history are read from Firestore
+    with telemetry.stage("load_history") as span:
+        contents, history_stats = history_cache.load(
+            db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(chat),
+            uid,
+            notebookId
+        )
+        span.set_attributes(history_stats)
+    app.logger.info(f"{event_id}: {len(contents)} contents are used: {history_stats}")
 
-    contents = [Content(role=chat_message.get("role"), parts=[Part.from_text(chat_message.get("content"))]) 
-            for chat_message in chat_messages if not chat_message.get("loading") and chat_message.get("status") == "success"]
-    app.logger.info(f"{event_id}: {len(contents)} contents are used")
+    answer_cache_ref = db.collection(users).document(uid).collection("answerCache")
+    try:
+        with telemetry.stage("answer_cache") as span:
+            answer = answer_cache.lookup(answer_cache_ref, message.get("content"), source_ids, history_stats["history_free"])
+            span.set_attribute("hit", answer is not None)
+    except Exception as err:
+        answer = None
+        app.logger.info(f"{event_id}: failed looking up the answer cache: {err=}, {type(err)=}")
+    app.logger.info(f"{event_id}: answer cache hit ratio: {answer_cache.hit_ratio:.2f}")
+    app.logger.info(f"{event_id}: generation rate limit: {generation_limiter.stats()}")
+    if answer is not None:
+        uow.update(answer_ref, {"content": answer, "loading": False, "status": "success"})
+        uow.update(message_ref, {"loading": False, "status": "success"})
+        with telemetry.stage("firestore_write"):
+            uow.commit()
+        app.logger.info(f"{event_id}: finished answering from the cache: {messageId}: {uow.round_trips} firestore round trips")
+        return ("finished", 204)
 
     try:
         app.logger.info(f"{event_id}: start generating content")
-        response = rag_model.generate_content(contents=contents)
-        app.logger.info(f"{event_id}: finished generating content")
-
-        answer_ref.update({"content": response.text, "loading": False, "status": "success"})
-        message_ref.update({"loading": False, "status": "success"})
+        # RAG retrieval runs inside the generation request
+        with telemetry.stage("generate_content", stream=STREAM_ANSWER):
+            if STREAM_ANSWER:
+                answer, usage_metadata = stream_answer(rag_model, contents, answer_ref)
+            else:
+                with generation_limiter.limit(PRIORITY_INTERACTIVE):
+                    response = rag_model.generate_content(contents=contents)
+                answer, usage_metadata = response.text, response.usage_metadata
+            telemetry.record_tokens(usage_metadata, GENERATIVE_MODEL_NAME)
+        app.logger.info(f"{event_id}: finished generating content: {usage_metadata.prompt_token_count} prompt tokens")
+
+        uow.update(answer_ref, {"content": answer, "loading": False, "status": "success"})
+        uow.update(message_ref, {"loading": False, "status": "success"})
+        with telemetry.stage("firestore_write"):
+            uow.commit()
         app.logger.info(f"{event_id}: finished generating an answer: {messageId}")
     except Exception as err:
-        message_ref.update({"loading": False, "status": "failed"})
-        answer_ref.update({"content": QUESTION_FAILED_MESSAGE, "loading": False, "status": "failed"})
+        uow.update(message_ref, {"loading": False, "status": "failed"})
+        uow.update(answer_ref, {"content": QUESTION_FAILED_MESSAGE, "loading": False, "status": "failed"})
+        with telemetry.stage("firestore_write"):
+            uow.commit()
         app.logger.info(f"{event_id}: failed generating an answer: {err=}, {type(err)=}")
+        answer = None
+
+    # Answers that depend on earlier messages can't be reused for other conversations
+    if answer is not None and history_stats["history_free"]:
+        try:
+            answer_cache.store(answer_cache_ref, message.get("content"), source_ids, answer)
+        except Exception as err:
+            app.logger.info(f"{event_id}: failed storing the answer in the cache: {err=}, {type(err)=}")
+
+    app.logger.info(f"{event_id}: {uow.round_trips} firestore round trips for reading the message and writing the results")
 
     return ("finished", 204)
 
+def delete_blob(storagePath):
+    try:
+        storage_client.bucket(bucket_name).blob(storagePath[1:]).delete()
+    except NotFound:
+        pass
+
+def delete_rag_file(corpus_name, rag_file_id):
+    try:
+        rag.delete_file(f"{corpus_name}/ragFiles/{rag_file_id}", corpus_name=corpus_name)
+    except NotFound:
+        # Deleted by a previous attempt
+        pass
+
+def submit_source_files_deletion(corpus_name, rag_file_id, storagePath):
+    """Start deleting the rag file and the Cloud Storage object of a source in parallel."""
+    futures = [deletion_executor.submit(delete_blob, storagePath)]
+    if rag_file_id:
+        futures.append(deletion_executor.submit(delete_rag_file, corpus_name, rag_file_id))
+    return futures
+
 @app.route("/update_source", methods=["POST"])
+@telemetry.handler
 def update_source():
     event = from_http(request.headers, request.get_data())
     event_id = event.get("id")
@@ -247,8 +587,9 @@ def update_source():
 
     users, uid, notebooks, notebookId, sources, sourceId = document.split('/')
 
+    uow = UnitOfWork(db)
     doc_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(sources).document(sourceId)
-    doc = doc_ref.get()
+    (doc,), corpus_name = get_all_with_corpus_name(uow, users, uid, [doc_ref])
 
     name = doc.get("name")
     status = doc.get("status")
@@ -258,56 +599,143 @@ def update_source():
 
     app.logger.info(f"{event_id}: start deleting a source: {name}")
 
-    user_ref = db.collection(users).document(uid)
-    user = user_ref.get()
-    corpus_name = user.get("corpusName")
-
     rag_file_id = doc.get("ragFileId")
-    rag_file = f"{corpus_name}/ragFiles/{rag_file_id}"
+    storagePath = doc.get("storagePath")
 
-    app.logger.info(f"{event_id}: start deleting a rag file: {rag_file}")
-    rag.delete_file(rag_file, corpus_name=corpus_name)
-    app.logger.info(f"{event_id}: finished deleting a rag file: {rag_file}")
+    app.logger.info(f"{event_id}: start deleting a rag file and a source file from cloud storage: {rag_file_id} / {bucket_name}{storagePath}")
+    with telemetry.stage("delete_files"):
+        for future in submit_source_files_deletion(corpus_name, rag_file_id, storagePath):
+            future.result()
+    app.logger.info(f"{event_id}: finished deleting a rag file and a source file from cloud storage: {rag_file_id} / {bucket_name}{storagePath}")
 
-    storage_client = storage.Client()
-    storagePath = doc.get("storagePath")
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(storagePath[1:])
-    app.logger.info(f"{event_id}: start deleting a source file from cloud storage: {bucket_name}{storagePath}")
-    blob.delete()
-    app.logger.info(f"{event_id}: finished deleting a source file from cloud storage: {bucket_name}{storagePath}")
+    index_ref = db.collection(users).document(uid).collection("ragFiles")
+    uow.delete(rag_file_index.remove(index_ref, corpus_name, storagePath.split('/')[-1]))
+    # Cached answers may cite the deleted source
+    if rag_file_id:
+        answer_cache_ref = db.collection(users).document(uid).collection("answerCache")
+        for ref in answer_cache.evict_rag_files(answer_cache_ref, [rag_file_id]):
+            uow.delete(ref)
 
     notebook_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId)
-    notebook_ref.update({"sourceCount": firestore.Increment(-1)})
-
-    doc_ref.delete()
+    uow.update(notebook_ref, {"sourceCount": firestore.Increment(-1)})
+    uow.delete(doc_ref)
+    with telemetry.stage("firestore_write"):
+        uow.commit()
 
-    app.logger.info(f"{event_id}: finished deleting a source: {name}")
+    app.logger.info(f"{event_id}: finished deleting a source: {name}: {uow.round_trips} firestore round trips")
 
     return ("finished", 204)
 
-@app.route("/summarize", methods=["POST"])
-def summarize():
+@app.route("/delete_notebook", methods=["POST"])
+@telemetry.handler
+@deduplicate
+def delete_notebook():
+    """Delete a notebook whose status is deleting, together with all of its sources.
+
+    Triggered by updates of users/{uid}/notebooks/{notebookId}.
+    """
     event = from_http(request.headers, request.get_data())
     event_id = event.get("id")
     document = event.get("document")
 
-    users, uid, notebooks, notebookId, sources, sourceId = document.split('/')
+    users, uid, notebooks, notebookId = document.split('/')
 
-    app.logger.info(f"{event_id}: start summarizing a source: {sourceId}")
+    uow = UnitOfWork(db)
+    notebook_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId)
+    (notebook,), corpus_name = get_all_with_corpus_name(uow, users, uid, [notebook_ref])
 
-    doc_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(sources).document(sourceId)
-    doc = doc_ref.get()
+    if (notebook.to_dict() or {}).get("status") != "deleting":
+        app.logger.info(f"{event_id}: skipping since notebook is not deleting: {notebookId}")
+        return ("finished", 204)
 
-    file_type = doc.get("type")
-    storagePath = doc.get("storagePath")
-    gcs_path = f"gs://{PROJECT_ID}.firebasestorage.app{storagePath}"
+    sources = list(notebook_ref.collection("sources").stream())
+    app.logger.info(f"{event_id}: start deleting a notebook: {notebookId} with {len(sources)} sources")
+
+    # Rag files and Cloud Storage objects of all the sources are deleted in parallel
+    source_futures = [
+        (source, submit_source_files_deletion(corpus_name, source.get("ragFileId"), source.get("storagePath")))
+        for source in sources
+    ]
+    wait([future for _, futures in source_futures for future in futures])
+
+    index_ref = db.collection(users).document(uid).collection("ragFiles")
+    answer_cache_ref = db.collection(users).document(uid).collection("answerCache")
+    deleted_rag_file_ids = []
+    deleted = 0
+    for source, futures in source_futures:
+        errors = [future.exception() for future in futures if future.exception()]
+        if errors:
+            app.logger.error(f"{event_id}: failed deleting a source: {source.id}: {errors}")
+            continue
+        uow.delete(rag_file_index.remove(index_ref, corpus_name, source.get("storagePath").split('/')[-1]))
+        if source.get("ragFileId"):
+            deleted_rag_file_ids.append(source.get("ragFileId"))
+        uow.delete(source.reference)
+        deleted += 1
+    # Cached answers may cite the deleted sources
+    for ref in answer_cache.evict_rag_files(answer_cache_ref, deleted_rag_file_ids):
+        uow.delete(ref)
+
+    if deleted < len(sources):
+        # Keep the notebook so that the remaining sources are deleted when Eventarc retries the event.
+        # The notebook itself is not updated, as that would trigger another deletion at the same time.
+        uow.commit()
+        app.logger.error(f"{event_id}: failed deleting {len(sources) - deleted} sources of a notebook: {notebookId}")
+        return ("failed", 500)
+
+    uow.commit()
+    # Delete the notebook with its chat messages and notes
+    db.recursive_delete(notebook_ref)
+    history_cache.invalidate(uid, notebookId)
 
-    model = GenerativeModel(model_name=GENERATIVE_MODEL_NAME)
+    app.logger.info(f"{event_id}: finished deleting a notebook: {notebookId}: {deleted} sources")
+
+    return ("finished", 204)
 
-    doc_part = Part.from_uri(gcs_path, file_type)
+def get_content_hash(storagePath):
+    """Return a hex digest of the object's content from its Cloud Storage metadata, or None if it doesn't exist."""
+    blob = storage_client.bucket(bucket_name).get_blob(storagePath[1:])
+    if blob is None:
+        return None
+    # Composite objects don't have an MD5 hash
+    return base64.b64decode(blob.md5_hash or blob.crc32c).hex()
+
+def result_cache_key(kind, storagePath):
+    content_hash = get_content_hash(storagePath)
+    if content_hash is None:
+        return None
+    return cache_key(content_hash, kind, PROMPT_VERSIONS[kind], GENERATIVE_MODEL_NAME)
+
+def get_cached_result(kind, storagePath, event_id):
+    """Return the cache key and the cached result of a source.
+
+    A missing object or an error of Cloud Storage or the cache is treated as a
+    miss, so the result is generated instead of failing the request.
+    """
+    try:
+        key = result_cache_key(kind, storagePath)
+        return key, result_cache.get(key) if key is not None else None
+    except Exception as err:
+        app.logger.info(f"{event_id}: failed looking up the result cache: {err=}, {type(err)=}")
+        return None, None
 
-    config = GenerationConfig(
+def set_cached_result(key, value, tokens, event_id):
+    if key is None:
+        return
+    try:
+        result_cache.set(key, value, tokens)
+    except Exception as err:
+        app.logger.info(f"{event_id}: failed storing a result in the cache: {err=}, {type(err)=}")
+
+def log_result_cache(event_id):
+    app.logger.info(f"{event_id}: result cache hit ratio: {result_cache.hit_ratio:.2f}, saved tokens: {result_cache.saved_tokens}")
+
+@retry_throttled
+def generate_summary(doc_part):
+    """Generate a summary of the document and return it with the total token count."""
+    model = get_model()
+
+    config = generative_models.GenerationConfig(
         max_output_tokens=MAX_SUMMARIZATION_LENGTH + 1000, temperature=0, top_p=1, top_k=32,
     )
 
@@ -318,41 +746,150 @@ def summarize():
     Surround the keypoint sentence or words by **.
     """
 
-    try:
-        app.logger.info(f"{event_id}: start generating a summary for a source: {sourceId}")
+    with generation_limiter.limit(PRIORITY_BACKGROUND):
         response = model.generate_content([doc_part, prompt], generation_config=config)
-        app.logger.info(f"{event_id}: finished generating a summary for a source: {sourceId}")
-        doc_ref.update({"summarization": response.text})
-        app.logger.info(f"{event_id}: finished summarizing a source: {sourceId}")
-    except Exception as err:
-        app.logger.info(f"{event_id}: failed generating a summary for a source: {sourceId}")
-        doc_ref.update({"summarization": SUMMARIZATION_FAILED_MESSAGE})
-        app.logger.info(f"{event_id}: failed summarizing a source: {err=}, {type(err)=}")
+    telemetry.record_tokens(response.usage_metadata, GENERATIVE_MODEL_NAME)
+    return response.text, response.usage_metadata.total_token_count
+
+def split_for_summary(file_type, storagePath):
+    """Return the page chunks of a PDF that is large enough for map-reduce summarization, or None."""
+    if not SUMMARIZE_MAP_REDUCE or file_type != "application/pdf":
+        return None
+    data = storage_client.bucket(bucket_name).blob(storagePath[1:]).download_as_bytes()
+    return pdf_chunks.split(data, SUMMARY_CHUNK_PAGES, min_pages=MAP_REDUCE_MIN_PAGES)
+
+@retry_throttled
+def generate_chunk_summary(chunk, first_page, last_page):
+    """Summarize the pages of a chunk and return the summary with the total token count."""
+    model = get_model()
+
+    config = generative_models.GenerationConfig(
+        max_output_tokens=MAX_CHUNK_SUMMARIZATION_LENGTH + 500, temperature=0, top_p=1, top_k=32,
+    )
 
-    return ("finished", 204)
+    prompt = f"""You are an AI assistant.
 
-@app.route("/generate_common_questions", methods=["POST"])
-def generate_common_questions():
+    Summarize pages {first_page} to {last_page} of a longer document.
+    Keep the key facts, numbers and terms, since the summaries of all the pages are combined later.
+    Output the result in Japanese and the result must be less than {MAX_CHUNK_SUMMARIZATION_LENGTH} characters.
+    """
+
+    chunk_part = generative_models.Part.from_data(chunk, "application/pdf")
+    with generation_limiter.limit(PRIORITY_BACKGROUND):
+        response = model.generate_content([chunk_part, prompt], generation_config=config)
+    telemetry.record_tokens(response.usage_metadata, GENERATIVE_MODEL_NAME)
+    return response.text, response.usage_metadata.total_token_count
+
+def generate_summary_map_reduce(chunks, on_progress):
+    """Summarize the chunks concurrently and combine the summaries.
+
+    on_progress(completed, total) is called as chunk summaries complete.
+    Returns the summary with the total token count.
+    """
+    futures = {
+        summary_executor.submit(generate_chunk_summary, chunk, first_page, last_page): i
+        for i, (first_page, last_page, chunk) in enumerate(chunks)
+    }
+    summaries = [None] * len(chunks)
+    tokens = 0
+    for completed, future in enumerate(as_completed(futures), 1):
+        summaries[futures[future]], chunk_tokens = future.result()
+        tokens += chunk_tokens
+        on_progress(completed, len(chunks))
+
+    summary, reduce_tokens = combine_summaries(chunks, summaries)
+    return summary, tokens + reduce_tokens
+
+@retry_throttled
+def combine_summaries(chunks, summaries):
+    """Combine the summaries of the chunks and return the summary with the total token count."""
+    model = get_model()
+
+    config = generative_models.GenerationConfig(
+        max_output_tokens=MAX_SUMMARIZATION_LENGTH + 1000, temperature=0, top_p=1, top_k=32,
+    )
+
+    prompt = f"""You are an AI assistant.
+
+    The following are the summaries of consecutive pages of a document.
+    Combine them into a summary of the whole document for readers who doesn't have enough domain knowledge.
+    Output the result in Japanese and the result must be less than {MAX_SUMMARIZATION_LENGTH} characters.
+    Surround the keypoint sentence or words by **.
+    """
+
+    chunk_summaries = "\n\n".join(
+        f"## Pages {first_page}-{last_page}\n{summary}" for (first_page, last_page, _), summary in zip(chunks, summaries)
+    )
+    with generation_limiter.limit(PRIORITY_BACKGROUND):
+        response = model.generate_content([chunk_summaries, prompt], generation_config=config)
+    telemetry.record_tokens(response.usage_metadata, GENERATIVE_MODEL_NAME)
+    return response.text, response.usage_metadata.total_token_count
+
+@app.route("/summarize", methods=["POST"])
+@telemetry.handler
+@deduplicate
+def summarize():
     event = from_http(request.headers, request.get_data())
     event_id = event.get("id")
     document = event.get("document")
 
     users, uid, notebooks, notebookId, sources, sourceId = document.split('/')
 
-    app.logger.info(f"{event_id}: start generating common questions: {sourceId}")
+    app.logger.info(f"{event_id}: start summarizing a source: {sourceId}")
 
     doc_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(sources).document(sourceId)
-    doc = doc_ref.get()
+    with telemetry.stage("firestore_read"):
+        doc = doc_ref.get()
 
     file_type = doc.get("type")
     storagePath = doc.get("storagePath")
     gcs_path = f"gs://{PROJECT_ID}.firebasestorage.app{storagePath}"
 
-    model = GenerativeModel(model_name=GENERATIVE_MODEL_NAME)
+    doc_part = generative_models.Part.from_uri(gcs_path, file_type)
+
+    try:
+        with telemetry.stage("result_cache") as span:
+            key, summarization = get_cached_result("summarization", storagePath, event_id)
+            span.set_attribute("hit", summarization is not None)
+        log_result_cache(event_id)
+        app.logger.info(f"{event_id}: generation rate limit: {generation_limiter.stats()}")
+        if summarization is None:
+            app.logger.info(f"{event_id}: start generating a summary for a source: {sourceId}")
+            chunks = split_for_summary(file_type, storagePath)
+            if chunks:
+                app.logger.info(f"{event_id}: summarizing {chunks[-1][1]} pages in {len(chunks)} chunks")
+                last_progress = 0
+
+                def on_progress(completed, total):
+                    nonlocal last_progress
+                    # Progress is written at most once per second, like streamed answers
+                    if completed == total or time.monotonic() - last_progress >= STREAM_FLUSH_INTERVAL_MS / 1000:
+                        doc_ref.update({"summarizationProgress": {"completed": completed, "total": total}})
+                        last_progress = time.monotonic()
+
+                with telemetry.stage("generate_content", chunks=len(chunks)):
+                    summarization, tokens = generate_summary_map_reduce(chunks, on_progress)
+            else:
+                with telemetry.stage("generate_content"):
+                    summarization, tokens = generate_summary(doc_part)
+            app.logger.info(f"{event_id}: finished generating a summary for a source: {sourceId}")
+            set_cached_result(key, summarization, tokens, event_id)
+        with telemetry.stage("firestore_write"):
+            doc_ref.update({"summarization": summarization})
+        app.logger.info(f"{event_id}: finished summarizing a source: {sourceId}")
+    except Exception as err:
+        app.logger.info(f"{event_id}: failed generating a summary for a source: {sourceId}")
+        doc_ref.update({"summarization": SUMMARIZATION_FAILED_MESSAGE})
+        app.logger.info(f"{event_id}: failed summarizing a source: {err=}, {type(err)=}")
+
+    return ("finished", 204)
 
-    doc_part = Part.from_uri(gcs_path, file_type)
+@retry_throttled
+def generate_raw_questions(doc_part):
+    """Generate common questions of the document and return them with the total token count."""
+    model = get_model()
 
-    config = GenerationConfig(
+    config = generative_models.GenerationConfig(
         max_output_tokens=MAX_TOTAL_COMMON_QUESTIONS_LENGTH, temperature=0, top_p=1, top_k=32,
     )
 
@@ -364,19 +901,17 @@ Propose up to 5 common questions based on the content, adhering to the following
 - Output the results in Japanese, with each question on a new line.
 - Each question should be a single sentence and no more than 30 characters long."""
 
-    questions = []
-    raw_questions = []
-    try:
-        app.logger.info(f"{event_id}: start generating commmon raw questions: {sourceId}")
+    with generation_limiter.limit(PRIORITY_BACKGROUND):
         response = model.generate_content([doc_part, prompt], generation_config=config)
-        app.logger.info(f"{event_id}: finished generating commmon raw questions: {sourceId}")
-        raw_questions = response.text.splitlines()
-    except Exception:
-        app.logger.info(f"{event_id}: failed generating common questions: {sourceId}")
-
     # Remove unnecessary numbers (1. ,2. ,3. ) or hyphens (- ) at the beginning of the questions.
-    for raw_question in raw_questions:
-        question = raw_question.split()[1] if ' ' in raw_question else raw_question
+    raw_questions = [raw_question.split()[1] if ' ' in raw_question else raw_question
+                     for raw_question in response.text.splitlines()]
+    telemetry.record_tokens(response.usage_metadata, GENERATIVE_MODEL_NAME)
+    return raw_questions, response.usage_metadata.total_token_count
+
+def clean_questions(raw_questions, event_id):
+    questions = []
+    for question in raw_questions:
         # Skip if the question is too short
         if len(question) < MEANINGFUL_MINIMUM_QUESTION_LENGTH:
             app.logger.info(f"{event_id}: skipping generated common question: {question}")
@@ -384,12 +919,254 @@ Propose up to 5 common questions based on the content, adhering to the following
         questions.append(question)
 
     # Delete duplicate questions
-    questions = list(set(questions))
+    return list(set(questions))
+
+@app.route("/generate_common_questions", methods=["POST"])
+@telemetry.handler
+@deduplicate
+def generate_common_questions():
+    event = from_http(request.headers, request.get_data())
+    event_id = event.get("id")
+    document = event.get("document")
+
+    users, uid, notebooks, notebookId, sources, sourceId = document.split('/')
+
+    app.logger.info(f"{event_id}: start generating common questions: {sourceId}")
+
+    doc_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(sources).document(sourceId)
+    with telemetry.stage("firestore_read"):
+        doc = doc_ref.get()
 
-    doc_ref.update({"questions": questions})
+    file_type = doc.get("type")
+    storagePath = doc.get("storagePath")
+    gcs_path = f"gs://{PROJECT_ID}.firebasestorage.app{storagePath}"
+
+    doc_part = generative_models.Part.from_uri(gcs_path, file_type)
+
+    with telemetry.stage("result_cache") as span:
+        key, questions = get_cached_result("questions", storagePath, event_id)
+        span.set_attribute("hit", questions is not None)
+    log_result_cache(event_id)
+    if questions is None:
+        raw_questions = None
+        try:
+            app.logger.info(f"{event_id}: start generating commmon raw questions: {sourceId}")
+            with telemetry.stage("generate_content"):
+                raw_questions, tokens = generate_raw_questions(doc_part)
+            app.logger.info(f"{event_id}: finished generating commmon raw questions: {sourceId}")
+        except Exception:
+            app.logger.info(f"{event_id}: failed generating common questions: {sourceId}")
+
+        questions = clean_questions(raw_questions or [], event_id)
+        if raw_questions is not None:
+            set_cached_result(key, questions, tokens, event_id)
+
+    with telemetry.stage("firestore_write"):
+        doc_ref.update({"questions": questions})
     app.logger.info(f"{event_id}: finished generating common questions: {len(questions)} questions -> {sourceId}")
 
     return ("finished", 204)
 
+@retry_throttled
+def analyze(doc_part):
+    """Generate a summary and common questions of the document in a single request.
+
+    Returns the summary, the questions and the total token count.
+    """
+    model = get_model()
+
+    config = generative_models.GenerationConfig(
+        max_output_tokens=MAX_SUMMARIZATION_LENGTH + 1000 + MAX_TOTAL_COMMON_QUESTIONS_LENGTH,
+        temperature=0, top_p=1, top_k=32,
+        response_mime_type="application/json",
+        response_schema=ANALYSIS_RESPONSE_SCHEMA,
+    )
+
+    prompt = f"""You are an AI assistant.
+
+Analyze the content and output the following fields:
+- summarization: Summarize the contents for readers who doesn't have enough domain knowledge.
+  Output the result in Japanese and the result must be less than {MAX_SUMMARIZATION_LENGTH} characters.
+  Surround the keypoint sentence or words by **.
+- questions: Propose up to 5 common questions based on the content.
+  The questions should be general and based on the PDF content.
+  Output the questions in Japanese without any numbers or hyphens at the beginning.
+  Each question should be a single sentence and no more than 30 characters long."""
+
+    with generation_limiter.limit(PRIORITY_BACKGROUND):
+        response = model.generate_content([doc_part, prompt], generation_config=config)
+    telemetry.record_tokens(response.usage_metadata, GENERATIVE_MODEL_NAME)
+    result = json.loads(response.text)
+    return result["summarization"], result["questions"], response.usage_metadata.total_token_count
+
+@app.route("/analyze_source", methods=["POST"])
+@telemetry.handler
+@deduplicate
+def analyze_source():
+    """Generate both the summary and the common questions of a source.
+
+    This can replace the /summarize and /generate_common_questions triggers,
+    so the document is only sent to the model once.
+    """
+    event = from_http(request.headers, request.get_data())
+    event_id = event.get("id")
+    document = event.get("document")
+
+    users, uid, notebooks, notebookId, sources, sourceId = document.split('/')
+
+    app.logger.info(f"{event_id}: start analyzing a source: {sourceId}")
+
+    doc_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(sources).document(sourceId)
+    doc = doc_ref.get()
+
+    file_type = doc.get("type")
+    storagePath = doc.get("storagePath")
+    gcs_path = f"gs://{PROJECT_ID}.firebasestorage.app{storagePath}"
+
+    # Identical files uploaded again reuse the previous result
+    key, cached = get_cached_result("analysis", storagePath, event_id)
+    log_result_cache(event_id)
+    if cached is not None:
+        doc_ref.update(cached)
+        app.logger.info(f"{event_id}: finished analyzing a source from the cache: {sourceId}")
+        return ("finished", 204)
+
+    doc_part = generative_models.Part.from_uri(gcs_path, file_type)
+
+    try:
+        app.logger.info(f"{event_id}: start generating an analysis for a source: {sourceId}")
+        summarization, raw_questions, tokens = analyze(doc_part)
+        app.logger.info(f"{event_id}: finished generating an analysis for a source: {sourceId}")
+    except Exception as err:
+        # Fall back to generating the summary and the questions separately
+        app.logger.info(f"{event_id}: failed generating an analysis, falling back to separate requests: {err=}, {type(err)=}")
+        summarization, raw_questions, tokens = None, None, 0
+        try:
+            summarization, summarization_tokens = generate_summary(doc_part)
+            tokens += summarization_tokens
+        except Exception as err:
+            app.logger.info(f"{event_id}: failed generating a summary for a source: {err=}, {type(err)=}")
+        try:
+            raw_questions, questions_tokens = generate_raw_questions(doc_part)
+            tokens += questions_tokens
+        except Exception:
+            app.logger.info(f"{event_id}: failed generating common questions: {sourceId}")
+
+    questions = clean_questions(raw_questions or [], event_id)[:5]
+
+    doc_ref.update({"summarization": summarization or SUMMARIZATION_FAILED_MESSAGE, "questions": questions})
+    if summarization and raw_questions is not None:
+        set_cached_result(key, {"summarization": summarization, "questions": questions}, tokens, event_id)
+
+    app.logger.info(f"{event_id}: finished analyzing a source: {len(questions)} questions -> {sourceId}")
+
+    return ("finished", 204)
+
+@retry_throttled
+def precompute_answer(rag_model, question):
+    """Answer a common question without any chat history and return the answer with the total token count."""
+    with generation_limiter.limit(PRIORITY_BACKGROUND):
+        response = rag_model.generate_content(question)
+    return response.text, response.usage_metadata.total_token_count
+
+@app.route("/precompute_answers", methods=["POST"])
+@telemetry.handler
+def precompute_answers():
+    """Answer the common questions of a source in advance.
+
+    Triggered by updates of users/{uid}/notebooks/{notebookId}/sources/{sourceId}.
+    Runs once the source has both its rag file and its common questions. The
+    answers are stored in the answer cache and in the answers field of the source.
+    """
+    event = from_http(request.headers, request.get_data())
+    event_id = event.get("id")
+    document = event.get("document")
+
+    users, uid, notebooks, notebookId, sources, sourceId = document.split('/')
+
+    uow = UnitOfWork(db)
+    doc_ref = db.collection(users).document(uid).collection(notebooks).document(notebookId).collection(sources).document(sourceId)
+    (doc,), corpus_name = get_all_with_corpus_name(uow, users, uid, [doc_ref])
+
+    source = doc.to_dict() or {}
+    questions = source.get("questions")
+    rag_file_id = source.get("ragFileId")
+    if source.get("status") != "created" or not questions or not rag_file_id or "answers" in source:
+        app.logger.info(f"{event_id}: skipping since source is not ready for precomputing answers: {sourceId}")
+        return ("finished", 204)
+
+    # Both the ragFileId and the questions updates can see a ready source, so only one of them runs
+    key = f"precompute_answers-{sourceId}"
+    state = event_deduplicator.start(key)
+    if state == DONE:
+        app.logger.info(f"{event_id}: skipping since answers are already precomputed: {sourceId}")
+        return ("finished", 204)
+    if state is not None:
+        # Retried until the other event has finished, or has crashed and its lease has expired
+        app.logger.info(f"{event_id}: answers are being precomputed by another event: {sourceId}")
+        return ("answers are being precomputed", 409)
+
+    app.logger.info(f"{event_id}: start precomputing answers: {len(questions)} questions -> {sourceId}")
+
+    try:
+        rag_model = get_rag_model(corpus_name, [rag_file_id])
+        answer_cache_ref = db.collection(users).document(uid).collection("answerCache")
+        answers = []
+        tokens = 0
+        # Answers generated, including those that failed to be cached
+        generated = 0
+        remaining = list(questions)
+        pending = {}
+        start = time.monotonic()
+        while remaining or pending:
+            # A question starts only if the tokens used so far, and the answers in flight at the
+            # average tokens per answer, leave room for it. The first answer runs alone to measure it.
+            while remaining and len(pending) < PRECOMPUTE_CONCURRENCY and (generated or not pending):
+                average = tokens / generated if generated else 0
+                if tokens + average * (len(pending) + 1) > PRECOMPUTE_TOKEN_BUDGET:
+                    break
+                question = remaining.pop(0)
+                pending[precompute_executor.submit(precompute_answer, rag_model, question)] = question
+            if not pending:
+                app.logger.info(f"{event_id}: token budget is exhausted, skipping {len(remaining)} questions")
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                question = pending.pop(future)
+                try:
+                    answer, answer_tokens = future.result()
+                except Exception as err:
+                    app.logger.info(f"{event_id}: failed precomputing an answer: {question}: {err=}, {type(err)=}")
+                    continue
+                tokens += answer_tokens
+                generated += 1
+                answers.append({"question": question, "answer": answer})
+                try:
+                    answer_cache.store(answer_cache_ref, question, [rag_file_id], answer, self_contained=True)
+                except Exception as err:
+                    # The answer is still saved in the source
+                    app.logger.info(f"{event_id}: failed caching a precomputed answer: {question}: {err=}, {type(err)=}")
+
+        uow.update(doc_ref, {"answers": answers})
+        uow.commit()
+    except Exception:
+        event_deduplicator.fail(key)
+        raise
+    event_deduplicator.complete(key)
+
+    app.logger.info(
+        f"{event_id}: finished precomputing answers: {len(answers)}/{len(questions)} answers "
+        f"in {time.monotonic() - start:.1f}s with {tokens}/{PRECOMPUTE_TOKEN_BUDGET} tokens -> {sourceId}"
+    )
+
+    return ("finished", 204)
+
+def shutdown():
+    """Wait for the background work started by handlers, before the process exits."""
+    deletion_executor.shutdown(wait=True)
+    precompute_executor.shutdown(wait=True)
+    summary_executor.shutdown(wait=True)
+    telemetry.shutdown()
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
@@ -0,0 +1,25 @@
+import io
+
+from pypdf import PdfReader, PdfWriter
+
+
+def split(data, pages_per_chunk, min_pages=0):
+    """Split a PDF into documents of up to pages_per_chunk pages.
+
+    Returns a list of (first page, last page, PDF bytes) with 1-based page
+    numbers, or None if the PDF has fewer than min_pages pages.
+    """
+    reader = PdfReader(io.BytesIO(data))
+    page_count = len(reader.pages)
+    if page_count < min_pages:
+        return None
+
+    chunks = []
+    for start in range(0, page_count, pages_per_chunk):
+        writer = PdfWriter()
+        for page in reader.pages[start:start + pages_per_chunk]:
+            writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        chunks.append((start + 1, min(start + pages_per_chunk, page_count), buffer.getvalue()))
+    return chunks
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from cache import LRUCache
+
+# Maximum number of writes in a single Firestore batch
+FIRESTORE_BATCH_SIZE = 500
+
+
+class CorpusFiles:
+    """Rag files known in a corpus, with the time of its last listing and the lock serializing listings."""
+
+    def __init__(self):
+        self.files = {}
+        self.listed_at = 0
+        self.lock = threading.Lock()
+
+
+class RagFileIndex:
+    """Index from a rag file's display name to its rag_file_id for each corpus.
+
+    Entries are found by listing the corpus. A listing is shared by all
+    concurrent lookups on the same corpus and its results are persisted in
+    Firestore, so that other instances can find them without listing again.
+    At most maxsize corpora are kept in memory, each for ttl seconds.
+    """
+
+    def __init__(self, db, list_files, maxsize=64, ttl=60 * 60):
+        self.db = db
+        self.list_files = list_files
+        self.corpora = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def lookup(self, index_ref, corpus_name, display_name, imported_at):
+        """Return the rag_file_id for display_name, or None if it is not in the corpus.
+
+        imported_at is the time.time() when the import of the file finished.
+        """
+        corpus = self.corpora.get_or_set(corpus_name, CorpusFiles)
+        files = corpus.files
+        if display_name in files:
+            return files[display_name]
+
+        with corpus.lock:
+            if display_name in files:
+                return files[display_name]
+
+            doc = index_ref.document(display_name).get()
+            if doc.exists:
+                files[display_name] = doc.get("ragFileId")
+                return files[display_name]
+
+            # A listing started after the import would have found the file
+            if corpus.listed_at > imported_at:
+                return None
+
+            corpus.listed_at = time.time()
+            batch = self.db.batch()
+            pending_writes = 0
+            for rag_file in self.list_files(corpus_name=corpus_name):
+                rag_file_id = rag_file.name.split('/')[-1]
+                if files.get(rag_file.display_name) == rag_file_id:
+                    continue
+                files[rag_file.display_name] = rag_file_id
+                batch.set(index_ref.document(rag_file.display_name), {"ragFileId": rag_file_id})
+                pending_writes += 1
+                if pending_writes == FIRESTORE_BATCH_SIZE:
+                    batch.commit()
+                    batch = self.db.batch()
+                    pending_writes = 0
+            if pending_writes:
+                batch.commit()
+
+            return files.get(display_name)
+
+    def remove(self, index_ref, corpus_name, display_name):
+        """Remove a deleted rag file from the index and return the persisted entry to delete.
+
+        Other instances keep the file in memory until the corpus expires. It is
+        never looked up again, since each upload has a unique display name.
+        """
+        corpus = self.corpora.get(corpus_name)
+        if corpus is not None:
+            corpus.files.pop(display_name, None)
+        return index_ref.document(display_name)
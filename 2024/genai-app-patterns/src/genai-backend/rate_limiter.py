@@ -0,0 +1,105 @@
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class AdaptiveRateLimiter:
+    """Token bucket shared by the requests of a process, with priorities.
+
+    Callers waiting for a token are served by priority and then in arrival
+    order. The rate is halved when a request is throttled (429) and grows
+    back by increase requests per second while requests succeed (AIMD),
+    between min_rate and max_rate requests per second.
+    """
+
+    def __init__(self, max_rate, min_rate, burst=10, increase=None, on_wait=None):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.burst = burst
+        self.increase = increase if increase is not None else max_rate / 100
+        self.on_wait = on_wait
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.decreased_at = 0.0
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.throttled = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def queue_depth(self):
+        return len(self.waiters)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "rate_per_min": round(self.rate * 60),
+                "queue_depth": len(self.waiters),
+                "throttled": self.throttled,
+                "average_wait_seconds": round(self.wait_seconds / self.waits, 3) if self.waits else 0.0,
+            }
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        """Wait for a token and return the seconds waited."""
+        start = time.monotonic()
+        with self.condition:
+            waiter = (priority, next(self.sequence))
+            heapq.heappush(self.waiters, waiter)
+            while True:
+                self._refill()
+                if self.waiters[0] == waiter and self.tokens >= 1:
+                    heapq.heappop(self.waiters)
+                    self.tokens -= 1
+                    break
+                timeout = (1 - self.tokens) / self.rate if self.waiters[0] == waiter else None
+                self.condition.wait(timeout)
+            waited = time.monotonic() - start
+            self.waits += 1
+            self.wait_seconds += waited
+            # The next waiter may be able to take a token too
+            self.condition.notify_all()
+        if self.on_wait:
+            self.on_wait(waited, priority)
+        return waited
+
+    def on_success(self):
+        with self.condition:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttled(self):
+        with self.condition:
+            self.throttled += 1
+            now = time.monotonic()
+            # The requests in flight when the quota ran out fail together, so halve once per second
+            if now - self.decreased_at >= 1:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.decreased_at = now
+                self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def limit(self, priority=PRIORITY_INTERACTIVE):
+        """Wait for a token, then adapt the rate to the outcome of the request made in the block."""
+        self.acquire(priority)
+        try:
+            yield
+        except (ResourceExhausted, TooManyRequests):
+            self.on_throttled()
+            raise
+        else:
+            self.on_success()
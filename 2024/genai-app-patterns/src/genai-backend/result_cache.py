@@ -0,0 +1,136 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from lazy import LazyModule
+
+firestore = LazyModule("google.cloud.firestore")
+
+# Check the number of entries every this many writes
+EVICTION_CHECK_INTERVAL = 100
+
+
+def cache_key(*parts):
+    return hashlib.sha256("/".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class ResultCache:
+    """Cache of generated results that counts hits and the tokens they saved.
+
+    Subclasses implement _get(key), returning (value, tokens) or None, and
+    _set(key, value, tokens).
+    """
+
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key):
+        entry = self._get(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_tokens += entry[1]
+        return entry[0]
+
+    def set(self, key, value, tokens):
+        self._set(key, value, tokens)
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % EVICTION_CHECK_INTERVAL == 0
+        if evict:
+            self._evict()
+
+
+class FirestoreResultCache(ResultCache):
+    """Result cache stored in a Firestore collection.
+
+    Expired entries are ignored and can be removed by a TTL policy on expiresAt.
+    """
+
+    def __init__(self, db, collection_name, ttl_seconds, max_entries):
+        super().__init__(ttl_seconds, max_entries)
+        self.db = db
+        self.collection_ref = db.collection(collection_name)
+
+    def _get(self, key):
+        doc_ref = self.collection_ref.document(key)
+        doc = doc_ref.get()
+        if not doc.exists or doc.get("expiresAt") < datetime.now(timezone.utc):
+            return None
+        doc_ref.update({"lastAccessedAt": firestore.SERVER_TIMESTAMP})
+        return doc.get("value"), doc.get("tokens")
+
+    def _set(self, key, value, tokens):
+        self.collection_ref.document(key).set({
+            "value": value,
+            "tokens": tokens,
+            "expiresAt": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+            "lastAccessedAt": firestore.SERVER_TIMESTAMP,
+        })
+
+    def _evict(self):
+        count = self.collection_ref.count().get()[0][0].value
+        if count <= self.max_entries:
+            return
+        batch = self.db.batch()
+        for doc in self.collection_ref.order_by("lastAccessedAt").limit(min(count - self.max_entries, 500)).stream():
+            batch.delete(doc.reference)
+        batch.commit()
+
+
+class SQLiteResultCache(ResultCache):
+    """Result cache stored in a local SQLite database, for running without Firestore."""
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        super().__init__(ttl_seconds, max_entries)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection_lock = threading.Lock()
+        with self.connection_lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT, tokens INTEGER, expires_at REAL, last_accessed_at REAL)"
+            )
+
+    def _get(self, key):
+        now = time.time()
+        with self.connection_lock, self.connection:
+            row = self.connection.execute(
+                "SELECT value, tokens FROM results WHERE key = ? AND expires_at >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE results SET last_accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), row[1]
+
+    def _set(self, key, value, tokens):
+        now = time.time()
+        with self.connection_lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value), tokens, now + self.ttl_seconds, now),
+            )
+
+    def _evict(self):
+        with self.connection_lock, self.connection:
+            self.connection.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            self.connection.execute(
+                "DELETE FROM results WHERE key NOT IN "
+                "(SELECT key FROM results ORDER BY last_accessed_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
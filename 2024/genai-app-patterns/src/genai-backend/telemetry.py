@@ -0,0 +1,137 @@
+import contextlib
+import contextvars
+import functools
+import json
+import sys
+import time
+from collections import defaultdict
+
+from opentelemetry import metrics, trace
+
+current_handler = contextvars.ContextVar("current_handler", default=None)
+
+
+class Telemetry:
+    """Spans and histograms around the stages of each handler.
+
+    exporter is "console", "file" (OTLP JSON lines under path) or None. Without
+    an exporter the OpenTelemetry API is a no-op, so the instrumentation is
+    almost free.
+    """
+
+    def __init__(self, service_name, exporter=None, path="telemetry", export_interval_ms=10000):
+        self.providers = []
+        if exporter:
+            # The SDK is only imported when something is exported
+            from telemetry_sdk import create_providers
+            tracer_provider, meter_provider = create_providers(service_name, exporter, path, export_interval_ms)
+            trace.set_tracer_provider(tracer_provider)
+            metrics.set_meter_provider(meter_provider)
+            self.providers = [tracer_provider, meter_provider]
+
+        self.tracer = trace.get_tracer(service_name)
+        self.meter = meter = metrics.get_meter(service_name)
+        self.handler_duration = meter.create_histogram(
+            "genai_backend.handler.duration", unit="ms", description="Duration of an event handler"
+        )
+        self.stage_duration = meter.create_histogram(
+            "genai_backend.stage.duration", unit="ms", description="Duration of a stage in an event handler"
+        )
+        self.tokens = meter.create_counter(
+            "genai_backend.tokens", unit="{token}", description="Tokens used by generative model requests"
+        )
+        self.rate_limit_wait = meter.create_histogram(
+            "genai_backend.rate_limit.wait", unit="ms", description="Time waited for the client side rate limit"
+        )
+
+    def shutdown(self):
+        """Export the remaining spans and metrics."""
+        for provider in self.providers:
+            provider.shutdown()
+
+    def handler(self, handler):
+        """Decorator that wraps a Flask handler in a root span."""
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            token = current_handler.set(handler.__name__)
+            start = time.monotonic()
+            status = "error"
+            try:
+                with self.tracer.start_as_current_span(handler.__name__) as span:
+                    response = handler(*args, **kwargs)
+                    span.set_attribute("http.response.status_code", response[1])
+                    status = "ok" if response[1] < 500 else "error"
+                    return response
+            finally:
+                self.handler_duration.record(
+                    (time.monotonic() - start) * 1000, {"handler": handler.__name__, "status": status}
+                )
+                current_handler.reset(token)
+        return wrapper
+
+    @contextlib.contextmanager
+    def stage(self, name, **attributes):
+        """Measure a stage of the current handler as a child span and a histogram sample."""
+        start = time.monotonic()
+        status = "error"
+        try:
+            with self.tracer.start_as_current_span(name, attributes=attributes) as span:
+                yield span
+                status = "ok"
+        finally:
+            self.stage_duration.record(
+                (time.monotonic() - start) * 1000,
+                {"handler": current_handler.get() or "", "stage": name, "status": status}
+            )
+
+    def gauge(self, name, callback, unit, description):
+        """Report the value returned by callback() on each export."""
+        self.meter.create_observable_gauge(
+            name, callbacks=[lambda options: [metrics.Observation(callback())]], unit=unit, description=description
+        )
+
+    def record_rate_limit_wait(self, seconds, priority):
+        self.rate_limit_wait.record(seconds * 1000, {"handler": current_handler.get() or "", "priority": priority})
+
+    def event(self, name, **attributes):
+        """Add an event (e.g. the first chunk of a stream) to the current span."""
+        trace.get_current_span().add_event(name, attributes)
+
+    def record_tokens(self, usage_metadata, model):
+        """Add the token counts of a response to the current span and the token counter."""
+        if usage_metadata is None:
+            return
+        counts = {
+            "prompt": usage_metadata.prompt_token_count,
+            "candidates": usage_metadata.candidates_token_count,
+            "total": usage_metadata.total_token_count,
+        }
+        span = trace.get_current_span()
+        for kind, count in counts.items():
+            span.set_attribute(f"gen_ai.usage.{kind}_tokens", count)
+            self.tokens.add(count, {"handler": current_handler.get() or "", "model": model, "type": kind})
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(traces_path):
+    """Print count, p50, p99 and max durations per span name from an OTLP JSON lines file."""
+    durations = defaultdict(list)
+    with open(traces_path, encoding="utf-8") as f:
+        for line in f:
+            for resource_spans in json.loads(line).get("resourceSpans", []):
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for span in scope_spans.get("spans", []):
+                        elapsed = int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])
+                        durations[span["name"]].append(elapsed / 1e6)
+
+    print(f"{'span':<32}{'count':>8}{'p50 ms':>12}{'p99 ms':>12}{'max ms':>12}")
+    for name, values in sorted(durations.items()):
+        print(f"{name:<32}{len(values):>8}{percentile(values, 50):>12.1f}{percentile(values, 99):>12.1f}{max(values):>12.1f}")
+
+
+if __name__ == "__main__":
+    report(sys.argv[1] if len(sys.argv) > 1 else "telemetry/traces.jsonl")
@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+
+from google.protobuf.json_format import MessageToDict
+from opentelemetry.exporter.otlp.proto.common.metrics_encoder import encode_metrics
+from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+from opentelemetry.sdk.metrics import Histogram, MeterProvider
+from opentelemetry.sdk.metrics.export import (
+    ConsoleMetricExporter,
+    MetricExporter,
+    MetricExportResult,
+    PeriodicExportingMetricReader,
+)
+from opentelemetry.sdk.metrics.view import ExplicitBucketHistogramAggregation, View
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+    SpanExportResult,
+)
+
+# Bucket boundaries in milliseconds, up to the several tens of seconds a generation can take
+DURATION_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 40000, 80000, 160000]
+
+
+class OTLPJsonFileWriter:
+    """Appends OTLP export requests as JSON lines, following the OTLP file exporter format."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def write(self, request):
+        line = json.dumps(MessageToDict(request), ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class OTLPJsonFileSpanExporter(SpanExporter):
+
+    def __init__(self, path):
+        self.writer = OTLPJsonFileWriter(path)
+
+    def export(self, spans):
+        self.writer.write(encode_spans(spans))
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        self.writer.close()
+
+
+class OTLPJsonFileMetricExporter(MetricExporter):
+
+    def __init__(self, path):
+        super().__init__()
+        self.writer = OTLPJsonFileWriter(path)
+
+    def export(self, metrics_data, timeout_millis=10_000, **kwargs):
+        self.writer.write(encode_metrics(metrics_data))
+        return MetricExportResult.SUCCESS
+
+    def force_flush(self, timeout_millis=10_000):
+        return True
+
+    def shutdown(self, timeout_millis=30_000, **kwargs):
+        self.writer.close()
+
+
+def create_providers(service_name, exporter, path, export_interval_ms):
+    """Return the tracer and meter providers exporting to "console" or to OTLP JSON "file"s under path."""
+    resource = Resource.create({"service.name": service_name})
+    if exporter == "file":
+        span_exporter = OTLPJsonFileSpanExporter(os.path.join(path, "traces.jsonl"))
+        metric_exporter = OTLPJsonFileMetricExporter(os.path.join(path, "metrics.jsonl"))
+    elif exporter == "console":
+        span_exporter = ConsoleSpanExporter()
+        metric_exporter = ConsoleMetricExporter()
+    else:
+        raise ValueError(f"unknown telemetry exporter: {exporter}")
+
+    tracer_provider = TracerProvider(resource=resource)
+    tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+
+    meter_provider = MeterProvider(
+        resource=resource,
+        metric_readers=[PeriodicExportingMetricReader(metric_exporter, export_interval_millis=export_interval_ms)],
+        views=[View(
+            instrument_type=Histogram,
+            aggregation=ExplicitBucketHistogramAggregation(DURATION_BUCKETS_MS)
+        )],
+    )
+    return tracer_provider, meter_provider
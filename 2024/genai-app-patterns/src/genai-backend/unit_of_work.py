@@ -0,0 +1,49 @@
+# Maximum number of writes in a single Firestore batch
+MAX_BATCH_WRITES = 500
+
+
+class UnitOfWork:
+    """Coalesces the Firestore reads and writes of a handler.
+
+    Reads are sent with a single get_all call and writes are collected into
+    one WriteBatch that is sent by commit(), or earlier once the batch is full.
+    round_trips counts the requests sent to Firestore through this object.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.batch = db.batch()
+        self.pending_writes = 0
+        self.round_trips = 0
+
+    def get_all(self, refs):
+        """Read the documents in one round trip and return the snapshots in the same order."""
+        self.round_trips += 1
+        snapshots = {snapshot.reference.path: snapshot for snapshot in self.db.get_all(refs)}
+        return [snapshots[ref.path] for ref in refs]
+
+    def set(self, ref, data):
+        self.batch.set(ref, data)
+        self._added()
+
+    def update(self, ref, data):
+        self.batch.update(ref, data)
+        self._added()
+
+    def delete(self, ref):
+        self.batch.delete(ref)
+        self._added()
+
+    def _added(self):
+        self.pending_writes += 1
+        if self.pending_writes == MAX_BATCH_WRITES:
+            self.commit()
+
+    def commit(self):
+        """Send the pending writes atomically in one round trip."""
+        if not self.pending_writes:
+            return
+        self.batch.commit()
+        self.round_trips += 1
+        self.batch = self.db.batch()
+        self.pending_writes = 0
@@ -59,6 +59,17 @@ resource "google_firebaserules_release" "firestore" {
   ruleset_name = google_firebaserules_ruleset.firestore.name
 }
 
+# Embeddings of cached answers are only compared in the backend, so they are not
+# indexed. An indexed array field adds an index entry per element on every write.
+resource "google_firestore_field" "answer_cache_embedding" {
+  provider   = google-beta
+  database   = google_firestore_database.default.name
+  collection = "answerCache"
+  field      = "embedding"
+
+  index_config {}
+}
+
 resource "google_firestore_index" "items1" {
   provider    = google-beta
 
@@ -31,7 +31,9 @@ from vertexai.preview.reasoning_engines import AdkApp
 
 from app.agent import root_agent
 from app.utils.gcs import create_bucket_if_not_exists
-from app.utils.tracing import CloudTraceLoggingSpanExporter
+from app.utils.log_writer import BufferedLogWriter
+from app.utils.sampling import TailSamplingSpanExporter
+from app.utils.tracing import CloudTraceLoggingSpanExporter, JsonlFileSpanExporter
 from app.utils.typing import Feedback
 
 
@@ -41,19 +43,58 @@ class AgentEngineApp(AdkApp):
         super().set_up()
         logging_client = google_cloud_logging.Client()
         self.logger = logging_client.logger(__name__)
+        # Feedback is written in batches so that bursts do not block the worker
+        self.feedback_writer = BufferedLogWriter(self.logger)
         provider = TracerProvider()
-        processor = export.BatchSpanProcessor(
-            CloudTraceLoggingSpanExporter(
+        if os.environ.get("TRACE_EXPORTER") == "file":
+            # Write spans to a local file, e.g. to profile the agent without a project
+            span_exporter = JsonlFileSpanExporter(
+                os.environ.get("TRACE_FILE_PATH", "traces/spans.jsonl"),
+                max_bytes=int(
+                    os.environ.get("TRACE_FILE_MAX_BYTES", str(100 * 1024 * 1024))
+                ),
+            )
+        else:
+            span_exporter = CloudTraceLoggingSpanExporter(
                 project_id=os.environ.get("GOOGLE_CLOUD_PROJECT")
             )
+        # Export all the error and slow traces, and a sample of the others
+        max_attribute_length = os.environ.get("TRACE_MAX_ATTRIBUTE_LENGTH")
+        processor = export.BatchSpanProcessor(
+            TailSamplingSpanExporter(
+                span_exporter,
+                sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", "1.0")),
+                slow_threshold_ms=float(
+                    os.environ.get("TRACE_SLOW_THRESHOLD_MS", "10000")
+                ),
+                max_attribute_length=int(max_attribute_length)
+                if max_attribute_length
+                else None,
+            )
         )
         provider.add_span_processor(processor)
         trace.set_tracer_provider(provider)
 
     def register_feedback(self, feedback: dict[str, Any]) -> None:
-        """Collect and log feedback."""
+        """Collect feedback and queue it to be logged.
+
+        The feedback is written in the background after this returns. Writes are
+        retried, and feedback that still cannot be written, or that overflows the
+        buffer meanwhile, is dropped and counted in feedback_writer.dropped_entries.
+        """
         feedback_obj = Feedback.model_validate(feedback)
-        self.logger.log_struct(feedback_obj.model_dump(), severity="INFO")
+        self.feedback_writer.write([feedback_obj.model_dump()])
+
+    def register_feedback_batch(self, feedbacks: list[dict[str, Any]]) -> None:
+        """Collect a list of feedback and queue it to be logged.
+
+        Nothing is logged if any of the feedback is invalid. As with
+        register_feedback, the feedback is written in the background.
+        """
+        feedback_objs = [Feedback.model_validate(feedback) for feedback in feedbacks]
+        self.feedback_writer.write(
+            [feedback_obj.model_dump() for feedback_obj in feedback_objs]
+        )
 
     def register_operations(self) -> dict[str, list[str]]:
         """Registers the operations of the Agent.
@@ -61,7 +102,10 @@ class AgentEngineApp(AdkApp):
         Extends the base operations to include feedback registration functionality.
         """
         operations = super().register_operations()
-        operations[""] = operations[""] + ["register_feedback"]
+        operations[""] = operations[""] + [
+            "register_feedback",
+            "register_feedback_batch",
+        ]
         return operations
 
     def clone(self) -> "AgentEngineApp":
@@ -0,0 +1,159 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import atexit
+import logging
+import threading
+import time
+from typing import Any
+
+
+class BufferedLogWriter:
+    """
+    Buffers structured log entries and writes them to Google Cloud Logging in
+    batches, one entries.write call per batch, from a background thread.
+
+    The buffer is flushed every flush_interval seconds or as soon as it holds
+    max_batch_size entries. A failed batch is retried with exponential backoff by
+    the background thread, and dropped after max_attempts attempts. write never
+    waits for Cloud Logging: when the buffer holds max_buffered_entries, because
+    writes fail or entries arrive faster than they are written, the oldest entries
+    are dropped to make room, so that memory stays bounded. dropped_entries counts
+    the entries lost either way. The buffer is
+    flushed on close, which also runs at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        logger: Any,
+        max_batch_size: int = 200,
+        flush_interval: float = 1.0,
+        max_buffered_entries: int = 2000,
+        severity: str = "INFO",
+        max_attempts: int = 4,
+        retry_delay: float = 0.5,
+    ) -> None:
+        """
+        Initialize the writer and start its background thread.
+
+        :param logger: Google Cloud Logging logger
+        :param max_batch_size: Number of entries that triggers a flush
+        :param flush_interval: Maximum seconds an entry stays in the buffer
+        :param max_buffered_entries: Number of entries above which the oldest
+            buffered entries are dropped
+        :param severity: Severity of the entries
+        :param max_attempts: Number of attempts to write a batch before dropping it
+        :param retry_delay: Seconds to wait before the first retry, doubled on each
+            retry
+        """
+        self.logger = logger
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered_entries = max_buffered_entries
+        self.severity = severity
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.written_entries = 0
+        self.dropped_entries = 0
+        self.buffer_overflows = 0
+        self._buffer: list[dict] = []
+        self._condition = threading.Condition()
+        # Serializes the flushes of the background thread and the callers
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="BufferedLogWriter", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, entries: list[dict]) -> None:
+        """
+        Add entries to the buffer.
+
+        :param entries: The log entry payloads
+        """
+        with self._condition:
+            self._buffer.extend(entries)
+            overflow = len(self._buffer) - self.max_buffered_entries
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.buffer_overflows += 1
+                self.dropped_entries += overflow
+            if len(self._buffer) >= self.max_batch_size:
+                self._condition.notify()
+            # Log the first overflow and then every 1000 overflows
+            log_overflow = overflow > 0 and self.buffer_overflows % 1000 == 1
+        if log_overflow:
+            logging.warning(
+                f"Log buffer full, dropped the oldest entries, "
+                f"{self.dropped_entries} dropped so far"
+            )
+
+    def flush(self) -> None:
+        """
+        Write the buffered entries, retrying failed batches. This is called from
+        the background thread and on close.
+        """
+        with self._flush_lock:
+            with self._condition:
+                entries, self._buffer = self._buffer, []
+            for i in range(0, len(entries), self.max_batch_size):
+                self._write_batch(entries[i : i + self.max_batch_size])
+
+    def close(self) -> None:
+        """
+        Write the buffered entries and stop the background thread.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < self.max_batch_size:
+                    self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _write_batch(self, entries: list[dict]) -> None:
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            batch = self.logger.batch()
+            for entry in entries:
+                batch.log_struct(entry, severity=self.severity)
+            try:
+                batch.commit()
+                self.written_entries += len(entries)
+                return
+            except Exception:
+                logging.warning(
+                    f"Failed to write {len(entries)} log entries "
+                    f"(attempt {attempt + 1} of {self.max_attempts})",
+                    exc_info=True,
+                )
+        with self._condition:
+            self.dropped_entries += len(entries)
+        logging.error(
+            f"Dropped {len(entries)} log entries after {self.max_attempts} attempts, "
+            f"{self.dropped_entries} so far"
+        )
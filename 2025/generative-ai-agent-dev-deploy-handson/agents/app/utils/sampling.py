@@ -0,0 +1,237 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any
+
+from opentelemetry.sdk.trace import ReadableSpan
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from opentelemetry.trace import StatusCode
+
+# Number of decided traces remembered for the spans that end after their root span
+MAX_DECIDED_TRACES = 10000
+
+
+def truncate_value(value: str, max_length: int) -> str:
+    """
+    Truncate a string, appending its length and a hash of the full value so that
+    identical values can still be matched.
+
+    :param value: The string to truncate
+    :param max_length: Number of characters to keep
+    :return: The truncated string
+    """
+    digest = hashlib.sha256(value.encode()).hexdigest()[:16]
+    return f"{value[:max_length]}... [truncated {len(value)} characters, sha256 {digest}]"
+
+
+class _PendingTrace:
+    def __init__(self) -> None:
+        self.spans: list[ReadableSpan] = []
+        self.created_at = time.monotonic()
+
+
+class TailSamplingSpanExporter(SpanExporter):
+    """
+    A span exporter that decides which traces to export once they are complete.
+
+    Traces with an error span, or whose root span took at least slow_threshold_ms,
+    are always exported. Of the other traces, a sample_rate fraction chosen by trace
+    ID is exported. The spans of a trace are held until its root span ends. Traces
+    decided without their root span, after trace_timeout seconds, beyond
+    max_pending_traces or at shutdown, are exported like slow traces, and so are
+    the spans of them that end later. String attributes longer than
+    max_attribute_length characters, like LLM prompts and responses, are truncated.
+    """
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        sample_rate: float = 1.0,
+        slow_threshold_ms: float = 10000,
+        max_attribute_length: int | None = None,
+        max_pending_traces: int = 10000,
+        trace_timeout: float = 60.0,
+    ) -> None:
+        """
+        Initialize the exporter.
+
+        :param exporter: The exporter of the sampled spans
+        :param sample_rate: Fraction of the fast traces without errors to export
+        :param slow_threshold_ms: Duration of the root span above which a trace
+            is always exported
+        :param max_attribute_length: Maximum length of string attribute values,
+            or None to keep them whole
+        :param max_pending_traces: Maximum number of traces waiting for their root
+            span; the oldest are decided early beyond it
+        :param trace_timeout: Seconds after which a trace without a root span is
+            exported with the spans received so far
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms
+        self.max_attribute_length = max_attribute_length
+        self.max_pending_traces = max_pending_traces
+        self.trace_timeout = trace_timeout
+        self.exported_traces = 0
+        self.dropped_traces = 0
+        self._pending: OrderedDict[int, _PendingTrace] = OrderedDict()
+        self._decided: OrderedDict[int, bool] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        """
+        Hold the spans until their trace is complete, then export the sampled ones.
+
+        :param spans: A sequence of spans to export
+        :return: The result of the export of the sampled spans
+        """
+        if self.sample_rate >= 1:
+            return self._export(spans)
+
+        sampled: list[ReadableSpan] = []
+        with self._lock:
+            for span in spans:
+                trace_id = span.context.trace_id
+                if trace_id in self._decided:
+                    # The span ended after its root span
+                    if self._decided[trace_id]:
+                        sampled.append(span)
+                    continue
+                pending = self._pending.get(trace_id)
+                if pending is None:
+                    pending = self._pending[trace_id] = _PendingTrace()
+                pending.spans.append(span)
+                if span.parent is None or span.parent.is_remote:
+                    del self._pending[trace_id]
+                    sampled.extend(self._decide(trace_id, pending.spans, span))
+
+            now = time.monotonic()
+            while self._pending:
+                trace_id, pending = next(iter(self._pending.items()))
+                if (
+                    len(self._pending) <= self.max_pending_traces
+                    and now - pending.created_at < self.trace_timeout
+                ):
+                    break
+                del self._pending[trace_id]
+                sampled.extend(self._decide(trace_id, pending.spans, None))
+
+        return self._export(sampled)
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        """
+        Flush the wrapped exporter. Traces waiting for their root span are kept.
+
+        :param timeout_millis: Maximum time to wait in milliseconds
+        :return: Whether the flush completed before the timeout
+        """
+        return self.exporter.force_flush(timeout_millis)
+
+    def shutdown(self) -> None:
+        """
+        Decide the traces waiting for their root span, then shut down the wrapped
+        exporter.
+        """
+        sampled: list[ReadableSpan] = []
+        with self._lock:
+            for trace_id, pending in self._pending.items():
+                sampled.extend(self._decide(trace_id, pending.spans, None))
+            self._pending.clear()
+        self._export(sampled)
+        self.exporter.shutdown()
+
+    def _decide(
+        self,
+        trace_id: int,
+        spans: list[ReadableSpan],
+        root: ReadableSpan | None,
+    ) -> list[ReadableSpan]:
+        """
+        Decide whether to export a trace and remember the decision.
+
+        :param trace_id: The trace ID
+        :param spans: The spans of the trace received so far
+        :param root: The root span, or None if it has not ended yet
+        :return: The spans to export
+        """
+        keep = (
+            any(span.status.status_code == StatusCode.ERROR for span in spans)
+            # A trace decided before its root span ended is still running or lost its
+            # root span, so it is kept like a slow trace
+            or root is None
+            or root.end_time is None
+            or (root.end_time - root.start_time) / 1e6 >= self.slow_threshold_ms
+            # Sample by the lower 64 bits of the trace ID like TraceIdRatioBased
+            or (trace_id & 0xFFFFFFFFFFFFFFFF) < self.sample_rate * 2**64
+        )
+        self._decided[trace_id] = keep
+        if len(self._decided) > MAX_DECIDED_TRACES:
+            self._decided.popitem(last=False)
+        if keep:
+            self.exported_traces += 1
+            return spans
+        self.dropped_traces += 1
+        return []
+
+    def _export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        if not spans:
+            return SpanExportResult.SUCCESS
+        if self.max_attribute_length is not None:
+            spans = [self._truncate(span) for span in spans]
+        try:
+            return self.exporter.export(spans)
+        except Exception:
+            logging.exception(f"Failed to export {len(spans)} sampled spans")
+            return SpanExportResult.FAILURE
+
+    def _truncate(self, span: ReadableSpan) -> ReadableSpan:
+        """
+        Return a copy of the span with its long string attributes truncated.
+
+        :param span: The span
+        :return: The span itself if no attribute is too long, otherwise a copy
+        """
+        max_length = self.max_attribute_length
+        attributes: Any = span.attributes or {}
+        if not any(
+            isinstance(value, str) and len(value) > max_length
+            for value in attributes.values()
+        ):
+            return span
+        return ReadableSpan(
+            name=span.name,
+            context=span.context,
+            parent=span.parent,
+            resource=span.resource,
+            attributes={
+                key: truncate_value(value, max_length)
+                if isinstance(value, str) and len(value) > max_length
+                else value
+                for key, value in attributes.items()
+            },
+            events=span.events,
+            links=span.links,
+            kind=span.kind,
+            status=span.status,
+            start_time=span.start_time,
+            end_time=span.end_time,
+            instrumentation_scope=span.instrumentation_scope,
+        )
@@ -0,0 +1,170 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Aggregate the spans written by JsonlFileSpanExporter into latency histograms.
+
+Spans are grouped by agent (agent_run spans), tool (execute_tool spans) and model
+(call_llm spans), with the token totals of each model. The script only uses the
+standard library, so it can be run without importing app:
+
+    python app/utils/trace_report.py traces/spans.jsonl*
+"""
+
+import argparse
+import json
+import math
+import re
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+
+# Upper bounds of the histogram buckets in milliseconds
+BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, math.inf]
+
+AGENT_SPAN = re.compile(r"agent_run \[(.+)\]")
+TOOL_SPAN = re.compile(r"execute_tool (.+)")
+
+
+def read_spans(paths: Iterable[str]) -> Iterator[dict]:
+    """
+    Read the spans of JSON Lines files, skipping the lines that cannot be parsed,
+    e.g. a partly written last line.
+
+    :param paths: Paths of the files
+    :return: The span dictionaries
+    """
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def duration_ms(span: dict) -> float | None:
+    if not span.get("start_time") or not span.get("end_time"):
+        return None
+    start = datetime.fromisoformat(span["start_time"])
+    end = datetime.fromisoformat(span["end_time"])
+    return (end - start).total_seconds() * 1000
+
+
+def group_of(span: dict) -> tuple[str, str] | None:
+    """
+    Return the kind and name of the group of a span, or None to skip it.
+
+    :param span: The span dictionary
+    :return: ("agent", name), ("tool", name) or ("model", name)
+    """
+    name = span.get("name", "")
+    attributes = span.get("attributes") or {}
+    if match := AGENT_SPAN.fullmatch(name):
+        return "agent", match.group(1)
+    if match := TOOL_SPAN.fullmatch(name):
+        return "tool", attributes.get("gen_ai.tool.name", match.group(1))
+    if name == "call_llm":
+        return "model", attributes.get("gen_ai.request.model", "unknown")
+    return None
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Return the q-th percentile of sorted values by the nearest rank."""
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def aggregate(spans: Iterable[dict]) -> dict:
+    """
+    Aggregate spans into the durations and token totals of each group.
+
+    :param spans: The span dictionaries
+    :return: {(kind, name): {"durations": [...], "errors": n, "input_tokens": n,
+        "output_tokens": n}}
+    """
+    groups: dict = defaultdict(
+        lambda: {"durations": [], "errors": 0, "input_tokens": 0, "output_tokens": 0}
+    )
+    for span in spans:
+        group = group_of(span)
+        duration = duration_ms(span)
+        if group is None or duration is None:
+            continue
+        stats = groups[group]
+        stats["durations"].append(duration)
+        if (span.get("status") or {}).get("status_code") == "ERROR":
+            stats["errors"] += 1
+        attributes = span.get("attributes") or {}
+        stats["input_tokens"] += int(attributes.get("gen_ai.usage.input_tokens", 0))
+        stats["output_tokens"] += int(attributes.get("gen_ai.usage.output_tokens", 0))
+    return groups
+
+
+def histogram(durations: list[float]) -> list[int]:
+    counts = [0] * len(BUCKETS_MS)
+    for duration in durations:
+        counts[next(i for i, bound in enumerate(BUCKETS_MS) if duration <= bound)] += 1
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="JSON Lines files written by JsonlFileSpanExporter")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    groups = aggregate(read_spans(args.paths))
+    report = []
+    for (kind, name), stats in sorted(groups.items()):
+        durations = sorted(stats["durations"])
+        report.append(
+            {
+                "kind": kind,
+                "name": name,
+                "count": len(durations),
+                "errors": stats["errors"],
+                "p50_ms": round(percentile(durations, 50), 1),
+                "p95_ms": round(percentile(durations, 95), 1),
+                "p99_ms": round(percentile(durations, 99), 1),
+                "max_ms": round(durations[-1], 1),
+                "histogram": dict(
+                    zip([str(bound) for bound in BUCKETS_MS], histogram(durations))
+                ),
+                "input_tokens": stats["input_tokens"],
+                "output_tokens": stats["output_tokens"],
+            }
+        )
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(
+        f"{'kind':<7}{'name':<24}{'count':>7}{'errors':>7}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'max ms':>9}{'input tokens':>14}{'output tokens':>15}"
+    )
+    for row in report:
+        print(
+            f"{row['kind']:<7}{row['name']:<24}{row['count']:>7}{row['errors']:>7}"
+            f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['max_ms']:>9}"
+            f"{row['input_tokens']:>14}{row['output_tokens']:>15}"
+        )
+    print()
+    print(f"{'kind':<7}{'name':<24}" + "".join(f"{'<=' + format(b, 'g'):>8}" for b in BUCKETS_MS))
+    for row in report:
+        print(f"{row['kind']:<7}{row['name']:<24}" + "".join(f"{n:>8}" for n in row["histogram"].values()))
+
+
+if __name__ == "__main__":
+    main()
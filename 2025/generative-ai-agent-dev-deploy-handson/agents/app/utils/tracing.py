@@ -12,16 +12,133 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
+import gzip
 import json
 import logging
+import os
+import queue
+import threading
+import time
 from collections.abc import Sequence
-from typing import Any
+from typing import Any, Literal
 
 import google.cloud.storage as storage
 from google.cloud import logging as google_cloud_logging
 from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
 from opentelemetry.sdk.trace import ReadableSpan
-from opentelemetry.sdk.trace.export import SpanExportResult
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from opentelemetry.sdk.util import ns_to_iso_str
+from opentelemetry.trace import format_span_id, format_trace_id
+
+from app.utils.sampling import truncate_value
+
+LOG_LABELS = {
+    "type": "agent_telemetry",
+    "service_name": "sample-app",
+}
+
+# Attributes above this size are stored in GCS, as Cloud Logging rejects entries above 256 KB
+MAX_ATTRIBUTES_SIZE = 255 * 1024
+
+# Room left in the log entry for the GCS links of offloaded attributes
+OFFLOADED_LINKS_SIZE = 1024
+
+# Marks the end of the queue for the sender thread
+_SHUTDOWN = object()
+
+
+def _attributes_to_dict(attributes: Any) -> dict:
+    # Sequence attribute values are tuples, which Cloud Logging cannot encode
+    return {
+        key: list(value) if isinstance(value, tuple) else value
+        for key, value in (attributes or {}).items()
+    }
+
+
+def span_to_dict(span: ReadableSpan) -> dict:
+    """
+    Convert a span to the dictionary that json.loads(span.to_json()) returns, without
+    encoding and decoding the attribute values.
+
+    :param span: The span to convert
+    :return: The span data dictionary
+    """
+    context = span.context
+    status = {"status_code": span.status.status_code.name}
+    if span.status.description:
+        status["description"] = span.status.description
+    return {
+        "name": span.name,
+        "context": {
+            "trace_id": f"0x{format_trace_id(context.trace_id)}",
+            "span_id": f"0x{format_span_id(context.span_id)}",
+            "trace_state": repr(context.trace_state),
+        }
+        if context
+        else None,
+        "kind": str(span.kind),
+        "parent_id": f"0x{format_span_id(span.parent.span_id)}" if span.parent else None,
+        "start_time": ns_to_iso_str(span.start_time) if span.start_time else None,
+        "end_time": ns_to_iso_str(span.end_time) if span.end_time else None,
+        "status": status,
+        "attributes": _attributes_to_dict(span.attributes),
+        "events": [
+            {
+                "name": event.name,
+                "timestamp": ns_to_iso_str(event.timestamp),
+                "attributes": _attributes_to_dict(event.attributes),
+            }
+            for event in span.events
+        ],
+        "links": [
+            {
+                "context": {
+                    "trace_id": f"0x{format_trace_id(link.context.trace_id)}",
+                    "span_id": f"0x{format_span_id(link.context.span_id)}",
+                    "trace_state": repr(link.context.trace_state),
+                },
+                "attributes": _attributes_to_dict(link.attributes),
+            }
+            for link in span.links
+        ],
+        "resource": {
+            "attributes": _attributes_to_dict(span.resource.attributes),
+            "schema_url": span.resource.schema_url,
+        },
+    }
+
+
+def estimate_json_size(value: Any, limit: int) -> int:
+    """
+    Estimate the size in bytes of the UTF-8 JSON encoding of a value, stopping as
+    soon as the estimate exceeds limit.
+
+    :param value: A dictionary, list or scalar made of JSON types
+    :param limit: The size above which to stop
+    :return: The estimated size, or a size above limit if the value is larger
+    """
+    if isinstance(value, str):
+        # The quotes; escaped characters are not counted
+        return (len(value) if value.isascii() else len(value.encode())) + 2
+    if isinstance(value, dict):
+        size = 2
+        for key, item in value.items():
+            # The key, its quotes, the colon and the comma
+            size += len(key) + 4 + estimate_json_size(item, limit - size)
+            if size > limit:
+                break
+        return size
+    if isinstance(value, list | tuple):
+        size = 2
+        for item in value:
+            size += estimate_json_size(item, limit - size) + 1
+            if size > limit:
+                break
+        return size
+    if value is None:
+        return 4
+    return len(str(value))
 
 
 class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
@@ -31,6 +148,13 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
 
     This class helps bypass the 256 character limit of Cloud Trace for attribute values
     by leveraging Cloud Logging (which has a 256KB limit) and Cloud Storage for larger payloads.
+    Only the largest attributes are moved to Cloud Storage. They are uploaded gzip
+    compressed by a thread pool, so that exports do not wait for the uploads either.
+
+    Log entries are queued and written by a background thread in batches of up to
+    max_batch_size entries, one entries.write call per batch, so that exports do not
+    wait for Cloud Logging. When the queue is full, new entries are dropped, or with
+    the "block" policy the export waits up to enqueue_timeout seconds for room first.
     """
 
     def __init__(
@@ -39,6 +163,12 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
         storage_client: storage.Client | None = None,
         bucket_name: str | None = None,
         debug: bool = False,
+        max_queue_size: int = 2048,
+        max_batch_size: int = 32,
+        queue_full_policy: Literal["drop", "block"] = "drop",
+        enqueue_timeout: float = 1.0,
+        upload_workers: int = 4,
+        bucket_check_interval: float = 300.0,
         **kwargs: Any,
     ) -> None:
         """
@@ -48,6 +178,15 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
         :param storage_client: Google Cloud Storage client
         :param bucket_name: Name of the GCS bucket to store large payloads
         :param debug: Enable debug mode for additional logging
+        :param max_queue_size: Maximum number of log entries waiting to be written
+        :param max_batch_size: Maximum number of log entries per entries.write call
+            (Cloud Logging accepts up to 10 MB per call and 256 KB per entry)
+        :param queue_full_policy: "drop" to drop entries when the queue is full,
+            "block" to wait up to enqueue_timeout seconds for room first
+        :param enqueue_timeout: Seconds to wait for room with the "block" policy
+        :param upload_workers: Number of threads uploading large payloads to GCS
+        :param bucket_check_interval: Seconds for which the result of the bucket
+            existence check is reused
         :param kwargs: Additional arguments to pass to the parent class
         """
         super().__init__(**kwargs)
@@ -61,19 +200,47 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
             bucket_name or f"{self.project_id}-sample-app-logs-data"
         )
         self.bucket = self.storage_client.bucket(self.bucket_name)
+        self.bucket_check_interval = bucket_check_interval
+        self._bucket_exists = False
+        self._bucket_checked_at: float | None = None
+        self._bucket_lock = threading.Lock()
+        self._upload_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=upload_workers, thread_name_prefix="CloudTraceLoggingUpload"
+        )
+        self._uploads: set[concurrent.futures.Future] = set()
+
+        self.max_batch_size = max_batch_size
+        self.queue_full_policy = queue_full_policy
+        self.enqueue_timeout = enqueue_timeout
+        self.written_entries = 0
+        self.dropped_entries = 0
+        self.failed_entries = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        # Entries queued or being written, to let force_flush wait for them
+        self._pending = 0
+        self._pending_condition = threading.Condition()
+        self._is_shutdown = False
+        self._sender = threading.Thread(
+            target=self._send_entries, name="CloudTraceLoggingSender", daemon=True
+        )
+        self._sender.start()
 
     def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
         """
-        Export the spans to Google Cloud Logging and Cloud Trace.
+        Queue the spans for Google Cloud Logging and export them to Cloud Trace.
 
         :param spans: A sequence of spans to export
         :return: The result of the export operation
         """
+        if self._is_shutdown:
+            logging.warning("Exporter already shut down, ignoring spans")
+            return SpanExportResult.FAILURE
+
         for span in spans:
             span_context = span.get_span_context()
             trace_id = format(span_context.trace_id, "x")
             span_id = format(span_context.span_id, "x")
-            span_dict = json.loads(span.to_json())
+            span_dict = span_to_dict(span)
 
             span_dict["trace"] = f"projects/{self.project_id}/traces/{trace_id}"
             span_dict["span_id"] = span_id
@@ -85,67 +252,322 @@ class CloudTraceLoggingSpanExporter(CloudTraceSpanExporter):
             if self.debug:
                 print(span_dict)
 
-            # Log the span data to Google Cloud Logging
-            self.logger.log_struct(
-                span_dict,
-                labels={
-                    "type": "agent_telemetry",
-                    "service_name": "sample-app",
-                },
-                severity="INFO",
-            )
+            # Log the span data to Google Cloud Logging from the sender thread
+            self._enqueue(span_dict)
         # Export spans to Google Cloud Trace using the parent class method
         return super().export(spans)
 
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        """
+        Wait until the queued log entries have been written and the large payloads
+        uploaded.
+
+        :param timeout_millis: Maximum time to wait in milliseconds
+        :return: Whether everything was written before the timeout
+        """
+        deadline = time.monotonic() + timeout_millis / 1000
+        _, not_done = concurrent.futures.wait(
+            list(self._uploads), timeout=timeout_millis / 1000
+        )
+        if not_done:
+            return False
+        with self._pending_condition:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._pending_condition.wait(remaining)
+        return True
+
+    def shutdown(self) -> None:
+        """
+        Write the queued log entries and upload the large payloads, then stop the
+        sender and upload threads.
+        """
+        if self._is_shutdown:
+            return
+        self._is_shutdown = True
+        self.force_flush()
+        self._upload_executor.shutdown()
+        self._queue.put(_SHUTDOWN)
+        self._sender.join()
+        super().shutdown()
+
+    def _enqueue(self, entry: dict) -> None:
+        """
+        Queue a log entry for the sender thread, applying the queue full policy.
+
+        :param entry: The log entry payload
+        """
+        with self._pending_condition:
+            self._pending += 1
+        try:
+            if self.queue_full_policy == "block":
+                self._queue.put(entry, timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            self._done(1)
+            self.dropped_entries += 1
+            # Log the first drop and then every 1000 drops
+            if self.dropped_entries % 1000 == 1:
+                logging.warning(
+                    f"Span log queue full, dropped {self.dropped_entries} entries so far"
+                )
+
+    def _done(self, count: int) -> None:
+        with self._pending_condition:
+            self._pending -= count
+            self._pending_condition.notify_all()
+
+    def _send_entries(self) -> None:
+        """
+        Write the queued log entries in batches until shutdown.
+        """
+        while True:
+            entry = self._queue.get()
+            if entry is _SHUTDOWN:
+                return
+            entries = [entry]
+            stop = False
+            # Take the entries queued meanwhile into the same batch
+            while len(entries) < self.max_batch_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _SHUTDOWN:
+                    stop = True
+                    break
+                entries.append(entry)
+            self._write_entries(entries)
+            if stop:
+                return
+
+    def _write_entries(self, entries: list[dict]) -> None:
+        """
+        Write log entries to Google Cloud Logging with a single entries.write call.
+
+        :param entries: The log entry payloads
+        """
+        batch = self.logger.batch()
+        for entry in entries:
+            batch.log_struct(entry, labels=LOG_LABELS, severity="INFO")
+        try:
+            batch.commit()
+            self.written_entries += len(entries)
+        except Exception:
+            self.failed_entries += len(entries)
+            logging.exception(f"Failed to write {len(entries)} span log entries")
+        finally:
+            self._done(len(entries))
+
+    def bucket_exists(self) -> bool:
+        """
+        Check whether the GCS bucket exists, reusing the result for
+        bucket_check_interval seconds.
+
+        :return: Whether the bucket exists
+        """
+        with self._bucket_lock:
+            now = time.monotonic()
+            if (
+                self._bucket_checked_at is None
+                or now - self._bucket_checked_at > self.bucket_check_interval
+            ):
+                self._bucket_exists = self.bucket.exists()
+                self._bucket_checked_at = now
+            return self._bucket_exists
+
     def store_in_gcs(self, content: str, span_id: str) -> str:
         """
-        Initiate storing large content in Google Cloud Storage/
+        Store large content in Google Cloud Storage, gzip compressed.
 
         :param content: The content to store
         :param span_id: The ID of the span
-        :return: The  GCS URI of the stored content
+        :return: The GCS URI of the stored content
         """
-        if not self.storage_client.bucket(self.bucket_name).exists():
-            logging.warning(
-                f"Bucket {self.bucket_name} not found. "
-                "Unable to store span attributes in GCS."
-            )
-            return "GCS bucket not found"
-
         blob_name = f"spans/{span_id}.json"
         blob = self.bucket.blob(blob_name)
+        # Served decompressed to clients that do not accept gzip
+        blob.content_encoding = "gzip"
 
-        blob.upload_from_string(content, "application/json")
+        blob.upload_from_string(gzip.compress(content.encode()), "application/json")
         return f"gs://{self.bucket_name}/{blob_name}"
 
+    def _upload(self, attributes: dict, span_id: str) -> None:
+        """
+        Serialize and store attributes in GCS, logging failures.
+
+        :param attributes: The attributes to store
+        :param span_id: The ID of the span
+        """
+        try:
+            self.store_in_gcs(json.dumps(attributes), span_id)
+        except Exception:
+            logging.exception(f"Failed to store the attributes of span {span_id} in GCS")
+
     def _process_large_attributes(self, span_dict: dict, span_id: str) -> dict:
         """
-        Process large attribute values by storing them in GCS if they exceed the size
-        limit of Google Cloud Logging.
+        Move the largest attribute values to GCS if the attributes exceed the size
+        limit of Google Cloud Logging. If the bucket does not exist, the values are
+        truncated in place instead, so that the entry can still be logged.
 
         :param span_dict: The span data dictionary
-        :param trace_id: The trace ID
         :param span_id: The span ID
         :return: The updated span dictionary
         """
         attributes = span_dict["attributes"]
-        if len(json.dumps(attributes).encode()) > 255 * 1024:  # 250 KB
-            # Separate large payload from other attributes
-            attributes_payload = dict(attributes.items())
-            attributes_retain = dict(attributes.items())
-
-            # Store large payload in GCS
-            gcs_uri = self.store_in_gcs(json.dumps(attributes_payload), span_id)
-            attributes_retain["uri_payload"] = gcs_uri
-            attributes_retain["url_payload"] = (
-                f"https://storage.mtls.cloud.google.com/"
-                f"{self.bucket_name}/spans/{span_id}.json"
-            )
+        if estimate_json_size(attributes, MAX_ATTRIBUTES_SIZE) <= MAX_ATTRIBUTES_SIZE:
+            return span_dict
+
+        sizes = {
+            key: estimate_json_size(value, MAX_ATTRIBUTES_SIZE)
+            for key, value in attributes.items()
+        }
+        size = sum(len(key) + 4 + value_size for key, value_size in sizes.items())
+        keys = []
+        # Offload the largest values until the rest fits
+        for key in sorted(sizes, key=sizes.get, reverse=True):
+            if size <= MAX_ATTRIBUTES_SIZE - OFFLOADED_LINKS_SIZE:
+                break
+            keys.append(key)
+            size -= len(key) + 4 + sizes[key]
+        payload = {key: attributes[key] for key in keys}
 
-            span_dict["attributes"] = attributes_retain
-            logging.info(
-                "Length of payload span above 250 KB, storing attributes in GCS "
-                "to avoid large log entry errors"
+        if not self.bucket_exists():
+            logging.warning(
+                f"Bucket {self.bucket_name} not found. "
+                f"Truncating {len(keys)} span attributes instead of storing them in GCS."
             )
+            return self._truncate_attributes(span_dict, keys, size)
+        try:
+            # The upload finishes in the background; the object name is known already
+            future = self._upload_executor.submit(self._upload, payload, span_id)
+        except RuntimeError:
+            # The executor has been shut down
+            logging.warning(f"Truncating {len(keys)} span attributes after shutdown")
+            return self._truncate_attributes(span_dict, keys, size)
+        self._uploads.add(future)
+        future.add_done_callback(self._uploads.discard)
+        for key in keys:
+            del attributes[key]
+        attributes["offloaded_attributes"] = keys
+        attributes["uri_payload"] = f"gs://{self.bucket_name}/spans/{span_id}.json"
+        attributes["url_payload"] = (
+            f"https://storage.mtls.cloud.google.com/"
+            f"{self.bucket_name}/spans/{span_id}.json"
+        )
+        logging.info(
+            f"Length of payload span above 250 KB, storing {len(payload)} attributes "
+            "in GCS to avoid large log entry errors"
+        )
+        return span_dict
+
+    def _truncate_attributes(self, span_dict: dict, keys: list[str], size: int) -> dict:
+        """
+        Truncate attribute values in place so that the attributes fit in a log entry.
 
+        :param span_dict: The span data dictionary
+        :param keys: The attributes to truncate
+        :param size: The estimated size of the other attributes
+        :return: The updated span dictionary
+        """
+        attributes = span_dict["attributes"]
+        # Each value gets an equal share of the room left, and the truncation note
+        max_length = max(
+            (MAX_ATTRIBUTES_SIZE - OFFLOADED_LINKS_SIZE - size) // len(keys) - 100, 0
+        )
+        for key in keys:
+            value = attributes[key]
+            if not isinstance(value, str):
+                value = json.dumps(value, ensure_ascii=False, default=str)
+            # Non-ASCII characters take up to 4 bytes in UTF-8
+            attributes[key] = truncate_value(
+                value, max_length if value.isascii() else max_length // 4
+            )
+        attributes["truncated_attributes"] = keys
+        attributes["uri_payload"] = "GCS bucket not found"
         return span_dict
+
+
+class JsonlFileSpanExporter(SpanExporter):
+    """
+    A span exporter that appends spans to a local JSON Lines file, one
+    span_to_dict dictionary per line, to profile agents without a Google Cloud
+    project. The file is rotated like logging.handlers.RotatingFileHandler: when
+    it would exceed max_bytes, it is renamed to path.1, path.1 to path.2 and so
+    on, keeping backup_count old files.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 100 * 1024 * 1024,
+        backup_count: int = 5,
+    ) -> None:
+        """
+        Initialize the exporter.
+
+        :param path: Path of the file to write
+        :param max_bytes: Size above which the file is rotated, or 0 to never rotate
+        :param backup_count: Number of rotated files to keep
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        """
+        Append the spans to the file.
+
+        :param spans: A sequence of spans to export
+        :return: The result of the export operation
+        """
+        data = "".join(
+            json.dumps(span_to_dict(span), ensure_ascii=False, default=str) + "\n"
+            for span in spans
+        ).encode()
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._open()
+                if self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+                    self._rotate()
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
+        except OSError:
+            logging.exception(f"Failed to write spans to {self.path}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        """
+        Close the file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        if self.backup_count:
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
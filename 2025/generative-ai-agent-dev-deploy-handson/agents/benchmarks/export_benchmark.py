@@ -0,0 +1,113 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Measure exports/sec and flush latency of CloudTraceLoggingSpanExporter.
+
+Cloud Logging, Cloud Trace and Cloud Storage are replaced by the fakes in
+benchmarks/fakes.py. Importing app resolves the default project with
+google.auth.default(), so application default credentials must be set up, but
+nothing is sent to Google Cloud.
+
+    python -m benchmarks.export_benchmark --logging-latency-ms 30
+"""
+
+import argparse
+import itertools
+import json
+import time
+from collections.abc import Sequence
+
+from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
+from opentelemetry.sdk.trace import ReadableSpan
+from opentelemetry.sdk.trace.export import SpanExportResult
+
+from app.utils.tracing import LOG_LABELS, CloudTraceLoggingSpanExporter
+from benchmarks.fakes import FakeLoggingClient, FakeStorageClient, FakeTraceClient
+from benchmarks.spans import make_spans
+
+
+class SynchronousExporter(CloudTraceLoggingSpanExporter):
+    """The previous export path: one entries.write call per span, in the caller's thread."""
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        for span in spans:
+            span_id = format(span.get_span_context().span_id, "x")
+            span_dict = json.loads(span.to_json())
+            span_dict = self._process_large_attributes(span_dict=span_dict, span_id=span_id)
+            self.logger.log_struct(span_dict, labels=LOG_LABELS, severity="INFO")
+        return CloudTraceSpanExporter.export(self, spans)
+
+
+def run(
+    exporter_class: type[CloudTraceLoggingSpanExporter],
+    batches: list[list[ReadableSpan]],
+    args: argparse.Namespace,
+) -> None:
+    logging_client = FakeLoggingClient(latency=args.logging_latency_ms / 1000)
+    exporter = exporter_class(
+        project_id="benchmark",
+        client=FakeTraceClient(),
+        logging_client=logging_client,
+        storage_client=FakeStorageClient(),
+        max_queue_size=args.queue_size,
+        queue_full_policy=args.policy,
+    )
+    start = time.perf_counter()
+    for spans in batches:
+        exporter.export(spans)
+    export_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    exporter.force_flush()
+    flush_seconds = time.perf_counter() - start
+    exporter.shutdown()
+
+    print(
+        f"{exporter_class.__name__:<32}"
+        f"{len(batches) / export_seconds:>12.1f}"
+        f"{flush_seconds * 1000:>12.1f}"
+        f"{logging_client.requests:>10}"
+        f"{logging_client.entries:>10}"
+        f"{exporter.dropped_entries:>9}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--exports", type=int, default=50, help="number of export calls")
+    parser.add_argument("--spans-per-export", type=int, default=64, help="spans per export call")
+    parser.add_argument("--llm-request-bytes", type=int, default=4096, help="size of the LLM request attributes")
+    parser.add_argument("--logging-latency-ms", type=float, default=30, help="latency of an entries.write call")
+    parser.add_argument("--queue-size", type=int, default=2048, help="max_queue_size of the exporter")
+    parser.add_argument("--policy", choices=["drop", "block"], default="drop", help="queue_full_policy of the exporter")
+    args = parser.parse_args()
+
+    # make_spans records 5 spans per request
+    requests = make_spans(
+        args.exports * args.spans_per_export // 5 + 1,
+        llm_request_bytes=args.llm_request_bytes,
+    )
+    spans = list(itertools.chain.from_iterable(requests))
+    batches = [
+        spans[i * args.spans_per_export : (i + 1) * args.spans_per_export]
+        for i in range(args.exports)
+    ]
+
+    print(f"{'exporter':<32}{'exports/s':>12}{'flush ms':>12}{'writes':>10}{'entries':>10}{'dropped':>9}")
+    for exporter_class in (SynchronousExporter, CloudTraceLoggingSpanExporter):
+        run(exporter_class, batches, args)
+
+
+if __name__ == "__main__":
+    main()
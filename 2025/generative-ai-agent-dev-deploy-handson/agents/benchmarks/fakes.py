@@ -0,0 +1,133 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""In-memory stand-ins for the Google Cloud clients used by the telemetry code.
+
+Each remote call sleeps for a fixed latency and is counted, so that exporters can
+be benchmarked locally without a Google Cloud project.
+"""
+
+import json
+import threading
+import time
+from typing import Any
+
+
+class FakeLoggingClient:
+    """Stand-in for google.cloud.logging.Client that counts entries.write calls."""
+
+    def __init__(self, latency: float = 0.03) -> None:
+        """
+        :param latency: Seconds each entries.write call takes
+        """
+        self.latency = latency
+        self.requests = 0
+        self.entries = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def logger(self, name: str) -> "FakeLogger":
+        return FakeLogger(self, name)
+
+    def write_entries(self, entries: list[dict]) -> None:
+        time.sleep(self.latency)
+        size = sum(len(json.dumps(entry, default=str)) for entry in entries)
+        with self._lock:
+            self.requests += 1
+            self.entries += len(entries)
+            self.bytes += size
+
+
+class FakeLogger:
+    def __init__(self, client: FakeLoggingClient, name: str) -> None:
+        self.client = client
+        self.name = name
+
+    def log_struct(self, info: dict, **kwargs: Any) -> None:
+        self.client.write_entries([{"jsonPayload": info, **kwargs}])
+
+    def batch(self) -> "FakeBatch":
+        return FakeBatch(self.client)
+
+
+class FakeBatch:
+    def __init__(self, client: FakeLoggingClient) -> None:
+        self.client = client
+        self.entries: list[dict] = []
+
+    def log_struct(self, info: dict, **kwargs: Any) -> None:
+        self.entries.append({"jsonPayload": info, **kwargs})
+
+    def commit(self, **kwargs: Any) -> None:
+        entries, self.entries = self.entries, []
+        if entries:
+            self.client.write_entries(entries)
+
+
+class FakeTraceClient:
+    """Stand-in for the Cloud Trace client used by CloudTraceSpanExporter."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.requests = 0
+
+    def batch_write_spans(self, *args: Any, **kwargs: Any) -> None:
+        time.sleep(self.latency)
+        self.requests += 1
+
+
+class FakeStorageClient:
+    """Stand-in for google.cloud.storage.Client that counts requests and uploaded bytes."""
+
+    def __init__(self, latency: float = 0.05) -> None:
+        """
+        :param latency: Seconds each request takes
+        """
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def bucket(self, name: str) -> "FakeBucket":
+        return FakeBucket(self, name)
+
+    def request(self, size: int = 0) -> None:
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+
+
+class FakeBucket:
+    def __init__(self, client: FakeStorageClient, name: str) -> None:
+        self.client = client
+        self.name = name
+
+    def exists(self) -> bool:
+        self.client.request()
+        return True
+
+    def blob(self, name: str) -> "FakeBlob":
+        return FakeBlob(self.client, name)
+
+
+class FakeBlob:
+    def __init__(self, client: FakeStorageClient, name: str) -> None:
+        self.client = client
+        self.name = name
+        self.content_encoding: str | None = None
+
+    def upload_from_string(self, data: str | bytes, content_type: str = "") -> None:
+        self.client.request(len(data))
@@ -0,0 +1,100 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compare the throughput of single and batched feedback ingestion.
+
+Cloud Logging is replaced by the fake in benchmarks/fakes.py. Importing app
+resolves the default project with google.auth.default(), so application default
+credentials must be set up, but nothing is sent to Google Cloud.
+
+    python -m benchmarks.feedback_benchmark --feedbacks 2000 --logging-latency-ms 30
+"""
+
+import argparse
+import time
+from collections.abc import Callable
+
+from app.agent_engine_app import AgentEngineApp
+from app.utils.log_writer import BufferedLogWriter
+from app.utils.typing import Feedback
+from benchmarks.fakes import FakeLoggingClient
+
+
+def make_app(logging_client: FakeLoggingClient) -> AgentEngineApp:
+    # Only the feedback operations are used, so skip the agent and Vertex AI set up
+    app = object.__new__(AgentEngineApp)
+    app.logger = logging_client.logger("benchmark")
+    app.feedback_writer = BufferedLogWriter(app.logger)
+    return app
+
+
+def previous_register_feedback(app: AgentEngineApp, feedback: dict) -> None:
+    """The previous register_feedback: one entries.write call per feedback."""
+    feedback_obj = Feedback.model_validate(feedback)
+    app.logger.log_struct(feedback_obj.model_dump(), severity="INFO")
+
+
+def run(
+    name: str,
+    ingest: Callable[[AgentEngineApp, list[dict]], None],
+    feedbacks: list[dict],
+    args: argparse.Namespace,
+) -> None:
+    logging_client = FakeLoggingClient(latency=args.logging_latency_ms / 1000)
+    app = make_app(logging_client)
+    start = time.perf_counter()
+    ingest(app, feedbacks)
+    accept_seconds = time.perf_counter() - start
+    app.feedback_writer.close()
+    total_seconds = time.perf_counter() - start
+    print(
+        f"{name:<28}{len(feedbacks) / accept_seconds:>14.0f}"
+        f"{len(feedbacks) / total_seconds:>15.0f}{logging_client.requests:>9}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--feedbacks", type=int, default=1000, help="number of feedback to ingest")
+    parser.add_argument("--batch-size", type=int, default=50, help="feedback per register_feedback_batch call")
+    parser.add_argument("--logging-latency-ms", type=float, default=30, help="latency of an entries.write call")
+    args = parser.parse_args()
+
+    feedbacks = [
+        {"score": i % 5 + 1, "text": "とても役に立ちました", "invocation_id": f"e-{i:08d}", "user_id": f"u-{i % 37}"}
+        for i in range(args.feedbacks)
+    ]
+
+    def previous(app: AgentEngineApp, feedbacks: list[dict]) -> None:
+        for feedback in feedbacks:
+            previous_register_feedback(app, feedback)
+
+    def single(app: AgentEngineApp, feedbacks: list[dict]) -> None:
+        for feedback in feedbacks:
+            app.register_feedback(feedback)
+
+    def batched(app: AgentEngineApp, feedbacks: list[dict]) -> None:
+        for i in range(0, len(feedbacks), args.batch_size):
+            app.register_feedback_batch(feedbacks[i : i + args.batch_size])
+
+    # accepted/s is the rate at which the calls return, flushed/s includes the final flush
+    print(f"{'ingestion':<28}{'accepted/s':>14}{'flushed/s':>15}{'writes':>9}")
+    run("log_struct per feedback", previous, feedbacks, args)
+    run("register_feedback", single, feedbacks, args)
+    run(f"register_feedback_batch {args.batch_size}", batched, feedbacks, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Measure the bytes logged to Cloud Logging per 1k requests under sampling policies.
+
+Replays synthetic root_agent requests, a few of them failing or slow, through
+TailSamplingSpanExporter and CloudTraceLoggingSpanExporter in batches of 512 spans
+like BatchSpanProcessor. Google Cloud is replaced by the fakes in
+benchmarks/fakes.py, and application default credentials are needed to import app.
+
+    python -m benchmarks.sampling_benchmark --requests 2000 --error-rate 0.02
+"""
+
+import argparse
+import itertools
+import time
+
+from app.utils.sampling import TailSamplingSpanExporter
+from app.utils.tracing import CloudTraceLoggingSpanExporter
+from benchmarks.fakes import FakeLoggingClient, FakeStorageClient, FakeTraceClient
+from benchmarks.spans import make_spans
+
+# Name and TailSamplingSpanExporter arguments of each policy
+POLICIES = [
+    ("keep all", {}),
+    ("truncate 2048", {"max_attribute_length": 2048}),
+    ("sample 10%", {"sample_rate": 0.1}),
+    ("sample 10%, truncate 2048", {"sample_rate": 0.1, "max_attribute_length": 2048}),
+    ("sample 1%, truncate 512", {"sample_rate": 0.01, "max_attribute_length": 512}),
+]
+
+BATCH_SIZE = 512
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000, help="number of requests to replay")
+    parser.add_argument("--llm-request-bytes", type=int, default=16384, help="size of the LLM request attributes")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="fraction of failing requests")
+    parser.add_argument("--slow-rate", type=float, default=0.02, help="fraction of slow requests")
+    args = parser.parse_args()
+
+    requests = make_spans(
+        args.requests,
+        llm_request_bytes=args.llm_request_bytes,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+    )
+    spans = list(itertools.chain.from_iterable(requests))
+
+    print(f"{'policy':<28}{'traces':>8}{'MB per 1k requests':>20}{'CPU s per 1k requests':>23}")
+    for name, kwargs in POLICIES:
+        logging_client = FakeLoggingClient(latency=0)
+        exporter = TailSamplingSpanExporter(
+            CloudTraceLoggingSpanExporter(
+                project_id="benchmark",
+                client=FakeTraceClient(),
+                logging_client=logging_client,
+                storage_client=FakeStorageClient(latency=0),
+            ),
+            **kwargs,
+        )
+        start = time.process_time()
+        for i in range(0, len(spans), BATCH_SIZE):
+            exporter.export(spans[i : i + BATCH_SIZE])
+        exporter.shutdown()
+        seconds = time.process_time() - start
+
+        scale = 1000 / args.requests
+        traces = exporter.exported_traces if kwargs.get("sample_rate") else args.requests
+        print(
+            f"{name:<28}{traces:>8}"
+            f"{logging_client.bytes * scale / 1e6:>20.2f}{seconds * scale:>23.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
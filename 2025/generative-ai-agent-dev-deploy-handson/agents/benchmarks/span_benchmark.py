@@ -0,0 +1,120 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Measure the CPU time CloudTraceLoggingSpanExporter spends converting each span.
+
+Compares the previous conversion, which encoded the span with to_json, decoded it,
+encoded the attributes twice more when they were large and uploaded all of them
+uncompressed, with the current one. The CPU time includes the upload threads.
+Storage is replaced by the fake in benchmarks/fakes.py with no latency, and
+application default credentials are needed to import app.
+
+    python -m benchmarks.span_benchmark --llm-request-bytes 4096 300000
+"""
+
+import argparse
+import itertools
+import json
+import time
+from collections.abc import Callable
+
+from opentelemetry.sdk.trace import ReadableSpan
+
+from app.utils.tracing import (
+    MAX_ATTRIBUTES_SIZE,
+    CloudTraceLoggingSpanExporter,
+    estimate_json_size,
+    span_to_dict,
+)
+from benchmarks.fakes import FakeLoggingClient, FakeStorageClient, FakeTraceClient
+from benchmarks.spans import make_spans
+
+
+def previous_conversion(exporter: CloudTraceLoggingSpanExporter, span: ReadableSpan) -> dict:
+    span_dict = json.loads(span.to_json())
+    attributes = span_dict["attributes"]
+    if len(json.dumps(attributes).encode()) > MAX_ATTRIBUTES_SIZE:
+        attributes_payload = dict(attributes.items())
+        attributes_retain = dict(attributes.items())
+        exporter.storage_client.bucket(exporter.bucket_name).exists()
+        blob = exporter.bucket.blob("spans/span.json")
+        blob.upload_from_string(json.dumps(attributes_payload), "application/json")
+        attributes_retain["uri_payload"] = f"gs://{exporter.bucket_name}/spans/span.json"
+        span_dict["attributes"] = attributes_retain
+    return span_dict
+
+
+def conversion(exporter: CloudTraceLoggingSpanExporter, span: ReadableSpan) -> dict:
+    span_dict = span_to_dict(span)
+    return exporter._process_large_attributes(span_dict=span_dict, span_id="span")
+
+
+def cost_per_span(
+    convert: Callable[[CloudTraceLoggingSpanExporter, ReadableSpan], dict],
+    spans: list[ReadableSpan],
+    repeat: int,
+) -> tuple[float, float]:
+    """Return the CPU seconds and the bytes uploaded to GCS per span."""
+    storage_client = FakeStorageClient(latency=0)
+    exporter = CloudTraceLoggingSpanExporter(
+        project_id="benchmark",
+        client=FakeTraceClient(),
+        logging_client=FakeLoggingClient(),
+        storage_client=storage_client,
+    )
+    start = time.process_time()
+    for _ in range(repeat):
+        for span in spans:
+            convert(exporter, span)
+    exporter.force_flush()
+    seconds = time.process_time() - start
+    exporter.shutdown()
+    count = repeat * len(spans)
+    return seconds / count, storage_client.bytes / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sizes", type=int, nargs="*", default=[4096, 65536, 300000], help="sizes of the LLM request attributes")
+    parser.add_argument("--requests", type=int, default=50, help="number of requests, of 5 spans each")
+    parser.add_argument("--repeat", type=int, default=5, help="number of passes over the spans")
+    args = parser.parse_args()
+
+    print(
+        f"{'request bytes':>14}{'previous us/span':>18}{'current us/span':>17}"
+        f"{'previous upload B/span':>24}{'current upload B/span':>23}"
+    )
+    for size in args.sizes:
+        spans = list(itertools.chain.from_iterable(make_spans(args.requests, llm_request_bytes=size)))
+        for span in spans:
+            if span_to_dict(span) != json.loads(span.to_json()):
+                raise SystemExit(f"span_to_dict differs from to_json for {span.name}")
+            attributes = dict(span.attributes)
+            exact = len(json.dumps(attributes, ensure_ascii=False).encode())
+            if (exact > MAX_ATTRIBUTES_SIZE) != (
+                estimate_json_size(attributes, MAX_ATTRIBUTES_SIZE) > MAX_ATTRIBUTES_SIZE
+            ):
+                print(f"estimate_json_size disagrees on {span.name} ({exact} bytes)")
+
+        previous, previous_bytes = cost_per_span(previous_conversion, spans, args.repeat)
+        current, current_bytes = cost_per_span(conversion, spans, args.repeat)
+        print(
+            f"{size:>14}{previous * 1e6:>18.1f}{current * 1e6:>17.1f}"
+            f"{previous_bytes:>24.0f}{current_bytes:>23.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Synthetic spans shaped like the ones ADK records for root_agent runs."""
+
+import json
+import random
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import Status, StatusCode
+
+MODEL = "gemini-2.5-flash"
+TOOL = "get_weather"
+
+# Median latencies of the stages of a request in milliseconds
+LLM_LATENCY_MS = 800
+TOOL_LATENCY_MS = 20
+# Slow requests take this many times longer
+SLOW_FACTOR = 10
+
+
+def _llm_request(rng: random.Random, size: int) -> str:
+    """Return a JSON encoded LLM request of about size bytes."""
+    words = ["天気", "weather", "Tokyo", "forecast", "気温", "rain", "sunny", "湿度"]
+    text = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        text.append(word)
+        length += len(word.encode()) + 1
+    return json.dumps(
+        {
+            "model": MODEL,
+            "config": {"system_instruction": "あなたは親切なAIアシスタントです。"},
+            "contents": [{"role": "user", "parts": [{"text": " ".join(text)}]}],
+        },
+        ensure_ascii=False,
+    )
+
+
+def make_spans(
+    requests: int,
+    llm_request_bytes: int = 4096,
+    error_rate: float = 0.0,
+    slow_rate: float = 0.0,
+    seed: int = 0,
+) -> list[list[ReadableSpan]]:
+    """
+    Record the spans of root_agent requests: an invocation, an agent run, two LLM
+    calls and a tool call each.
+
+    :param requests: Number of requests
+    :param llm_request_bytes: Approximate size of the LLM request attributes
+    :param error_rate: Fraction of the requests whose tool call fails
+    :param slow_rate: Fraction of the requests that are SLOW_FACTOR times slower
+    :param seed: Seed of the random generator
+    :return: The finished spans of each request, children first
+    """
+    rng = random.Random(seed)
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = provider.get_tracer("gcp.vertex.agent")
+
+    def duration(median_ms: float, factor: float) -> int:
+        return int(rng.lognormvariate(0, 0.5) * median_ms * factor * 1_000_000)
+
+    result = []
+    now = 1_700_000_000_000_000_000
+    for i in range(requests):
+        factor = SLOW_FACTOR if rng.random() < slow_rate else 1
+        failed = rng.random() < error_rate
+        common = {
+            "gen_ai.system": "gcp.vertex.agent",
+            "gcp.vertex.agent.invocation_id": f"e-{i:08d}",
+            "gcp.vertex.agent.session_id": f"s-{i % 97:08d}",
+        }
+        start = now
+        invocation = tracer.start_span("invocation", start_time=start, attributes=common)
+        parent = trace.set_span_in_context(invocation)
+        agent_run = tracer.start_span(
+            "agent_run [root_agent]", context=parent, start_time=start
+        )
+        parent = trace.set_span_in_context(agent_run)
+
+        for step in range(2):
+            end = start + duration(LLM_LATENCY_MS, factor)
+            llm = tracer.start_span(
+                "call_llm",
+                context=parent,
+                start_time=start,
+                attributes={
+                    **common,
+                    "gen_ai.request.model": MODEL,
+                    "gcp.vertex.agent.event_id": f"{i:08d}-{step}",
+                    "gcp.vertex.agent.llm_request": _llm_request(rng, llm_request_bytes),
+                    "gcp.vertex.agent.llm_response": _llm_request(rng, llm_request_bytes // 8),
+                    "gen_ai.usage.input_tokens": llm_request_bytes // 4,
+                    "gen_ai.usage.output_tokens": llm_request_bytes // 32,
+                },
+            )
+            llm.end(end_time=end)
+            start = end
+            if step:
+                break
+            end = start + duration(TOOL_LATENCY_MS, factor)
+            tool = tracer.start_span(
+                f"execute_tool {TOOL}",
+                context=parent,
+                start_time=start,
+                attributes={
+                    **common,
+                    "gen_ai.tool.name": TOOL,
+                    "gcp.vertex.agent.tool_call_args": json.dumps({"query": "Tokyo"}),
+                    "gcp.vertex.agent.tool_response": json.dumps(
+                        {"result": "気温は90度で晴れです。"}, ensure_ascii=False
+                    ),
+                },
+            )
+            if failed:
+                tool.set_status(Status(StatusCode.ERROR, "tool call failed"))
+            tool.end(end_time=end)
+            start = end
+
+        agent_run.end(end_time=start)
+        invocation.end(end_time=start)
+        now = start
+        result.append(list(exporter.get_finished_spans()))
+        exporter.clear()
+    return result